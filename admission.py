@@ -0,0 +1,215 @@
+"""
+Admission control shared by the main API and the AI server: per-route concurrency
+limits with a bounded, deadline-ordered wait queue, and per-client token buckets
+"""
+import math
+import time
+import heapq
+import asyncio
+import itertools
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+
+from fastapi import FastAPI
+from fastapi.responses import JSONResponse
+from prometheus_client import Counter, Histogram
+
+from metrics import LATENCY_BUCKETS, QUEUE_DEPTH
+
+# Seconds a caller is willing to wait overall; lets servers drop work the caller will abandon
+TIMEOUT_HEADER = "X-Request-Timeout"
+CLIENT_ID_HEADER = "X-Client-ID"
+
+ADMISSION_REJECTED = Counter(
+    "admission_rejected_total",
+    "Requests turned away by admission control",
+    ["route", "reason"]
+)
+ADMISSION_WAIT = Histogram(
+    "admission_wait_seconds",
+    "Time admitted requests spent in the wait queue",
+    ["route"],
+    buckets=LATENCY_BUCKETS
+)
+
+class Rejected(Exception):
+    def __init__(self, status_code: int, reason: str, retry_after: float):
+        super().__init__(reason)
+        self.status_code = status_code
+        self.reason = reason
+        self.retry_after = retry_after
+
+class ConcurrencyLimiter:
+    """At most max_concurrent requests run; up to max_queue wait, earliest deadline first
+
+    A request is rejected straight away when the queue is full or when the
+    expected wait (queue length times the recent service time) already exceeds
+    its deadline, so an overloaded server answers in milliseconds instead of
+    letting everyone time out together.
+    """
+
+    def __init__(self, max_concurrent: int, max_queue: int, max_wait_seconds: float):
+        self.max_concurrent = max(1, max_concurrent)
+        self.max_queue = max(0, max_queue)
+        self.max_wait_seconds = max_wait_seconds
+        self.active = 0
+        self.waiting = 0
+        self.service_seconds: Optional[float] = None
+        self._waiters: list = []  # heap of (deadline, sequence, future)
+        self._sequence = itertools.count()
+
+    def expected_wait(self) -> float:
+        """Rough time until a newly queued request would start"""
+        service = self.service_seconds or 1.0
+        return service * (self.waiting + 1) / self.max_concurrent
+
+    def observe(self, seconds: float):
+        """Feed back how long an admitted request took (exponentially weighted)"""
+        self.service_seconds = seconds if self.service_seconds is None else 0.8 * self.service_seconds + 0.2 * seconds
+
+    async def acquire(self, deadline: float):
+        """Take a slot before the (monotonic) deadline or raise Rejected"""
+        if self.active < self.max_concurrent and not self.waiting:
+            self.active += 1
+            return
+        retry_after = self.expected_wait()
+        if self.waiting >= self.max_queue:
+            raise Rejected(503, "queue_full", retry_after)
+        remaining = min(deadline - time.monotonic(), self.max_wait_seconds)
+        if retry_after > remaining:
+            raise Rejected(503, "deadline", retry_after)
+
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (deadline, next(self._sequence), future))
+        self.waiting += 1
+        try:
+            await asyncio.wait_for(future, timeout=remaining)
+        except asyncio.TimeoutError:
+            raise Rejected(503, "timeout", self.expected_wait())
+        except asyncio.CancelledError:
+            # The caller went away just as a slot was handed over: pass it on
+            if future.done() and not future.cancelled():
+                self.release()
+            raise
+        finally:
+            self.waiting -= 1
+            if len(self._waiters) > 2 * self.max_queue + 16:
+                self._waiters = [entry for entry in self._waiters if not entry[2].done()]
+                heapq.heapify(self._waiters)
+
+    def release(self):
+        # Hand the slot straight to the most urgent live waiter
+        while self._waiters:
+            _, _, future = heapq.heappop(self._waiters)
+            if not future.done():
+                future.set_result(None)
+                return
+        self.active -= 1
+
+class TokenBucketLimiter:
+    """Per-client token buckets: rate requests per second with bursts up to burst"""
+
+    def __init__(self, rate: float, burst: float, max_clients: int = 10000):
+        self.rate = rate
+        self.burst = max(1.0, burst)
+        self.max_clients = max_clients
+        self._buckets: "OrderedDict[str, Tuple[float, float]]" = OrderedDict()
+
+    def take(self, client: str) -> float:
+        """Spend one token; returns 0 if allowed, else seconds until a token is available"""
+        now = time.monotonic()
+        tokens, updated = self._buckets.pop(client, (self.burst, now))
+        tokens = min(self.burst, tokens + (now - updated) * self.rate)
+        wait = 0.0
+        if tokens >= 1:
+            tokens -= 1
+        else:
+            wait = (1 - tokens) / self.rate
+        self._buckets[client] = (tokens, now)
+        while len(self._buckets) > self.max_clients:
+            self._buckets.popitem(last=False)
+        return wait
+
+def parse_limits(spec: str, defaults: Dict[str, Tuple[int, int]]) -> Dict[str, Tuple[int, int]]:
+    """Merge "route=concurrency:queue,..." overrides into the default per-route limits"""
+    limits = dict(defaults)
+    for item in filter(None, (part.strip() for part in spec.split(","))):
+        route, _, values = item.partition("=")
+        concurrency, _, queue = values.partition(":")
+        limits[route.strip()] = (int(concurrency), int(queue or concurrency))
+    return limits
+
+class AdmissionMiddleware:
+    """ASGI middleware (not BaseHTTPMiddleware) so a slot stays held until a streamed body ends"""
+
+    def __init__(
+        self,
+        app,
+        limiters: Dict[str, ConcurrencyLimiter],
+        rate_limiter: Optional[TokenBucketLimiter] = None
+    ):
+        self.app = app
+        self.limiters = limiters
+        self.rate_limiter = rate_limiter
+
+    async def _reject(self, scope, receive, send, route: str, error: Rejected):
+        ADMISSION_REJECTED.labels(route, error.reason).inc()
+        message = "Too many requests" if error.status_code == 429 else "Server is at capacity"
+        response = JSONResponse(
+            {"detail": f"{message}, retry later", "reason": error.reason},
+            status_code=error.status_code,
+            headers={"Retry-After": str(max(1, math.ceil(error.retry_after)))}
+        )
+        await response(scope, receive, send)
+
+    async def __call__(self, scope, receive, send):
+        route = scope.get("path", "")
+        limiter = self.limiters.get(route) if scope["type"] == "http" else None
+        if limiter is None:
+            await self.app(scope, receive, send)
+            return
+
+        headers = {key.decode("latin-1").lower(): value.decode("latin-1") for key, value in scope.get("headers", [])}
+        if self.rate_limiter is not None:
+            client = headers.get(CLIENT_ID_HEADER.lower()) or (scope.get("client") or ("unknown",))[0]
+            wait = self.rate_limiter.take(client)
+            if wait > 0:
+                await self._reject(scope, receive, send, route, Rejected(429, "rate_limited", wait))
+                return
+
+        start = time.monotonic()
+        try:
+            timeout = float(headers.get(TIMEOUT_HEADER.lower(), limiter.max_wait_seconds))
+        except ValueError:
+            timeout = limiter.max_wait_seconds
+        try:
+            await limiter.acquire(start + timeout)
+        except Rejected as error:
+            await self._reject(scope, receive, send, route, error)
+            return
+
+        admitted = time.monotonic()
+        ADMISSION_WAIT.labels(route).observe(admitted - start)
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            limiter.release()
+            limiter.observe(time.monotonic() - admitted)
+
+def install_admission_control(
+    app: FastAPI,
+    limits: Dict[str, Tuple[int, int]],
+    max_wait_seconds: float,
+    rate_per_second: float = 0.0,
+    burst: float = 0.0
+):
+    """Limit concurrency per route path (route -> (max concurrent, max queued)) and optionally rate-limit clients"""
+    limiters = {
+        route: ConcurrencyLimiter(concurrency, queue, max_wait_seconds)
+        for route, (concurrency, queue) in limits.items()
+    }
+    for route, limiter in limiters.items():
+        QUEUE_DEPTH.labels(f"admission:{route}").set_function(lambda limiter=limiter: limiter.waiting)
+    rate_limiter = TokenBucketLimiter(rate_per_second, burst or rate_per_second) if rate_per_second > 0 else None
+    app.add_middleware(AdmissionMiddleware, limiters=limiters, rate_limiter=rate_limiter)
+    return limiters
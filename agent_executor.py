@@ -0,0 +1,243 @@
+"""
+Dependency-aware task graph executor for multi-step agent requests
+"""
+import time
+import asyncio
+import logging
+from typing import List, Dict, Any, Optional, Callable, Awaitable, Iterable
+
+logger = logging.getLogger(__name__)
+
+Runner = Callable[["Step", Dict[str, Any]], Awaitable[Any]]
+Listener = Callable[[Dict[str, Any]], Awaitable[None]]
+
+class BudgetExceeded(Exception):
+    pass
+
+class Budget:
+    """Per-request limits on LLM calls and wall time"""
+
+    def __init__(self, max_llm_calls: int, max_seconds: float):
+        self.max_llm_calls = max_llm_calls
+        self.max_seconds = max_seconds
+        self.llm_calls = 0
+        self.started_at = time.monotonic()
+
+    def elapsed_seconds(self) -> float:
+        return time.monotonic() - self.started_at
+
+    def remaining_seconds(self) -> float:
+        return max(0.0, self.max_seconds - self.elapsed_seconds())
+
+    def charge_llm_call(self):
+        """Count one LLM call, or raise if the request is out of calls or time"""
+        if self.llm_calls >= self.max_llm_calls:
+            raise BudgetExceeded(f"LLM call budget of {self.max_llm_calls} exhausted")
+        if self.remaining_seconds() <= 0:
+            raise BudgetExceeded(f"Time budget of {self.max_seconds}s exhausted")
+        self.llm_calls += 1
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "llm_calls": self.llm_calls,
+            "max_llm_calls": self.max_llm_calls,
+            "elapsed_seconds": round(self.elapsed_seconds(), 3),
+            "max_seconds": self.max_seconds
+        }
+
+class Step:
+    """One node of the plan: an action, the steps it waits for and the files it touches"""
+
+    def __init__(
+        self,
+        step_id: str,
+        action: str,
+        payload: Optional[Dict[str, Any]] = None,
+        depends_on: Iterable[str] = (),
+        reads: Iterable[str] = (),
+        writes: Iterable[str] = ()
+    ):
+        self.id = step_id
+        self.action = action
+        self.payload = payload or {}
+        self.depends_on = set(depends_on)
+        self.reads = set(reads)
+        self.writes = set(writes)
+        self.status = "pending"  # pending, running, done, failed, skipped
+        self.result: Any = None
+        self.error: Optional[str] = None
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "id": self.id,
+            "action": self.action,
+            "payload": self.payload,
+            "depends_on": sorted(self.depends_on),
+            "status": self.status,
+            "result": self.result,
+            "error": self.error,
+            "seconds": round(self.finished_at - self.started_at, 3) if self.started_at and self.finished_at else None
+        }
+
+class TaskGraph:
+    """Steps plus their ordering constraints
+
+    Besides explicit depends_on edges, steps that touch the same file are
+    ordered as listed: a writer waits for earlier readers and writers of the
+    file, a reader waits for the earlier writer. Steps on different files
+    stay independent and can run concurrently.
+    """
+
+    def __init__(self, steps: List[Step]):
+        self.steps: Dict[str, Step] = {}
+        for step in steps:
+            if step.id in self.steps:
+                raise ValueError(f"Duplicate step id: {step.id}")
+            self.steps[step.id] = step
+        for step in steps:
+            unknown = step.depends_on - set(self.steps)
+            if unknown:
+                raise ValueError(f"Step {step.id} depends on unknown steps: {sorted(unknown)}")
+
+        last_writer: Dict[str, str] = {}
+        readers: Dict[str, List[str]] = {}
+        for step in steps:
+            implicit = set()
+            for path in step.reads | step.writes:
+                if path in last_writer:
+                    implicit.add(last_writer[path])
+            for path in step.writes:
+                implicit.update(readers.get(path, []))
+            step.depends_on |= implicit - {step.id}
+            for path in step.reads:
+                readers.setdefault(path, []).append(step.id)
+            for path in step.writes:
+                last_writer[path] = step.id
+                readers[path] = []
+
+        self._check_acyclic()
+
+    def _check_acyclic(self):
+        waiting = {step_id: len(step.depends_on) for step_id, step in self.steps.items()}
+        dependents: Dict[str, List[str]] = {}
+        for step in self.steps.values():
+            for dependency in step.depends_on:
+                dependents.setdefault(dependency, []).append(step.id)
+        ready = [step_id for step_id, count in waiting.items() if count == 0]
+        visited = 0
+        while ready:
+            step_id = ready.pop()
+            visited += 1
+            for dependent in dependents.get(step_id, []):
+                waiting[dependent] -= 1
+                if waiting[dependent] == 0:
+                    ready.append(dependent)
+        if visited != len(self.steps):
+            raise ValueError("Plan has a dependency cycle")
+
+    def to_dict(self) -> List[Dict[str, Any]]:
+        return [step.to_dict() for step in self.steps.values()]
+
+class TaskGraphExecutor:
+    """Run a TaskGraph with bounded concurrency, stopping at the budget's deadline
+
+    runners maps an action to a coroutine taking the step and the results of
+    the steps it depends on. A failed step skips everything downstream of it;
+    a runner raising BudgetExceeded skips the step instead of failing it.
+    """
+
+    def __init__(
+        self,
+        runners: Dict[str, Runner],
+        budget: Budget,
+        max_parallel: int = 4,
+        on_event: Optional[Listener] = None
+    ):
+        self.runners = runners
+        self.budget = budget
+        self.max_parallel = max(1, max_parallel)
+        self.on_event = on_event
+
+    async def _emit(self, step: Step):
+        if self.on_event is None:
+            return
+        try:
+            await self.on_event({"type": "step", "data": step.to_dict()})
+        except Exception as e:
+            logger.warning(f"Step progress listener failed: {e}")
+
+    async def _run_step(self, step: Step, graph: TaskGraph) -> Any:
+        runner = self.runners.get(step.action)
+        if runner is None:
+            raise ValueError(f"Unknown action: {step.action}")
+        inputs = {dependency: graph.steps[dependency].result for dependency in step.depends_on}
+        return await runner(step, inputs)
+
+    async def run(self, graph: TaskGraph) -> TaskGraph:
+        running: Dict[asyncio.Task, Step] = {}
+        try:
+            while True:
+                # Anything downstream of a failure can never run
+                for step in graph.steps.values():
+                    if step.status == "pending" and any(
+                        graph.steps[dependency].status in ("failed", "skipped") for dependency in step.depends_on
+                    ):
+                        step.status = "skipped"
+                        step.error = "A step it depends on did not complete"
+                        await self._emit(step)
+
+                ready = [
+                    step for step in graph.steps.values()
+                    if step.status == "pending" and all(graph.steps[dependency].status == "done" for dependency in step.depends_on)
+                ]
+                for step in ready[:self.max_parallel - len(running)]:
+                    step.status = "running"
+                    step.started_at = time.monotonic()
+                    running[asyncio.create_task(self._run_step(step, graph))] = step
+                    await self._emit(step)
+
+                if not running:
+                    break
+
+                finished, _ = await asyncio.wait(
+                    running,
+                    timeout=self.budget.remaining_seconds(),
+                    return_when=asyncio.FIRST_COMPLETED
+                )
+                if not finished:
+                    break  # out of time; the finally block cancels what is still running
+
+                for task in finished:
+                    step = running.pop(task)
+                    step.finished_at = time.monotonic()
+                    error = task.exception()
+                    if error is None:
+                        step.status = "done"
+                        step.result = task.result()
+                    elif isinstance(error, BudgetExceeded):
+                        step.status = "skipped"
+                        step.error = str(error)
+                    else:
+                        step.status = "failed"
+                        step.error = str(error) or type(error).__name__
+                        logger.warning(f"Agent step {step.id} ({step.action}) failed: {step.error}")
+                    await self._emit(step)
+        finally:
+            for task, step in running.items():
+                task.cancel()
+                step.status = "skipped"
+                step.error = f"Time budget of {self.budget.max_seconds}s exhausted"
+                step.finished_at = time.monotonic()
+            if running:
+                await asyncio.gather(*running, return_exceptions=True)
+                for step in running.values():
+                    await self._emit(step)
+
+        for step in graph.steps.values():
+            if step.status == "pending":
+                step.status = "skipped"
+                step.error = step.error or "Budget exhausted before the step could start"
+                await self._emit(step)
+        return graph
@@ -4,13 +4,38 @@ AI Server using transformers library for real model inference
 """
 import os
 import json
+import math
+import time
+import uuid
+import base64
+import asyncio
+import hashlib
 import logging
-from typing import Dict, Any, List
+import queue
+import threading
+from contextlib import AsyncExitStack
+from collections import OrderedDict
+from typing import Dict, Any, List, Optional, Tuple, AsyncIterator, Union
 from fastapi import FastAPI, HTTPException
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
-import torch
-from transformers import AutoTokenizer, AutoModelForCausalLM, pipeline
 import uvicorn
+try:
+    import torch
+    from transformers import AutoTokenizer, AutoModelForCausalLM, TextIteratorStreamer, LogitsProcessorList, StoppingCriteriaList
+except ImportError:
+    # Only the fake benchmarking model (MODEL_NAME=fake) works without these
+    torch = None
+from prometheus_client import Counter, Gauge, Histogram
+
+from tracing import install_profiling, install_tracing
+from metrics import instrument_app, record_cache, stage
+from admission import install_admission_control, parse_limits
+from model_registry import ModelRegistry, ModelSpec, load_model_specs, memory_budget_from_env
+from embeddings import EMBEDDING_MODEL_NAME, EmbeddingBatcher, EmbeddingCache, load_embedding_backend
+from structured_output import (
+    JsonSchemaLogitsProcessor, example_instance, response_format_schema, schema_instructions
+)
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -19,10 +44,55 @@ logger = logging.getLogger(__name__)
 # Initialize FastAPI app
 app = FastAPI(title="Local AI Server", version="1.0.0")
 
-# Global variables for model and tokenizer
-model = None
-tokenizer = None
-generator = None
+# Per-route latency histograms and the /metrics endpoint
+instrument_app(app)
+
+# Request-id propagation, opt-in Server-Timing spans and /admin/profile
+install_tracing(app)
+install_profiling(app)
+
+# Bounded concurrency for generation; overflow waits in a short queue or gets 503 + Retry-After
+admission_limiters = install_admission_control(
+    app,
+    parse_limits(os.getenv("ADMISSION_LIMITS", ""), {
+        "/v1/chat/completions": (
+            int(os.getenv("GENERATION_CONCURRENCY", "2")),
+            int(os.getenv("GENERATION_QUEUE", "32"))
+        ),
+        # Embedding requests are cheap to hold; the batcher merges them into model calls
+        "/v1/embeddings": (64, 256)
+    }),
+    max_wait_seconds=float(os.getenv("ADMISSION_MAX_WAIT_SECONDS", "60")),
+    rate_per_second=float(os.getenv("RATE_LIMIT_PER_SECOND", "0")),
+    burst=float(os.getenv("RATE_LIMIT_BURST", "0"))
+)
+
+GENERATIONS_IN_FLIGHT = Gauge(
+    "generations_in_flight",
+    "Chat completions currently generating"
+)
+PROMPT_TOKENS = Counter("prompt_tokens_total", "Prompt tokens processed")
+GENERATED_TOKENS = Counter("generated_tokens_total", "Completion tokens generated")
+TOKENS_PER_SECOND = Histogram(
+    "generation_tokens_per_second",
+    "Decode throughput per completion",
+    buckets=(1, 2, 5, 10, 20, 50, 100, 200, 500, 1000)
+)
+
+# Configured models, loaded on demand (see load_model_registry)
+registry: Optional[ModelRegistry] = None
+# With neither MODELS nor MODEL_NAME set, a model that cannot load gets a canned reply instead of a 503
+canned_fallback = not os.getenv("MODELS") and not os.getenv("MODEL_NAME")
+
+# Embedding model for /v1/embeddings, loaded on the first request
+embedding_batcher: Optional[EmbeddingBatcher] = None
+embedding_load_lock = asyncio.Lock()
+embedding_cache = EmbeddingCache(int(os.getenv("EMBEDDING_CACHE_ENTRIES", "50000")))
+
+max_model_length = int(os.getenv("MAX_MODEL_LENGTH", "4096"))
+# A streamed generation that produces no text for this long is stopped and reported as failed
+stream_token_timeout = float(os.getenv("STREAM_TOKEN_TIMEOUT_SECONDS", "120"))
+token_cache_size = int(os.getenv("TOKEN_CACHE_SIZE", "2048"))
 
 class ChatMessage(BaseModel):
     role: str
@@ -33,70 +103,323 @@ class ChatRequest(BaseModel):
     messages: List[ChatMessage]
     max_tokens: int = 1000
     temperature: float = 0.7
+    stream: bool = False
+    # {"type": "json_object"} or {"type": "json_schema", "json_schema": {"schema": {...}}}
+    response_format: Optional[Dict[str, Any]] = None
 
 class ChatResponse(BaseModel):
     choices: List[Dict[str, Any]]
+    usage: Optional[Dict[str, int]] = None
+
+class EmbeddingRequest(BaseModel):
+    input: Union[str, List[str]]
+    model: Optional[str] = None
+    encoding_format: str = "float"  # or "base64": little-endian float32, much smaller than JSON floats
+
+# Fallback format used when the tokenizer ships without a chat template
+FALLBACK_ROLE_WRAPPERS = {
+    "system": ("### System:\n", "\n\n"),
+    "user": ("### User:\n", "\n\n"),
+    "assistant": ("### Assistant:\n", "\n\n"),
+}
+FALLBACK_GENERATION_PROMPT = "### Assistant:\n"
+
+# Placeholder content used to discover how the chat template wraps each role
+_TEMPLATE_SENTINEL = "\u2063SENTINEL\u2063"
+
+class PromptTooLong(ValueError):
+    """The system prompt and the latest turn alone exceed the prompt token budget"""
+
+class TokenCache:
+    """LRU cache of token ids keyed by a hash of the rendered text segment"""
+
+    def __init__(self, tokenizer, max_entries: int = 2048):
+        self.tokenizer = tokenizer
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, List[int]]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def encode(self, text: str) -> List[int]:
+        """Return token ids for text, tokenizing only on a cache miss"""
+        key = hashlib.sha256(text.encode("utf-8")).hexdigest()
+        ids = self._entries.get(key)
+        if ids is not None:
+            self._entries.move_to_end(key)
+            self.hits += 1
+            record_cache("prompt_tokens", True)
+            return ids
+
+        self.misses += 1
+        record_cache("prompt_tokens", False)
+        ids = self.tokenizer.encode(text, add_special_tokens=False)
+        self._entries[key] = ids
+        if len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+        return ids
+
+class PromptRenderer:
+    """Render chat messages to token ids, one cached segment per message
+
+    The tokenizer's chat template is probed once with a sentinel message per
+    role to learn the text it wraps around each turn. If concatenating those
+    wrappers reproduces the template's own output, every message is rendered
+    and tokenized on its own so repeated system prompts and earlier turns of a
+    conversation come straight from the cache. Templates that do not compose
+    this way are rendered whole, and tokenizers without a template use the
+    fallback format above.
+    """
+
+    def __init__(self, tokenizer, cache: TokenCache):
+        self.tokenizer = tokenizer
+        self.cache = cache
+        self.head = ""
+        self.generation_prompt = FALLBACK_GENERATION_PROMPT
+        self.role_wrappers: Dict[str, Tuple[str, str]] = dict(FALLBACK_ROLE_WRAPPERS)
+        self.mode = "fallback"
+
+        if getattr(tokenizer, "chat_template", None):
+            try:
+                self._probe_template()
+            except Exception as e:
+                logger.warning(f"Chat template could not be segmented, rendering whole prompts: {e}")
+                self.mode = "template"
+        logger.info(f"Prompt rendering mode: {self.mode}")
+
+    def _apply_template(self, messages: List[Dict[str, str]], add_generation_prompt: bool = False) -> str:
+        return self.tokenizer.apply_chat_template(
+            messages,
+            tokenize=False,
+            add_generation_prompt=add_generation_prompt
+        )
+
+    def _probe_template(self):
+        """Learn the template head, per-role wrappers and generation prompt"""
+        user_turn = {"role": "user", "content": _TEMPLATE_SENTINEL}
+        assistant_turn = {"role": "assistant", "content": _TEMPLATE_SENTINEL}
+
+        # An assistant turn rendered after a user turn carries no head text
+        first = self._apply_template([user_turn])
+        pair = self._apply_template([user_turn, assistant_turn])
+        if not pair.startswith(first):
+            raise ValueError("template output is not append-only")
+        assistant_block = pair[len(first):]
+        lone_assistant = self._apply_template([assistant_turn])
+        if not lone_assistant.endswith(assistant_block):
+            raise ValueError("template head could not be isolated")
+        self.head = lone_assistant[:len(lone_assistant) - len(assistant_block)]
+
+        wrappers = {}
+        for role in ("system", "user", "assistant"):
+            rendered = self._apply_template([{"role": role, "content": _TEMPLATE_SENTINEL}])
+            if not rendered.startswith(self.head):
+                raise ValueError(f"{role} turn does not start with the template head")
+            prefix, sep, suffix = rendered[len(self.head):].partition(_TEMPLATE_SENTINEL)
+            if not sep:
+                raise ValueError(f"template drops {role} content")
+            wrappers[role] = (prefix, suffix)
+        self.role_wrappers = wrappers
+
+        # Surrounding whitespace in the probe catches templates that trim content
+        probe = [
+            {"role": "system", "content": " a\n"},
+            {"role": "user", "content": " b\n"},
+            {"role": "assistant", "content": " c\n"},
+            {"role": "user", "content": " d\n"},
+        ]
+        without_prompt = self._apply_template(probe)
+        with_prompt = self._apply_template(probe, add_generation_prompt=True)
+        if not with_prompt.startswith(without_prompt):
+            raise ValueError("generation prompt is not a suffix")
+        self.generation_prompt = with_prompt[len(without_prompt):]
+
+        if self._join_segments(probe) != without_prompt:
+            raise ValueError("per-message wrappers do not reproduce the template output")
+        self.mode = "segmented"
+
+    def _segments(self, messages: List[Dict[str, str]]) -> List[str]:
+        segments = [self.head] if self.head else []
+        for message in messages:
+            prefix, suffix = self.role_wrappers.get(message["role"], self.role_wrappers["user"])
+            segments.append(f"{prefix}{message['content']}{suffix}")
+        return segments
 
-def load_model():
-    """Load the AI model and tokenizer"""
-    global model, tokenizer, generator
+    def _join_segments(self, messages: List[Dict[str, str]]) -> str:
+        return "".join(self._segments(messages))
+
+    def render_text(self, messages: List[Dict[str, str]]) -> str:
+        """Render messages to the prompt text, including the generation prompt"""
+        if self.mode == "template":
+            return self._apply_template(messages, add_generation_prompt=True)
+        return self._join_segments(messages) + self.generation_prompt
+
+    def _render_all_ids(self, messages: List[Dict[str, str]]) -> List[int]:
+        if self.mode == "template":
+            return list(self.cache.encode(self.render_text(messages)))
+        ids = []
+        for segment in self._segments(messages):
+            ids.extend(self.cache.encode(segment))
+        ids.extend(self.cache.encode(self.generation_prompt))
+        return ids
+
+    def render_ids(self, messages: List[Dict[str, str]], max_prompt_tokens: Optional[int] = None) -> List[int]:
+        """Render messages to token ids, reusing cached segments
+
+        When the prompt exceeds max_prompt_tokens, whole turns are dropped,
+        oldest first, and the prompt is rendered again. Leading system messages
+        and the latest turn are always kept (raises PromptTooLong if they alone
+        do not fit), and the kept history starts at a user turn so templates
+        that require alternating roles still render.
+        """
+        ids = self._render_all_ids(messages)
+        if max_prompt_tokens is None or len(ids) <= max_prompt_tokens:
+            return ids
+
+        leading = 0
+        while leading < len(messages) and messages[leading]["role"] == "system":
+            leading += 1
+        system, history = messages[:leading], messages[leading:]
+        while len(ids) > max_prompt_tokens:
+            if len(history) <= 1:
+                raise PromptTooLong(
+                    f"Prompt needs {len(ids)} tokens with only the system prompt and latest message, "
+                    f"but at most {max_prompt_tokens} fit"
+                )
+            history = history[1:]
+            while len(history) > 1 and history[0]["role"] != "user":
+                history = history[1:]
+            ids = self._render_all_ids(system + history)
+        return ids
+
+class FakeModel:
+    """Deterministic stand-in model for benchmarking the serving stack offline
+
+    Enabled with MODEL_NAME=fake. Each completion waits FAKE_PREFILL_MS, then
+    emits tokens at FAKE_TOKENS_PER_SECOND. The text is derived from a hash of
+    the messages, so the same request always gets the same answer.
+    """
+
+    VOCABULARY = [
+        "def", "return", "value", "result", "for", "item", "in", "items", "if", "not",
+        "None", "self", "config", "data", "print", "import", "class", "update", "index", "path",
+    ]
+
+    def __init__(self, tokens_per_second: float, prefill_seconds: float, completion_tokens: int):
+        self.tokens_per_second = tokens_per_second
+        self.prefill_seconds = prefill_seconds
+        self.completion_tokens = completion_tokens
+
+    def tokens(self, messages: List[Dict[str, str]], max_tokens: int) -> List[str]:
+        seed = int(hashlib.sha256(json.dumps(messages, sort_keys=True).encode("utf-8")).hexdigest()[:8], 16)
+        count = min(max_tokens, self.completion_tokens)
+        return [self.VOCABULARY[(seed + i * 7919) % len(self.VOCABULARY)] + " " for i in range(count)]
+
+    async def complete(self, messages: List[Dict[str, str]], max_tokens: int) -> str:
+        tokens = self.tokens(messages, max_tokens)
+        await asyncio.sleep(self.prefill_seconds + len(tokens) / self.tokens_per_second)
+        return "".join(tokens).strip()
+
+    async def stream(self, messages: List[Dict[str, str]], max_tokens: int) -> AsyncIterator[str]:
+        # Sleep until each token's due time so timer overhead does not accumulate
+        loop = asyncio.get_running_loop()
+        start = loop.time() + self.prefill_seconds
+        for i, token in enumerate(self.tokens(messages, max_tokens)):
+            await asyncio.sleep(max(0.0, start + (i + 1) / self.tokens_per_second - loop.time()))
+            yield token
+
+class LoadedModel:
+    """A model ready to serve: weights, tokenizer and prompt renderer, or the fake model"""
+
+    def __init__(self, model=None, tokenizer=None, prompt_renderer=None, fake=None):
+        self.model = model
+        self.tokenizer = tokenizer
+        self.prompt_renderer = prompt_renderer
+        self.fake = fake
+
+def load_model(spec: ModelSpec) -> Tuple[LoadedModel, int]:
+    """Load one model and its tokenizer; returns it with its memory footprint in bytes"""
+    if spec.source == "fake":
+        fake_model = FakeModel(
+            tokens_per_second=float(os.getenv("FAKE_TOKENS_PER_SECOND", "50")),
+            prefill_seconds=float(os.getenv("FAKE_PREFILL_MS", "200")) / 1000,
+            completion_tokens=int(os.getenv("FAKE_COMPLETION_TOKENS", "128"))
+        )
+        logger.info(f"Using fake model for {spec.id}: {vars(fake_model)}")
+        return LoadedModel(fake=fake_model), 0
+    if torch is None:
+        raise RuntimeError("torch and transformers are required to load a real model")
     
-    try:
-        model_name = os.getenv("MODEL_NAME", "microsoft/DialoGPT-medium")
-        # Use a coding-focused model if available
-        if "Kimi" in model_name:
-            model_name = "microsoft/CodeGPT-small-py"  # Fallback to a coding model
-        logger.info(f"Loading model: {model_name}")
-        
-        # Check if we have a GPU available
-        device = "cuda" if torch.cuda.is_available() else "cpu"
-        logger.info(f"Using device: {device}")
-        
-        # Load tokenizer and model
-        tokenizer = AutoTokenizer.from_pretrained(model_name)
-        
-        # Add pad token if it doesn't exist
-        if tokenizer.pad_token is None:
-            tokenizer.pad_token = tokenizer.eos_token
-        
-        # Load model with appropriate settings
-        if device == "cuda":
-            model = AutoModelForCausalLM.from_pretrained(
-                model_name,
-                torch_dtype=torch.float16,
-                device_map="auto",
-                trust_remote_code=True
-            )
-        else:
-            model = AutoModelForCausalLM.from_pretrained(
-                model_name,
-                torch_dtype=torch.float32,
-                trust_remote_code=True
-            )
-            model = model.to(device)
-        
-        # Create text generation pipeline
-        generator = pipeline(
-            "text-generation",
-            model=model,
-            tokenizer=tokenizer,
-            device=0 if device == "cuda" else -1,
-            torch_dtype=torch.float16 if device == "cuda" else torch.float32
+    # Use a coding-focused model if available
+    model_name = spec.source
+    if "Kimi" in model_name:
+        model_name = "microsoft/CodeGPT-small-py"  # Fallback to a coding model
+    logger.info(f"Loading model {spec.id}: {model_name}")
+    
+    # Check if we have a GPU available
+    device = "cuda" if torch.cuda.is_available() else "cpu"
+    logger.info(f"Using device: {device}")
+    
+    # Load tokenizer and model
+    tokenizer = AutoTokenizer.from_pretrained(model_name)
+    
+    # Add pad token if it doesn't exist
+    if tokenizer.pad_token is None:
+        tokenizer.pad_token = tokenizer.eos_token
+    
+    # Load model with appropriate settings
+    if device == "cuda":
+        model = AutoModelForCausalLM.from_pretrained(
+            model_name,
+            torch_dtype=torch.float16,
+            device_map="auto",
+            trust_remote_code=True
         )
-        
-        logger.info("Model loaded successfully!")
-        return True
-        
-    except Exception as e:
-        logger.error(f"Failed to load model: {str(e)}")
-        return False
+    else:
+        model = AutoModelForCausalLM.from_pretrained(
+            model_name,
+            torch_dtype=torch.float32,
+            trust_remote_code=True
+        )
+        model = model.to(device)
+    model.eval()
+    
+    # Prepare chat prompt rendering with cached tokenization
+    prompt_renderer = PromptRenderer(tokenizer, TokenCache(tokenizer, token_cache_size))
+    return LoadedModel(model, tokenizer, prompt_renderer), model.get_memory_footprint()
+
+def unload_model(loaded: LoadedModel):
+    """Drop a model's weights and hand freed GPU memory back to the allocator"""
+    loaded.model = None
+    if torch is not None and torch.cuda.is_available():
+        import gc
+        gc.collect()
+        torch.cuda.empty_cache()
 
-# Initialize model on startup
+def load_model_registry() -> ModelRegistry:
+    """Models from MODELS (inline JSON or a file path), else MODEL_NAME as the only model"""
+    specs, single_model = load_model_specs(
+        os.getenv("MODELS", ""),
+        os.getenv("MODEL_NAME", "microsoft/DialoGPT-medium")
+    )
+    return ModelRegistry(
+        specs,
+        loader=load_model,
+        unloader=unload_model,
+        memory_budget_bytes=memory_budget_from_env(),
+        fallback_to_default=single_model
+    )
+
+# Initialize models on startup
 def initialize_model():
-    """Initialize the model"""
-    success = load_model()
-    if not success:
-        logger.warning("Model loading failed, but server will continue with fallback responses")
+    """Build the registry and load pinned models"""
+    global registry
+    registry = load_model_registry()
+    registry.preload()
+    if not any(entry.state == "loaded" for entry in registry.entries.values()):
+        logger.warning("No model loaded at startup; models load on first request or fall back to canned responses")
 
 # Load model when module is imported
 initialize_model()
@@ -104,65 +427,384 @@ initialize_model()
 @app.get("/health")
 async def health_check():
     """Health check endpoint"""
-    return {"status": "healthy", "model_loaded": model is not None}
+    default = registry.entries[registry.default_id]
+    generation_limiter = admission_limiters.get("/v1/chat/completions")
+    renderer = default.handle.prompt_renderer if default.handle else None
+    return {
+        "status": "healthy",
+        "model_loaded": any(entry.state == "loaded" for entry in registry.entries.values()),
+        "models": {entry.spec.id: entry.state for entry in registry.entries.values()},
+        "prompt_rendering": renderer.mode if renderer else None,
+        # Clients with batch work size their fan-out to this so they don't just fill the queue
+        "generation": {
+            "max_concurrent": generation_limiter.max_concurrent,
+            "active": generation_limiter.active,
+            "waiting": generation_limiter.waiting,
+            # Larger max_tokens requests are clamped to this
+            "max_completion_tokens": max_model_length // 2
+        } if generation_limiter else None,
+        "token_cache": {
+            "hits": renderer.cache.hits,
+            "misses": renderer.cache.misses,
+            "entries": len(renderer.cache)
+        } if renderer else None,
+        "embeddings": {
+            "backend": embedding_batcher.backend.describe() if embedding_batcher else None,
+            "batches": embedding_batcher.batches if embedding_batcher else 0,
+            "cache_hits": embedding_cache.hits,
+            "cache_misses": embedding_cache.misses,
+            "cache_entries": len(embedding_cache)
+        }
+    }
+
+def _generate_in_thread(model, **generate_kwargs):
+    with torch.no_grad():
+        return model.generate(**generate_kwargs)
+
+class CancelGeneration:
+    """Stopping criterion that ends generation once cancel() is called (e.g. the client went away)"""
+
+    def __init__(self):
+        self.event = threading.Event()
+
+    def cancel(self):
+        self.event.set()
+
+    def __call__(self, input_ids, scores, **kwargs):
+        return torch.full((input_ids.shape[0],), self.event.is_set(), dtype=torch.bool, device=input_ids.device)
+
+async def stream_generated_text(loaded: LoadedModel, generate_kwargs: Dict[str, Any], usage: Dict[str, int]) -> AsyncIterator[str]:
+    """Run generation in a thread and yield decoded text as it is produced
+
+    usage["completion_tokens"] is set once generation ends. Errors in the
+    generation thread, or no text for stream_token_timeout seconds, are raised
+    here; closing the iterator early stops generation.
+    """
+    streamer = TextIteratorStreamer(loaded.tokenizer, skip_prompt=True, timeout=stream_token_timeout, skip_special_tokens=True)
+    cancel = CancelGeneration()
+    prompt_length = generate_kwargs["input_ids"].shape[1]
+    outcome: Dict[str, Any] = {}
+
+    def generate():
+        try:
+            output_ids = _generate_in_thread(
+                loaded.model,
+                **generate_kwargs,
+                streamer=streamer,
+                stopping_criteria=StoppingCriteriaList([cancel])
+            )
+            outcome["completion_tokens"] = output_ids.shape[1] - prompt_length
+        except BaseException as e:
+            outcome["error"] = e
+            # Wake the consumer instead of leaving it waiting for the timeout
+            streamer.end()
+
+    thread = threading.Thread(target=generate, daemon=True)
+    thread.start()
+    loop = asyncio.get_running_loop()
+    try:
+        while True:
+            try:
+                text = await loop.run_in_executor(None, next, streamer, None)
+            except queue.Empty:
+                raise TimeoutError(f"No tokens generated for {stream_token_timeout:g}s")
+            if text is None:
+                break
+            if text:
+                yield text
+        await loop.run_in_executor(None, thread.join)
+        if "error" in outcome:
+            raise outcome["error"]
+        usage["completion_tokens"] = outcome.get("completion_tokens", 0)
+    finally:
+        # No-op after a normal finish; on disconnect or error it frees the model at the next token
+        cancel.cancel()
+
+async def sse_chat_chunks(pieces: AsyncIterator[str], model_name: str, usage: Optional[Dict[str, int]] = None) -> AsyncIterator[str]:
+    """Wrap text pieces in OpenAI-style chat.completion.chunk server-sent events
+
+    Throughput is measured from usage["completion_tokens"] when the producer
+    reports it; otherwise each piece counts as one token.
+    """
+    completion_id = f"chatcmpl-{uuid.uuid4().hex}"
+    
+    def chunk(delta: Dict[str, str], finish_reason: Optional[str] = None) -> str:
+        return "data: " + json.dumps({
+            "id": completion_id,
+            "object": "chat.completion.chunk",
+            "created": int(time.time()),
+            "model": model_name,
+            "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}]
+        }) + "\n\n"
+    
+    GENERATIONS_IN_FLIGHT.inc()
+    start = time.perf_counter()
+    pieces_sent = 0
+    try:
+        yield chunk({"role": "assistant"})
+        try:
+            async for piece in pieces:
+                pieces_sent += 1
+                yield chunk({"content": piece})
+        except Exception as e:
+            # Headers are already sent, so report the failure in-band
+            logger.error(f"Streaming generation failed: {e}")
+            yield "data: " + json.dumps({"error": {"message": str(e), "type": "server_error"}}) + "\n\n"
+            return
+        yield chunk({}, finish_reason="stop")
+        yield "data: [DONE]\n\n"
+    finally:
+        GENERATIONS_IN_FLIGHT.dec()
+        generated = usage.get("completion_tokens", pieces_sent) if usage is not None else pieces_sent
+        GENERATED_TOKENS.inc(generated)
+        TOKENS_PER_SECOND.observe(generated / max(time.perf_counter() - start, 1e-6))
+
+def requested_schema(request: ChatRequest) -> Optional[Dict[str, Any]]:
+    try:
+        return response_format_schema(request.response_format)
+    except (ValueError, KeyError, AttributeError) as e:
+        raise HTTPException(status_code=400, detail=f"Invalid response_format: {e}")
+
+def with_schema_instructions(messages: List[Dict[str, str]], schema: Dict[str, Any]) -> List[Dict[str, str]]:
+    """Tell the model about the schema too; decoding enforces it, but an informed model needs fewer masked tokens"""
+    instructions = schema_instructions(schema)
+    if messages and messages[0]["role"] == "system":
+        return [{"role": "system", "content": messages[0]["content"] + "\n\n" + instructions}] + messages[1:]
+    return [{"role": "system", "content": instructions}] + messages
+
+async def fake_chat_completion(fake_model: FakeModel, request: ChatRequest):
+    """Serve a chat completion from the deterministic fake model"""
+    messages = [{"role": msg.role, "content": msg.content} for msg in request.messages]
+    schema = requested_schema(request)
+    if request.stream and schema is None:
+        return StreamingResponse(
+            sse_chat_chunks(fake_model.stream(messages, request.max_tokens), request.model),
+            media_type="text/event-stream"
+        )
+    
+    GENERATIONS_IN_FLIGHT.inc()
+    start = time.perf_counter()
+    try:
+        with stage("generate"):
+            content = await fake_model.complete(messages, request.max_tokens)
+    finally:
+        GENERATIONS_IN_FLIGHT.dec()
+    generated = min(request.max_tokens, fake_model.completion_tokens)
+    GENERATED_TOKENS.inc(generated)
+    TOKENS_PER_SECOND.observe(generated / max(time.perf_counter() - start, 1e-6))
+    usage = {"prompt_tokens": 0, "completion_tokens": generated, "total_tokens": generated}
+    if schema is not None:
+        # Same latency profile, but a schema-valid body so structured clients can be exercised
+        return ChatResponse(choices=[{
+            "message": {"role": "assistant", "content": json.dumps(example_instance(schema))},
+            "finish_reason": "stop"
+        }], usage=usage)
+    return ChatResponse(choices=[{"message": {"role": "assistant", "content": content}}], usage=usage)
+
+async def hold_while_streaming(body: AsyncIterator, resources: AsyncExitStack) -> AsyncIterator:
+    """Keep the model in use (not evictable) until the streamed body ends"""
+    try:
+        async for chunk in body:
+            yield chunk
+    finally:
+        await resources.aclose()
 
 @app.post("/v1/chat/completions", response_model=ChatResponse)
 async def chat_completions(request: ChatRequest):
-    """Chat completions endpoint compatible with OpenAI API"""
+    """Chat completions endpoint compatible with OpenAI API; request.model picks the model"""
+    try:
+        registry.resolve(request.model)
+    except KeyError:
+        raise HTTPException(status_code=404, detail=f"Model '{request.model}' not found")
+    
+    # Loads the model on first use; held until the response (or stream) is finished
+    resources = AsyncExitStack()
     try:
-        if not generator:
-            # Fallback response if model isn't loaded
+        with stage("model_load"):
+            loaded = await resources.enter_async_context(registry.use(request.model))
+    except Exception as e:
+        if canned_fallback:
             return ChatResponse(choices=[{
                 "message": {
                     "role": "assistant",
                     "content": "AI model is not loaded. Please check the server logs and ensure you have the required dependencies installed."
                 }
             }])
+        # Clients retry once the registry's backoff for this model has passed
+        entry = registry.resolve(request.model)
+        retry_after = max(1, math.ceil(entry.retry_at - time.time()))
+        raise HTTPException(status_code=503, detail=f"Model unavailable: {e}", headers={"Retry-After": str(retry_after)})
+    try:
+        response = await generate_chat_completion(loaded, request)
+    except BaseException:
+        await resources.aclose()
+        raise
+    if isinstance(response, StreamingResponse):
+        response.body_iterator = hold_while_streaming(response.body_iterator, resources)
+    else:
+        await resources.aclose()
+    return response
+
+async def generate_chat_completion(loaded: LoadedModel, request: ChatRequest):
+    """Serve one chat completion from a loaded model"""
+    try:
+        if loaded.fake is not None:
+            return await fake_chat_completion(loaded.fake, request)
         
-        # Extract the last user message
-        user_messages = [msg for msg in request.messages if msg.role == "user"]
-        if not user_messages:
+        model, tokenizer, prompt_renderer = loaded.model, loaded.tokenizer, loaded.prompt_renderer
+        if not any(msg.role == "user" for msg in request.messages):
             raise HTTPException(status_code=400, detail="No user message found")
         
-        prompt = user_messages[-1].content
+        # Render the whole conversation through the chat template
+        messages = [{"role": msg.role, "content": msg.content} for msg in request.messages]
+        schema = requested_schema(request)
+        if schema is not None:
+            messages = with_schema_instructions(messages, schema)
+        max_new_tokens = min(request.max_tokens, max_model_length // 2)
+        with stage("prompt_render"):
+            try:
+                prompt_ids = prompt_renderer.render_ids(
+                    messages,
+                    max_prompt_tokens=max_model_length - max_new_tokens
+                )
+            except PromptTooLong as e:
+                raise HTTPException(status_code=400, detail=str(e))
+        PROMPT_TOKENS.inc(len(prompt_ids))
         
         # Generate response
-        response = generator(
-            prompt,
-            max_length=len(prompt.split()) + request.max_tokens,
-            temperature=request.temperature,
-            do_sample=True,
-            pad_token_id=tokenizer.eos_token_id,
-            num_return_sequences=1,
-            truncation=True
-        )
+        input_ids = torch.tensor([prompt_ids], device=model.device)
+        generate_kwargs = {
+            "input_ids": input_ids,
+            "attention_mask": torch.ones_like(input_ids),
+            "max_new_tokens": max_new_tokens,
+            "temperature": request.temperature,
+            "do_sample": request.temperature > 0,
+            "pad_token_id": tokenizer.pad_token_id,
+            "num_return_sequences": 1
+        }
+        if schema is not None:
+            # Mask tokens that would break the schema; EOS is forced once the JSON closes
+            generate_kwargs["logits_processor"] = LogitsProcessorList([
+                JsonSchemaLogitsProcessor(schema, tokenizer, len(prompt_ids))
+            ])
+        
+        if request.stream:
+            usage: Dict[str, int] = {}
+            return StreamingResponse(
+                sse_chat_chunks(stream_generated_text(loaded, generate_kwargs, usage), request.model, usage),
+                media_type="text/event-stream"
+            )
         
-        # Extract generated text (remove the original prompt)
-        generated_text = response[0]['generated_text']
-        if generated_text.startswith(prompt):
-            generated_text = generated_text[len(prompt):].strip()
+        GENERATIONS_IN_FLIGHT.inc()
+        start = time.perf_counter()
+        try:
+            # Off the event loop, so health checks and load shedding keep answering
+            with stage("generate"):
+                output_ids = await asyncio.get_running_loop().run_in_executor(
+                    None, lambda: _generate_in_thread(model, **generate_kwargs)
+                )
+        finally:
+            GENERATIONS_IN_FLIGHT.dec()
+        
+        # Decode only the newly generated tokens
+        new_tokens = output_ids[0][len(prompt_ids):]
+        GENERATED_TOKENS.inc(len(new_tokens))
+        TOKENS_PER_SECOND.observe(len(new_tokens) / max(time.perf_counter() - start, 1e-6))
+        generated_text = tokenizer.decode(new_tokens, skip_special_tokens=True).strip()
+        if schema is None:
+            generated_text = generated_text or "I'm here to help with your coding tasks!"
         
         return ChatResponse(choices=[{
             "message": {
                 "role": "assistant",
-                "content": generated_text or "I'm here to help with your coding tasks!"
-            }
-        }])
+                "content": generated_text
+            },
+            # "length" means max_tokens cut the reply short (for structured output: the JSON is incomplete)
+            "finish_reason": "stop" if len(new_tokens) < max_new_tokens else "length"
+        }], usage={
+            "prompt_tokens": len(prompt_ids),
+            "completion_tokens": len(new_tokens),
+            "total_tokens": len(prompt_ids) + len(new_tokens)
+        })
         
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Error in chat completion: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Internal server error: {str(e)}")
 
+async def get_embedding_batcher() -> EmbeddingBatcher:
+    """Load the embedding backend once, off the event loop"""
+    global embedding_batcher
+    async with embedding_load_lock:
+        if embedding_batcher is None:
+            # This server is the remote end; never point it at itself
+            backend = os.getenv("EMBEDDING_BACKEND", "auto")
+            backend = "auto" if backend == "remote" else backend
+            with stage("embedding_load"):
+                # Chat generation shares this process's PyTorch threads; leave their count alone
+                loaded = await asyncio.get_running_loop().run_in_executor(
+                    None, lambda: load_embedding_backend(backend, tune_torch_threads=False)
+                )
+            logger.info(f"Embedding backend: {loaded.describe()}")
+            embedding_batcher = EmbeddingBatcher(
+                loaded,
+                max_batch=int(os.getenv("EMBEDDING_MAX_BATCH", "256")),
+                max_wait_seconds=float(os.getenv("EMBEDDING_BATCH_WAIT_MS", "5")) / 1000
+            )
+    return embedding_batcher
+
+@app.post("/v1/embeddings")
+async def create_embeddings(request: EmbeddingRequest):
+    """OpenAI-compatible embeddings; cached per text and batched across concurrent callers"""
+    texts = [request.input] if isinstance(request.input, str) else request.input
+    if not texts:
+        raise HTTPException(status_code=400, detail="input must not be empty")
+    if request.encoding_format not in ("float", "base64"):
+        raise HTTPException(status_code=400, detail="encoding_format must be 'float' or 'base64'")
+    
+    rows = []
+    for text in texts:
+        row = embedding_cache.get(text)
+        record_cache("embeddings", row is not None)
+        rows.append(row)
+    missing = list(dict.fromkeys(text for text, row in zip(texts, rows) if row is None))
+    if missing:
+        try:
+            batcher = embedding_batcher or await get_embedding_batcher()
+        except Exception as e:
+            logger.error(f"Failed to load embedding model: {e}")
+            raise HTTPException(status_code=503, detail=f"Embedding model unavailable: {e}")
+        with stage("embedding"):
+            computed = await batcher.encode(missing)
+        for text, row in zip(missing, computed):
+            embedding_cache.put(text, row)
+        fresh = dict(zip(missing, computed))
+        rows = [row if row is not None else fresh[text] for text, row in zip(texts, rows)]
+    
+    def encode(row) -> Union[str, List[float]]:
+        if request.encoding_format == "base64":
+            return base64.b64encode(row.astype("<f4").tobytes()).decode("ascii")
+        return row.tolist()
+    
+    return {
+        "object": "list",
+        "data": [{"object": "embedding", "index": i, "embedding": encode(row)} for i, row in enumerate(rows)],
+        "model": EMBEDDING_MODEL_NAME,
+        # Token counts are not tracked for embeddings
+        "usage": {"prompt_tokens": 0, "total_tokens": 0}
+    }
+
 @app.get("/v1/models")
 async def list_models():
-    """List available models"""
+    """List configured models with their load state"""
     return {
-        "data": [{
-            "id": "local-model",
-            "object": "model",
-            "owned_by": "local",
-            "permission": []
-        }]
+        "object": "list",
+        "data": registry.to_list(),
+        "memory": {
+            "loaded_bytes": registry.loaded_bytes(),
+            "budget_bytes": registry.memory_budget_bytes or None
+        }
     }
 
 if __name__ == "__main__":
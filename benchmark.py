@@ -0,0 +1,254 @@
+#!/usr/bin/env python3
+"""
+Load-testing benchmark for the JustCopy AI IDE APIs
+
+Drives /api/chat, /api/code/generate, /api/files/*, /ws and the AI server's
+streaming /v1/chat/completions at a fixed concurrency (closed loop) or a fixed
+Poisson arrival rate (open loop) and prints latency percentiles, throughput,
+time-to-first-token and error rates as JSON.
+
+For repeatable offline runs start the AI server with the fake model:
+
+    MODEL_NAME=fake FAKE_TOKENS_PER_SECOND=50 FAKE_PREFILL_MS=200 python3 ai_server.py
+    python3 main.py
+    python3 benchmark.py --scenarios chat,codegen,files,ws,completion --concurrency 8 --duration 30
+"""
+import sys
+import json
+import time
+import random
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Dict, Any, Optional, Callable
+
+import requests
+from websockets.sync.client import connect
+
+SCENARIOS = ["chat", "codegen", "files", "ws", "completion"]
+
+# Prompts cycled through by the chat/codegen scenarios
+PROMPTS = [
+    "Create a Python function to validate email addresses",
+    "Write a React component that renders a sortable table",
+    "Add retry with exponential backoff to an HTTP client",
+    "Explain how to paginate a SQL query efficiently",
+    "Generate unit tests for a string slugify function",
+]
+
+class Result:
+    """Outcome of one request"""
+
+    def __init__(self, latency: float, ok: bool, ttft: Optional[float] = None, error: Optional[str] = None):
+        self.latency = latency
+        self.ok = ok
+        self.ttft = ttft
+        self.error = error
+
+def percentile(values: List[float], pct: float) -> Optional[float]:
+    """Nearest-rank percentile in milliseconds"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(round(pct / 100 * len(ordered))) - 1))
+    return round(ordered[index] * 1000, 2)
+
+def summarize(results: List[Result], elapsed: float) -> Dict[str, Any]:
+    """Latency percentiles, throughput, TTFT and error rate for one scenario"""
+    latencies = [r.latency for r in results if r.ok]
+    ttfts = [r.ttft for r in results if r.ok and r.ttft is not None]
+    errors = [r for r in results if not r.ok]
+    error_samples = sorted({r.error for r in errors if r.error})[:5]
+    return {
+        "requests": len(results),
+        "errors": len(errors),
+        "error_rate": round(len(errors) / len(results), 4) if results else 0.0,
+        "throughput_rps": round(len(latencies) / elapsed, 2) if elapsed > 0 else 0.0,
+        "latency_ms": {
+            "p50": percentile(latencies, 50),
+            "p95": percentile(latencies, 95),
+            "p99": percentile(latencies, 99),
+            "mean": round(sum(latencies) / len(latencies) * 1000, 2) if latencies else None,
+            "max": round(max(latencies) * 1000, 2) if latencies else None
+        },
+        "ttft_ms": {
+            "p50": percentile(ttfts, 50),
+            "p95": percentile(ttfts, 95),
+            "p99": percentile(ttfts, 99)
+        } if ttfts else None,
+        "error_samples": error_samples
+    }
+
+class Benchmark:
+    """Request implementations for each scenario"""
+
+    def __init__(self, base_url: str, ai_url: str, projects_dir: str, timeout: float):
+        self.base_url = base_url.rstrip("/")
+        self.project_path = f"{projects_dir.rstrip('/')}/benchmark"
+        self.ai_url = ai_url.rstrip("/")
+        self.ws_url = self.base_url.replace("http", "ws", 1) + "/ws"
+        self.timeout = timeout
+        self.local = threading.local()
+        self.counter = 0
+        self.lock = threading.Lock()
+
+    def session(self) -> requests.Session:
+        # One keep-alive session per worker thread
+        if not hasattr(self.local, "session"):
+            self.local.session = requests.Session()
+        return self.local.session
+
+    def next_id(self) -> int:
+        with self.lock:
+            self.counter += 1
+            return self.counter
+
+    def post(self, url: str, payload: Dict[str, Any]) -> requests.Response:
+        response = self.session().post(url, json=payload, timeout=self.timeout)
+        response.raise_for_status()
+        return response
+
+    def chat(self) -> Optional[float]:
+        self.post(f"{self.base_url}/api/chat", {"message": random.choice(PROMPTS), "project_path": self.project_path})
+        return None
+
+    def codegen(self) -> Optional[float]:
+        self.post(f"{self.base_url}/api/code/generate", {"prompt": random.choice(PROMPTS)})
+        return None
+
+    def files(self) -> Optional[float]:
+        path = f"benchmark/file_{self.next_id() % 100}.py"
+        self.post(f"{self.base_url}/api/files/operation", {"operation": "write", "path": path, "content": "def f():\n    return 1\n" * 20})
+        self.post(f"{self.base_url}/api/files/operation", {"operation": "read", "path": path})
+        response = self.session().get(f"{self.base_url}/api/files/list", params={"path": self.project_path}, timeout=self.timeout)
+        response.raise_for_status()
+        return None
+
+    def ws(self) -> Optional[float]:
+        start = time.perf_counter()
+        with connect(self.ws_url, open_timeout=self.timeout) as websocket:
+            websocket.send(json.dumps({"type": "code_request", "data": {"prompt": random.choice(PROMPTS)}}))
+            message = websocket.recv(timeout=self.timeout)
+            ttft = time.perf_counter() - start
+            if json.loads(message).get("type") != "code_response":
+                raise RuntimeError(f"unexpected websocket message: {message[:100]}")
+        return ttft
+
+    def completion(self) -> Optional[float]:
+        start = time.perf_counter()
+        payload = {
+            "model": "local-model",
+            "messages": [{"role": "user", "content": random.choice(PROMPTS)}],
+            "max_tokens": 128,
+            "stream": True
+        }
+        ttft = None
+        with self.session().post(f"{self.ai_url}/v1/chat/completions", json=payload, stream=True, timeout=self.timeout) as response:
+            response.raise_for_status()
+            for line in response.iter_lines():
+                if not line.startswith(b"data: ") or line == b"data: [DONE]":
+                    continue
+                delta = json.loads(line[6:])["choices"][0]["delta"]
+                if ttft is None and delta.get("content"):
+                    ttft = time.perf_counter() - start
+        return ttft
+
+def timed(call: Callable[[], Optional[float]], scheduled: float) -> Result:
+    """Run one request; times count from its scheduled start to avoid coordinated omission"""
+    began = time.perf_counter()
+    try:
+        ttft = call()
+        queued = began - scheduled
+        return Result(time.perf_counter() - scheduled, True, queued + ttft if ttft is not None else None)
+    except Exception as e:
+        return Result(time.perf_counter() - scheduled, False, error=f"{type(e).__name__}: {str(e)[:200]}")
+
+def run_closed_loop(call: Callable[[], Optional[float]], concurrency: int, duration: float, max_requests: Optional[int]) -> List[Result]:
+    """Each of N workers issues its next request as soon as the previous one finishes"""
+    results: List[Result] = []
+    lock = threading.Lock()
+    deadline = time.perf_counter() + duration
+
+    def worker():
+        while time.perf_counter() < deadline:
+            with lock:
+                if max_requests is not None and len(results) >= max_requests:
+                    return
+            result = timed(call, time.perf_counter())
+            with lock:
+                results.append(result)
+
+    threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
+
+def run_open_loop(call: Callable[[], Optional[float]], rate: float, duration: float, max_requests: Optional[int], max_workers: int, seed: int) -> List[Result]:
+    """Issue requests at Poisson arrival times regardless of how fast the server answers"""
+    rng = random.Random(seed)
+    futures = []
+    start = time.perf_counter()
+    next_arrival = start
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        while next_arrival < start + duration and (max_requests is None or len(futures) < max_requests):
+            delay = next_arrival - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            futures.append(pool.submit(timed, call, next_arrival))
+            next_arrival += rng.expovariate(rate)
+        return [future.result() for future in futures]
+
+def main():
+    parser = argparse.ArgumentParser(description="Load-test the JustCopy AI IDE APIs")
+    parser.add_argument("--base-url", default="http://localhost:8888", help="Main API base URL")
+    parser.add_argument("--ai-url", default="http://localhost:8000", help="AI server base URL")
+    parser.add_argument("--projects-dir", default="/app/data/projects", help="Projects directory on the main API host")
+    parser.add_argument("--scenarios", default="chat,codegen,files", help=f"Comma-separated list of {', '.join(SCENARIOS)}")
+    parser.add_argument("--concurrency", type=int, default=4, help="Closed-loop workers per scenario")
+    parser.add_argument("--rate", type=float, default=None, help="Open-loop arrival rate in requests/s (overrides --concurrency)")
+    parser.add_argument("--max-workers", type=int, default=256, help="Thread cap for open-loop runs")
+    parser.add_argument("--duration", type=float, default=30.0, help="Seconds to run each scenario")
+    parser.add_argument("--requests", type=int, default=None, help="Stop each scenario after this many requests")
+    parser.add_argument("--timeout", type=float, default=180.0, help="Per-request timeout in seconds")
+    parser.add_argument("--seed", type=int, default=0, help="Seed for prompts and arrival times")
+    parser.add_argument("--output", default=None, help="Also write the JSON report to this file")
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+    benchmark = Benchmark(args.base_url, args.ai_url, args.projects_dir, args.timeout)
+    report: Dict[str, Any] = {
+        "config": {
+            "base_url": args.base_url,
+            "ai_url": args.ai_url,
+            "mode": "open" if args.rate else "closed",
+            "concurrency": None if args.rate else args.concurrency,
+            "rate": args.rate,
+            "duration": args.duration,
+            "requests": args.requests,
+            "seed": args.seed
+        },
+        "scenarios": {}
+    }
+
+    for name in [scenario.strip() for scenario in args.scenarios.split(",") if scenario.strip()]:
+        if name not in SCENARIOS:
+            parser.error(f"Unknown scenario: {name}")
+        call = getattr(benchmark, name)
+        print(f"⏱️  Running {name}...", file=sys.stderr)
+        start = time.perf_counter()
+        if args.rate:
+            results = run_open_loop(call, args.rate, args.duration, args.requests, args.max_workers, args.seed)
+        else:
+            results = run_closed_loop(call, args.concurrency, args.duration, args.requests)
+        report["scenarios"][name] = summarize(results, time.perf_counter() - start)
+
+    output = json.dumps(report, indent=2)
+    print(output)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,233 @@
+"""
+Per-project import graph (Python imports, JS/TS import/require) for context prefetching
+"""
+import re
+import ast
+import posixpath
+from collections import deque
+from typing import List, Dict, Set, Iterable, Optional
+
+PYTHON_EXTENSIONS = (".py",)
+JS_EXTENSIONS = (".js", ".jsx", ".mjs", ".cjs", ".ts", ".tsx")
+
+# import x from "y" / import "y" / export ... from "y" / require("y") / import("y")
+JS_IMPORT_PATTERN = re.compile(
+    r"""(?:\bimport\s+(?:[\w*{}\s,$]+\s+from\s+)?|\bexport\s+[\w*{}\s,$]+\s+from\s+|\brequire\s*\(\s*|\bimport\s*\(\s*)["']([^"']+)["']"""
+)
+
+# Fallback for Python files that do not parse (e.g. mid-edit)
+PYTHON_IMPORT_PATTERN = re.compile(r"^[ \t]*(?:from[ \t]+(\.*[\w.]*)[ \t]+import[ \t]+\(?([\w*, \t]+)|import[ \t]+([\w., \t]+))", re.MULTILINE)
+
+def _python_specs(content: str) -> List[str]:
+    """Imported modules as dotted names, with leading dots for relative imports"""
+    specs = []
+    try:
+        tree = ast.parse(content)
+    except (SyntaxError, ValueError):
+        for match in PYTHON_IMPORT_PATTERN.finditer(content):
+            if match.group(1) is not None:
+                module = match.group(1)
+                specs.append(module)
+                base = module if module.endswith(".") else module + "."
+                specs.extend(base + name.strip() for name in match.group(2).split(",") if name.strip() not in ("", "*"))
+            else:
+                specs.extend(name.strip().split(" as ")[0] for name in match.group(3).split(","))
+        return [spec for spec in specs if spec]
+
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Import):
+            specs.extend(alias.name for alias in node.names)
+        elif isinstance(node, ast.ImportFrom):
+            module = "." * node.level + (node.module or "")
+            if node.module:
+                specs.append(module)
+            # "from pkg import mod" may name a submodule rather than an attribute
+            base = module if module.endswith(".") else module + "."
+            specs.extend(base + alias.name for alias in node.names if alias.name != "*")
+    return specs
+
+def extract_imports(path: str, content: str) -> List[str]:
+    """Raw import specifiers found in a source file"""
+    if path.endswith(PYTHON_EXTENSIONS):
+        return _python_specs(content)
+    if path.endswith(JS_EXTENSIONS):
+        return JS_IMPORT_PATTERN.findall(content)
+    return []
+
+class DependencyGraph:
+    """Import edges between the files of one project, kept up to date per file
+
+    Raw import specifiers are stored per file and resolved against the set of
+    known files; edges are re-resolved only when files appear or disappear, so
+    content edits cost one parse. Specifiers are also indexed by the module
+    names and paths they could resolve to, so a new file re-resolves only the
+    files whose imports might point at it.
+    """
+
+    def __init__(self):
+        self.specs: Dict[str, List[str]] = {}
+        self.imports: Dict[str, Set[str]] = {}
+        self.importers: Dict[str, Set[str]] = {}
+        self._python_modules: Dict[str, Set[str]] = {}
+        self._wanted: Dict[str, Set[str]] = {}  # "module:<dotted>" / "path:<target>" -> files with an import that may resolve there
+
+    def __len__(self) -> int:
+        return len(self.specs)
+
+    def _module_names(self, path: str) -> List[str]:
+        # "src/pkg/mod.py" is importable as src.pkg.mod, pkg.mod or mod depending on sys.path
+        parts = path[:-3].split("/")
+        if parts[-1] == "__init__":
+            parts = parts[:-1]
+        return [".".join(parts[i:]) for i in range(len(parts)) if parts[i:]]
+
+    @staticmethod
+    def _relative_python_target(importer: str, spec: str) -> str:
+        level = len(spec) - len(spec.lstrip("."))
+        base = posixpath.dirname(importer)
+        for _ in range(level - 1):
+            base = posixpath.dirname(base)
+        rest = spec[level:].replace(".", "/")
+        return posixpath.join(base, rest) if rest else base
+
+    @staticmethod
+    def _python_module_suffixes(spec: str) -> List[str]:
+        # The project directory itself may be a package prefix ("myapp.core.db" for core/db.py)
+        parts = spec.split(".")
+        return [".".join(parts[start:]) for start in range(max(1, len(parts) - 1))]
+
+    @staticmethod
+    def _js_target(importer: str, spec: str) -> str:
+        return posixpath.normpath(posixpath.join(posixpath.dirname(importer), spec))
+
+    def _resolve_python(self, importer: str, spec: str) -> Optional[str]:
+        if spec.startswith("."):
+            target = self._relative_python_target(importer, spec)
+            for candidate in (f"{target}.py", f"{target}/__init__.py"):
+                if candidate.lstrip("/") in self.specs:
+                    return candidate.lstrip("/")
+            return None
+        candidates = None
+        for name in self._python_module_suffixes(spec):
+            candidates = self._python_modules.get(name)
+            if candidates:
+                break
+        if not candidates:
+            return None
+        # Prefer the file closest to the importer
+        importer_dir = posixpath.dirname(importer)
+        return min(candidates, key=lambda path: (not path.startswith(importer_dir), path.count("/"), path))
+
+    def _resolve_js(self, importer: str, spec: str) -> Optional[str]:
+        if not spec.startswith("."):
+            return None  # package import
+        target = self._js_target(importer, spec)
+        candidates = [target] + [target + ext for ext in JS_EXTENSIONS] + [f"{target}/index{ext}" for ext in JS_EXTENSIONS]
+        for candidate in candidates:
+            if candidate in self.specs:
+                return candidate
+        return None
+
+    def _resolve(self, path: str):
+        resolver = self._resolve_python if path.endswith(PYTHON_EXTENSIONS) else self._resolve_js
+        targets = {resolver(path, spec) for spec in self.specs.get(path, [])}
+        targets.discard(None)
+        targets.discard(path)
+        for target in self.imports.get(path, set()) - targets:
+            self.importers.get(target, set()).discard(path)
+        for target in targets:
+            self.importers.setdefault(target, set()).add(path)
+        self.imports[path] = targets
+
+    def _resolve_all(self):
+        self.importers = {}
+        for path in self.specs:
+            self._resolve(path)
+
+    def _wanted_keys(self, importer: str) -> Set[str]:
+        """Where the importer's specifiers could resolve, as keys of _wanted"""
+        keys = set()
+        python = importer.endswith(PYTHON_EXTENSIONS)
+        for spec in self.specs.get(importer, []):
+            if python and spec.startswith("."):
+                keys.add("path:" + self._relative_python_target(importer, spec).lstrip("/"))
+            elif python:
+                keys.update("module:" + name for name in self._python_module_suffixes(spec))
+            elif spec.startswith("."):
+                keys.add("path:" + self._js_target(importer, spec))
+        return keys
+
+    def _provided_keys(self, path: str) -> Set[str]:
+        """Keys of _wanted that a file at path could satisfy"""
+        stem = posixpath.splitext(path)[0]
+        keys = {"path:" + path, "path:" + stem}
+        if posixpath.basename(stem) in ("index", "__init__"):
+            keys.add("path:" + posixpath.dirname(stem))
+        if path.endswith(PYTHON_EXTENSIONS):
+            keys.update("module:" + name for name in self._module_names(path))
+        return keys
+
+    def _index_specs(self, path: str, specs: List[str]):
+        for key in self._wanted_keys(path):
+            importers = self._wanted.get(key)
+            if importers is not None:
+                importers.discard(path)
+                if not importers:
+                    del self._wanted[key]
+        self.specs[path] = specs
+        for key in self._wanted_keys(path):
+            self._wanted.setdefault(key, set()).add(path)
+
+    def update_file(self, path: str, content: str):
+        """Record a file's current imports"""
+        known = path in self.specs
+        self._index_specs(path, extract_imports(path, content))
+        if known:
+            self._resolve(path)
+            return
+        if path.endswith(PYTHON_EXTENSIONS):
+            for name in self._module_names(path):
+                self._python_modules.setdefault(name, set()).add(path)
+        # A new file can satisfy imports that previously pointed nowhere (or elsewhere)
+        affected = {path}
+        for key in self._provided_keys(path):
+            affected.update(self._wanted.get(key, ()))
+        for importer in affected:
+            self._resolve(importer)
+
+    def remove_file(self, path: str):
+        if path not in self.specs:
+            return
+        self._index_specs(path, [])
+        del self.specs[path]
+        if path.endswith(PYTHON_EXTENSIONS):
+            for name in self._module_names(path):
+                self._python_modules.get(name, set()).discard(path)
+        for target in self.imports.pop(path, set()):
+            self.importers.get(target, set()).discard(path)
+        # Files that imported it may now resolve to another candidate, or to nothing
+        for importer in self.importers.pop(path, set()):
+            self._resolve(importer)
+
+    def build(self, files: Iterable[tuple]):
+        """Populate from (path, content) pairs in one pass"""
+        for path, content in files:
+            self._index_specs(path, extract_imports(path, content))
+            if path.endswith(PYTHON_EXTENSIONS):
+                for name in self._module_names(path):
+                    self._python_modules.setdefault(name, set()).add(path)
+        self._resolve_all()
+
+    def neighbors(self, seeds: Iterable[str], max_depth: int = 2) -> Dict[str, int]:
+        """Files reachable from the seeds through imports in either direction, with their distance"""
+        distances = {seed: 0 for seed in seeds if seed in self.specs}
+        frontier = deque(distances)
+        while frontier:
+            path = frontier.popleft()
+            if distances[path] >= max_depth:
+                continue
+            for neighbor in self.imports.get(path, set()) | self.importers.get(path, set()):
+                if neighbor not in distances:
+                    distances[neighbor] = distances[path] + 1
+                    frontier.append(neighbor)
+        return distances
@@ -0,0 +1,399 @@
+"""
+Embedding backends for code context: PyTorch, ONNX, int8-quantized ONNX, or a remote /v1/embeddings server
+"""
+import os
+import json
+import time
+import base64
+import asyncio
+import hashlib
+import platform
+import logging
+from pathlib import Path
+from collections import OrderedDict
+from typing import List, Dict, Any, Optional, Sequence, Tuple, TYPE_CHECKING
+
+import numpy as np
+
+if TYPE_CHECKING:
+    from sentence_transformers import SentenceTransformer
+
+logger = logging.getLogger(__name__)
+
+EMBEDDING_MODEL_NAME = os.getenv("EMBEDDING_MODEL_NAME", "all-MiniLM-L6-v2")
+
+# Server used by the "remote" backend (the AI server's /v1/embeddings)
+EMBEDDING_SERVER_URL = os.getenv("EMBEDDING_SERVER_URL", "http://localhost:8000")
+
+# Where autotuning results are cached between restarts
+EMBEDDING_CACHE_DIR = Path(os.getenv("EMBEDDING_CACHE_DIR", "/app/data/embeddings"))
+
+# Optimized backends must agree with the PyTorch reference at least this well
+AGREEMENT_THRESHOLD = float(os.getenv("EMBEDDING_AGREEMENT_THRESHOLD", "0.98"))
+
+AUTOTUNE_BATCH_SIZES = [8, 16, 32, 64, 128]
+
+# Probe texts for the agreement check: a mix of prose and code, short and long
+AGREEMENT_PROBES = [
+    "How do I read a file line by line in Python?",
+    "def add(a, b):\n    return a + b",
+    "function debounce(fn, wait) { let t; return (...args) => { clearTimeout(t); t = setTimeout(() => fn(...args), wait); }; }",
+    "SELECT id, name FROM users WHERE created_at > NOW() - INTERVAL '7 days' ORDER BY name;",
+    "Create a FastAPI endpoint that uploads a file and stores it on disk",
+    "class LRUCache:\n    def __init__(self, capacity):\n        self.capacity = capacity\n        self.items = OrderedDict()",
+    "<div class=\"navbar\"><a href=\"/\">Home</a><a href=\"/about\">About</a></div>",
+    "Fix the race condition when two requests write the same file",
+    "body { font-family: Arial, sans-serif; margin: 0; padding: 20px; }",
+    "import numpy as np\nmatrix = np.random.rand(100, 100)\nvalues = np.linalg.eigvals(matrix)",
+]
+
+class EmbeddingBackend:
+    """A SentenceTransformer plus the batch size and thread count tuned for this host
+
+    texts_per_second is the autotuned throughput (None when untuned),
+    agreement the cosine agreement with PyTorch (None for PyTorch itself) and
+    rejected the backends tried before this one, with the reason.
+    """
+
+    def __init__(
+        self,
+        model: "SentenceTransformer",
+        name: str,
+        batch_size: int = 32,
+        threads: Optional[int] = None,
+        texts_per_second: Optional[float] = None
+    ):
+        self.model = model
+        self.name = name
+        self.batch_size = batch_size
+        self.threads = threads
+        self.texts_per_second = texts_per_second
+        self.agreement: Optional[float] = None
+        self.rejected: Dict[str, str] = {}
+
+    def encode(self, texts: Sequence[str], batch_size: Optional[int] = None) -> np.ndarray:
+        """Encode texts to L2-normalized float32 embeddings"""
+        return self.model.encode(
+            list(texts),
+            batch_size=batch_size or self.batch_size,
+            convert_to_numpy=True,
+            normalize_embeddings=True,
+            show_progress_bar=False
+        )
+
+    def get_sentence_embedding_dimension(self) -> int:
+        return self.model.get_sentence_embedding_dimension()
+
+    def describe(self) -> Dict[str, Any]:
+        return {
+            "backend": self.name,
+            "batch_size": self.batch_size,
+            "threads": self.threads,
+            "texts_per_second": self.texts_per_second,
+            "agreement": self.agreement,
+            "rejected": self.rejected
+        }
+
+def cpu_quantization_target() -> str:
+    """Pick the int8 ONNX variant matching the host CPU's instruction set"""
+    if platform.machine().lower() in ("arm64", "aarch64"):
+        return "arm64"
+    try:
+        with open("/proc/cpuinfo", "r") as f:
+            flags = f.read()
+    except OSError:
+        return "avx2"
+    if "avx512_vnni" in flags:
+        return "avx512_vnni"
+    if "avx512f" in flags:
+        return "avx512"
+    return "avx2"
+
+def thread_candidates() -> List[int]:
+    """Thread counts worth trying: one, half and all of the available cores"""
+    cores = os.cpu_count() or 1
+    return sorted({1, max(1, cores // 2), cores})
+
+def _load(backend: str, threads: Optional[int] = None) -> "SentenceTransformer":
+    """Load the embedding model for backend ("torch", "onnx" or "onnx-int8")"""
+    from sentence_transformers import SentenceTransformer
+    if backend == "torch":
+        return SentenceTransformer(EMBEDDING_MODEL_NAME)
+
+    import onnxruntime
+    session_options = onnxruntime.SessionOptions()
+    if threads:
+        session_options.intra_op_num_threads = threads
+    model_kwargs: Dict[str, Any] = {"session_options": session_options}
+    if backend == "onnx-int8":
+        target = cpu_quantization_target()
+        dtype = "quint8" if target == "avx2" else "qint8"
+        model_kwargs["file_name"] = os.getenv("EMBEDDING_ONNX_FILE", f"onnx/model_{dtype}_{target}.onnx")
+    elif os.getenv("EMBEDDING_ONNX_FILE"):
+        model_kwargs["file_name"] = os.getenv("EMBEDDING_ONNX_FILE")
+    return SentenceTransformer(EMBEDDING_MODEL_NAME, backend="onnx", model_kwargs=model_kwargs)
+
+def _torch_threads() -> int:
+    import torch
+    return torch.get_num_threads()
+
+def _with_threads(backend: str, model: "SentenceTransformer", threads: int) -> "SentenceTransformer":
+    """Apply a thread count: global for PyTorch, a fresh session for ONNX"""
+    if backend == "torch":
+        import torch
+        torch.set_num_threads(threads)
+        return model
+    return _load(backend, threads)
+
+def check_agreement(candidate: "SentenceTransformer", reference: "SentenceTransformer") -> float:
+    """Lowest cosine similarity between candidate and reference embeddings of the probes"""
+    ours = candidate.encode(AGREEMENT_PROBES, convert_to_numpy=True, normalize_embeddings=True, show_progress_bar=False)
+    theirs = reference.encode(AGREEMENT_PROBES, convert_to_numpy=True, normalize_embeddings=True, show_progress_bar=False)
+    return float(np.min(np.sum(ours * theirs, axis=1)))
+
+def _autotune_texts(count: int) -> List[str]:
+    """Synthetic code-like chunks about the size of an indexed file chunk"""
+    line = "    result = process_item(item, options=config.get('options', {}))  # update state"
+    return [f"def handler_{i}(item, config):\n" + "\n".join([line] * 12) for i in range(count)]
+
+def _measure(model: "SentenceTransformer", texts: List[str], batch_size: int) -> float:
+    """Texts per second for one batch size"""
+    model.encode(texts[:batch_size], batch_size=batch_size, show_progress_bar=False)  # warm up
+    start = time.perf_counter()
+    model.encode(texts, batch_size=batch_size, show_progress_bar=False)
+    return len(texts) / (time.perf_counter() - start)
+
+def _autotune_cache_key(backend: str) -> str:
+    return f"{EMBEDDING_MODEL_NAME}|{backend}|{platform.processor() or platform.machine()}|{os.cpu_count()}"
+
+def _read_autotune_cache() -> Dict[str, Any]:
+    try:
+        with open(EMBEDDING_CACHE_DIR / "autotune.json", "r") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def _write_autotune_cache(cache: Dict[str, Any]):
+    try:
+        EMBEDDING_CACHE_DIR.mkdir(parents=True, exist_ok=True)
+        with open(EMBEDDING_CACHE_DIR / "autotune.json", "w") as f:
+            json.dump(cache, f, indent=2)
+    except OSError as e:
+        logger.warning(f"Could not save embedding autotune results: {e}")
+
+def autotune(backend: str, model: "SentenceTransformer") -> EmbeddingBackend:
+    """Find the fastest thread count and batch size for backend on this host
+
+    Results are cached in EMBEDDING_CACHE_DIR keyed by model, backend and CPU,
+    so the sweep only runs the first time a host starts a given backend.
+    """
+    cache = _read_autotune_cache()
+    key = _autotune_cache_key(backend)
+    if key in cache:
+        tuned = cache[key]
+        model = _with_threads(backend, model, tuned["threads"])
+        logger.info(f"Using cached embedding autotune for {backend}: {tuned}")
+        return EmbeddingBackend(model, backend, tuned["batch_size"], tuned["threads"], tuned.get("texts_per_second"))
+
+    texts = _autotune_texts(max(AUTOTUNE_BATCH_SIZES))
+    best = (0.0, 32, os.cpu_count() or 1)
+    previous_threads = _torch_threads() if backend == "torch" else None
+    try:
+        for threads in thread_candidates():
+            candidate = _with_threads(backend, model, threads)
+            for batch_size in AUTOTUNE_BATCH_SIZES:
+                throughput = _measure(candidate, texts, batch_size)
+                logger.info(f"Embedding autotune {backend}: threads={threads} batch={batch_size} -> {throughput:.1f} texts/s")
+                if throughput > best[0]:
+                    best = (throughput, batch_size, threads)
+    except Exception:
+        # Leave the process as it was rather than stuck at whatever the sweep tried last
+        if previous_threads is not None:
+            _with_threads(backend, model, previous_threads)
+        raise
+
+    throughput, batch_size, threads = best
+    model = _with_threads(backend, model, threads)
+    cache[key] = {"batch_size": batch_size, "threads": threads, "texts_per_second": round(throughput, 1)}
+    _write_autotune_cache(cache)
+    logger.info(f"Embedding autotune picked {backend} threads={threads} batch={batch_size} ({throughput:.1f} texts/s)")
+    return EmbeddingBackend(model, backend, batch_size, threads, round(throughput, 1))
+
+def load_embedding_backend(backend: Optional[str] = None, tune: Optional[bool] = None, tune_torch_threads: bool = True):
+    """Load the configured embedding backend, falling back to PyTorch
+
+    EMBEDDING_BACKEND selects "torch", "onnx", "onnx-int8", "auto" (try int8,
+    then fp32 ONNX, then PyTorch) or "remote" (call EMBEDDING_SERVER_URL and
+    load nothing locally). An ONNX model is only used if its embeddings agree
+    with the PyTorch reference on a fixed probe set.
+
+    PyTorch's thread count is process-wide, so a process that also runs other
+    models passes tune_torch_threads=False: the PyTorch backend is then used
+    untuned, while ONNX sessions (which have their own threads) are still tuned.
+    """
+    backend = backend or os.getenv("EMBEDDING_BACKEND", "auto")
+    if backend == "remote":
+        return RemoteEmbeddingBackend(EMBEDDING_SERVER_URL)
+    if tune is None:
+        tune = os.getenv("EMBEDDING_AUTOTUNE", "true").lower() in ("1", "true", "yes")
+
+    from sentence_transformers import SentenceTransformer
+    reference = SentenceTransformer(EMBEDDING_MODEL_NAME)
+    candidates = {"auto": ["onnx-int8", "onnx"], "onnx-int8": ["onnx-int8"], "onnx": ["onnx"]}.get(backend, [])
+    rejected: Dict[str, str] = {}
+
+    for name in candidates:
+        try:
+            model = _load(name)
+            agreement = check_agreement(model, reference)
+        except Exception as e:
+            logger.warning(f"Embedding backend {name} unavailable: {e}")
+            rejected[name] = f"unavailable: {e}"
+            continue
+        if agreement < AGREEMENT_THRESHOLD:
+            logger.warning(f"Embedding backend {name} rejected: cosine agreement {agreement:.4f} < {AGREEMENT_THRESHOLD}")
+            rejected[name] = f"cosine agreement {agreement:.4f} < {AGREEMENT_THRESHOLD}"
+            continue
+        logger.info(f"Embedding backend {name} accepted: cosine agreement {agreement:.4f}")
+        del reference
+        loaded = autotune(name, model) if tune else EmbeddingBackend(model, name)
+        loaded.agreement = round(agreement, 4)
+        loaded.rejected = rejected
+        return loaded
+
+    if tune and not tune_torch_threads:
+        logger.info("Skipping embedding autotune for PyTorch; it would change the thread count of the whole process")
+        tune = False
+    loaded = autotune("torch", reference) if tune else EmbeddingBackend(reference, "torch")
+    loaded.rejected = rejected
+    return loaded
+
+def decode_embeddings(response: Dict[str, Any]) -> np.ndarray:
+    """Embeddings from an OpenAI-style response, in input order (float lists or base64 float32)"""
+    rows = sorted(response["data"], key=lambda item: item["index"])
+    return np.stack([
+        np.frombuffer(base64.b64decode(row["embedding"]), dtype="<f4") if isinstance(row["embedding"], str)
+        else np.asarray(row["embedding"], dtype=np.float32)
+        for row in rows
+    ]) if rows else np.zeros((0, 0), dtype=np.float32)
+
+class RemoteEmbeddingBackend:
+    """Client for another server's /v1/embeddings; no model is loaded in this process"""
+
+    def __init__(self, base_url: str, batch_size: int = 256, timeout: float = 60.0):
+        import requests
+        self.base_url = base_url.rstrip("/")
+        self.name = "remote"
+        self.batch_size = batch_size
+        self.timeout = timeout
+        self.dimension: Optional[int] = None
+        self.session = requests.Session()  # keep-alive across calls
+
+    def encode(self, texts: Sequence[str], batch_size: Optional[int] = None) -> np.ndarray:
+        texts = list(texts)
+        step = batch_size or self.batch_size
+        parts = []
+        for start in range(0, len(texts), step):
+            response = self.session.post(
+                f"{self.base_url}/v1/embeddings",
+                json={"input": texts[start:start + step], "model": EMBEDDING_MODEL_NAME, "encoding_format": "base64"},
+                timeout=self.timeout
+            )
+            response.raise_for_status()
+            parts.append(decode_embeddings(response.json()))
+        if not parts:
+            return np.zeros((0, self.get_sentence_embedding_dimension()), dtype=np.float32)
+        embeddings = np.concatenate(parts)
+        self.dimension = embeddings.shape[1]
+        return embeddings
+
+    def get_sentence_embedding_dimension(self) -> int:
+        if self.dimension is None:
+            self.encode(["dimension probe"])
+        return self.dimension
+
+    def describe(self) -> Dict[str, Any]:
+        return {"backend": self.name, "url": self.base_url, "batch_size": self.batch_size}
+
+class EmbeddingCache:
+    """LRU of embeddings keyed by a hash of the text"""
+
+    def __init__(self, max_entries: int = 50000):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, np.ndarray]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    @staticmethod
+    def key(text: str) -> str:
+        return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+    def get(self, text: str) -> Optional[np.ndarray]:
+        key = self.key(text)
+        embedding = self._entries.get(key)
+        if embedding is None:
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return embedding
+
+    def put(self, text: str, embedding: np.ndarray):
+        self._entries[self.key(text)] = embedding
+        self._entries.move_to_end(self.key(text))
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+class EmbeddingBatcher:
+    """Coalesce concurrent embedding requests into shared model batches
+
+    Callers' texts are queued; a worker waits up to max_wait_seconds after the
+    first arrival (or until max_batch texts are pending), embeds the distinct
+    texts in one call off the event loop, and hands each caller its rows.
+    """
+
+    def __init__(self, backend, max_batch: int = 256, max_wait_seconds: float = 0.005):
+        self.backend = backend
+        self.max_batch = max_batch
+        self.max_wait_seconds = max_wait_seconds
+        self.batches = 0
+        self._queue: "asyncio.Queue[Tuple[List[str], asyncio.Future]]" = asyncio.Queue()
+        self._worker: Optional[asyncio.Task] = None
+
+    async def encode(self, texts: List[str]) -> np.ndarray:
+        if self._worker is None or self._worker.done():
+            self._worker = asyncio.create_task(self._run())
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((texts, future))
+        return await future
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            pending = [await self._queue.get()]
+            count = len(pending[0][0])
+            deadline = loop.time() + self.max_wait_seconds
+            while count < self.max_batch:
+                try:
+                    item = await asyncio.wait_for(self._queue.get(), max(0.0, deadline - loop.time()))
+                except asyncio.TimeoutError:
+                    break
+                pending.append(item)
+                count += len(item[0])
+
+            distinct = list(dict.fromkeys(text for texts, _ in pending for text in texts))
+            try:
+                embeddings = await loop.run_in_executor(None, self.backend.encode, distinct)
+            except Exception as e:
+                for _, future in pending:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+            self.batches += 1
+            rows = {text: embeddings[i] for i, text in enumerate(distinct)}
+            for texts, future in pending:
+                if not future.done():
+                    future.set_result(np.stack([rows[text] for text in texts]) if texts else embeddings[:0])
@@ -0,0 +1,245 @@
+"""
+HTTP caching and compression: in-memory static assets with precompressed variants,
+validators (ETag/Last-Modified) and 304s for read-heavy JSON endpoints
+"""
+import os
+import re
+import gzip
+import json
+import hashlib
+import mimetypes
+from pathlib import Path
+from email.utils import formatdate, parsedate_to_datetime
+from typing import Dict, Any, Optional, Callable, Tuple
+
+from fastapi import Request, Response
+
+try:
+    import brotli
+except ImportError:
+    # gzip only; install brotli for ~15-20% smaller text assets
+    brotli = None
+
+from metrics import record_cache
+
+# Responses smaller than this are sent uncompressed; framing overhead outweighs the savings
+COMPRESSION_MIN_BYTES = int(os.getenv("COMPRESSION_MIN_BYTES", "1024"))
+
+# Fingerprinted asset URLs (?v=<etag>) never change, so browsers may keep them for a year
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+# Everything else is stored but revalidated, which costs one 304 when nothing changed
+REVALIDATE_CACHE_CONTROL = "no-cache"
+
+# Hex digits of the ETag used as the ?v= fingerprint
+FINGERPRINT_LENGTH = 12
+
+# "/static/<name>" inside quotes or url(...) in an HTML page
+ASSET_REFERENCE = re.compile(r"""(?<=["'(])/static/([\w./-]+)(?=["')])""")
+
+def _etag_matches(request: Request, etag: str) -> bool:
+    header = request.headers.get("if-none-match")
+    if not header:
+        return False
+    if header.strip() == "*":
+        return True
+    # Weak comparison: a gzip-transformed W/ tag still identifies the same content
+    candidates = {tag.strip().removeprefix("W/") for tag in header.split(",")}
+    return etag.removeprefix("W/") in candidates
+
+def _not_modified_since(request: Request, last_modified: Optional[float]) -> bool:
+    header = request.headers.get("if-modified-since")
+    if not header or last_modified is None or "if-none-match" in request.headers:
+        return False
+    try:
+        return int(last_modified) <= parsedate_to_datetime(header).timestamp()
+    except (TypeError, ValueError):
+        return False
+
+def is_fresh(request: Request, etag: str, last_modified: Optional[float] = None) -> bool:
+    """True when the client's cached copy (If-None-Match / If-Modified-Since) is still current"""
+    return _etag_matches(request, etag) or _not_modified_since(request, last_modified)
+
+def accepted_encodings(header: str) -> Dict[str, float]:
+    """Content-codings in an Accept-Encoding header with their q-values"""
+    weights: Dict[str, float] = {}
+    for part in header.split(","):
+        coding, *params = part.split(";")
+        coding = coding.strip().lower()
+        if not coding:
+            continue
+        weight = 1.0
+        for param in params:
+            name, _, value = param.partition("=")
+            if name.strip().lower() == "q":
+                try:
+                    weight = min(1.0, max(0.0, float(value.strip())))
+                except ValueError:
+                    weight = 0.0
+        weights[coding] = weight
+    return weights
+
+def preferred_encoding(request: Request, available) -> Optional[str]:
+    """Best content-coding the client accepts among those available (highest q, then br over gzip)"""
+    weights = accepted_encodings(request.headers.get("accept-encoding", ""))
+    best, best_weight = None, 0.0
+    for encoding in ("br", "gzip"):
+        if encoding not in available:
+            continue
+        weight = weights.get(encoding, weights.get("*", 0.0))
+        if weight > best_weight:
+            best, best_weight = encoding, weight
+    return best
+
+def compress(body: bytes, encoding: str, level: Optional[int] = None) -> bytes:
+    if encoding == "br":
+        return brotli.compress(body, quality=11 if level is None else level)
+    return gzip.compress(body, compresslevel=9 if level is None else level, mtime=0)
+
+def not_modified(etag: str, last_modified: Optional[float] = None, cache_control: str = REVALIDATE_CACHE_CONTROL) -> Response:
+    headers = {"ETag": etag, "Cache-Control": cache_control, "Vary": "Accept-Encoding"}
+    if last_modified is not None:
+        headers["Last-Modified"] = formatdate(last_modified, usegmt=True)
+    return Response(status_code=304, headers=headers)
+
+def cached_response(
+    request: Request,
+    body: bytes,
+    media_type: str,
+    etag: Optional[str] = None,
+    last_modified: Optional[float] = None,
+    cache_control: str = REVALIDATE_CACHE_CONTROL,
+    cache_name: str = "http"
+) -> Response:
+    """Send body with validators, answering 304 when the client's copy is current
+
+    Bodies of at least COMPRESSION_MIN_BYTES are compressed on the fly with a
+    fast setting (brotli 4 / gzip 6) when the client accepts it.
+    """
+    etag = etag or '"' + hashlib.sha256(body).hexdigest()[:32] + '"'
+    if is_fresh(request, etag, last_modified):
+        record_cache(cache_name, True)
+        return not_modified(etag, last_modified, cache_control)
+    record_cache(cache_name, False)
+
+    headers = {"ETag": etag, "Cache-Control": cache_control, "Vary": "Accept-Encoding"}
+    if last_modified is not None:
+        headers["Last-Modified"] = formatdate(last_modified, usegmt=True)
+    if len(body) >= COMPRESSION_MIN_BYTES:
+        encoding = preferred_encoding(request, ("br", "gzip") if brotli else ("gzip",))
+        if encoding:
+            body = compress(body, encoding, level=4 if encoding == "br" else 6)
+            headers["Content-Encoding"] = encoding
+    return Response(content=body, media_type=media_type, headers=headers)
+
+def json_response(request: Request, payload: Any, etag: Optional[str] = None, last_modified: Optional[float] = None, cache_name: str = "http") -> Response:
+    body = json.dumps(payload, separators=(",", ":")).encode("utf-8")
+    return cached_response(request, body, "application/json", etag=etag, last_modified=last_modified, cache_name=cache_name)
+
+def file_etag(stat: os.stat_result) -> str:
+    """Validator from file metadata, so a 304 needs a stat() and no read"""
+    return f'"{stat.st_ino:x}-{stat.st_size:x}-{stat.st_mtime_ns:x}"'
+
+class StaticAsset:
+    """One file's bytes and compressed variants
+
+    transform, if given, rewrites the body on load and returns it with the
+    ETags of the other assets it embedded (see StaticAssets).
+    """
+
+    def __init__(self, path: Path, transform: Optional[Callable[[bytes], Tuple[bytes, Dict[str, str]]]] = None):
+        self.path = path
+        self.transform = transform
+        self.load()
+
+    def load(self):
+        body = self.path.read_bytes()
+        self.mtime_ns = self.path.stat().st_mtime_ns
+        self.dependencies: Dict[str, str] = {}
+        if self.transform is not None:
+            body, self.dependencies = self.transform(body)
+        self.media_type = mimetypes.guess_type(self.path.name)[0] or "application/octet-stream"
+        if self.media_type.startswith("text/") or self.media_type in ("application/javascript", "application/json"):
+            self.media_type += "; charset=utf-8"
+        self.etag = '"' + hashlib.sha256(body).hexdigest()[:32] + '"'
+        self.variants: Dict[Optional[str], bytes] = {None: body}
+        if len(body) >= COMPRESSION_MIN_BYTES and not self.media_type.startswith(("image/png", "image/jpeg", "font/woff")):
+            # Compressed once at maximum effort, served from memory afterwards
+            for encoding in ("br", "gzip") if brotli else ("gzip",):
+                compressed = compress(body, encoding)
+                if len(compressed) < len(body):
+                    self.variants[encoding] = compressed
+
+    def refresh(self):
+        """Pick up edits to the file (one stat per request)"""
+        try:
+            if self.path.stat().st_mtime_ns != self.mtime_ns:
+                self.load()
+        except OSError:
+            pass
+
+class StaticAssets:
+    """UI files held in memory with content-hash ETags and precomputed gzip/brotli variants
+
+    HTML pages have their /static/ references rewritten to fingerprinted URLs,
+    so the assets they load can be cached for a year and a changed asset is
+    fetched under a new URL.
+    """
+
+    def __init__(self, directory: str):
+        self.directory = Path(directory)
+        self.assets: Dict[str, StaticAsset] = {}
+        paths = [path for path in sorted(self.directory.rglob("*")) if path.is_file()]
+        # Pages last, so the assets they reference already have ETags
+        for path in sorted(paths, key=lambda path: path.suffix == ".html"):
+            transform = self._fingerprint_references if path.suffix == ".html" else None
+            self.assets[path.relative_to(self.directory).as_posix()] = StaticAsset(path, transform)
+
+    @staticmethod
+    def _version(asset: StaticAsset) -> str:
+        return asset.etag.strip('"')[:FINGERPRINT_LENGTH]
+
+    def url(self, name: str) -> str:
+        """Fingerprinted URL for an asset, cacheable for a year"""
+        return f"/static/{name}?v={self._version(self.assets[name])}"
+
+    def _fingerprint_references(self, body: bytes) -> Tuple[bytes, Dict[str, str]]:
+        dependencies: Dict[str, str] = {}
+
+        def replace(match: "re.Match") -> str:
+            name = match.group(1)
+            if name not in self.assets:
+                return match.group(0)
+            dependencies[name] = self.assets[name].etag
+            return self.url(name)
+
+        text = ASSET_REFERENCE.sub(replace, body.decode("utf-8"))
+        return text.encode("utf-8"), dependencies
+
+    def _refresh(self, asset: StaticAsset):
+        asset.refresh()
+        if asset.dependencies:
+            for name in asset.dependencies:
+                self.assets[name].refresh()
+            # A page embeds its assets' fingerprints; re-render it when one changed
+            if any(self.assets[name].etag != etag for name, etag in asset.dependencies.items()):
+                asset.load()
+
+    def response(self, request: Request, name: str, cache_control: Optional[str] = None) -> Optional[Response]:
+        asset = self.assets.get(name)
+        if asset is None:
+            return None
+        self._refresh(asset)
+        if cache_control is None:
+            # Only the current fingerprint is immutable; a stale or partial ?v= must revalidate
+            fingerprinted = request.query_params.get("v") == self._version(asset)
+            cache_control = IMMUTABLE_CACHE_CONTROL if fingerprinted else REVALIDATE_CACHE_CONTROL
+        if _etag_matches(request, asset.etag):
+            record_cache("static", True)
+            return not_modified(asset.etag, cache_control=cache_control)
+        record_cache("static", False)
+
+        encoding = preferred_encoding(request, asset.variants)
+        headers = {"ETag": asset.etag, "Cache-Control": cache_control, "Vary": "Accept-Encoding"}
+        if encoding:
+            headers["Content-Encoding"] = encoding
+        return Response(content=asset.variants[encoding], media_type=asset.media_type, headers=headers)
@@ -0,0 +1,416 @@
+"""
+In-process prioritized background job queue with coalescing and persistence
+"""
+import os
+import json
+import time
+import uuid
+import heapq
+import asyncio
+import logging
+from contextlib import asynccontextmanager
+from typing import List, Dict, Any, Optional, Callable, Awaitable, Union
+
+logger = logging.getLogger(__name__)
+
+# Job priorities: lower runs first
+PRIORITY_INTERACTIVE = 0
+PRIORITY_WRITE = 10
+PRIORITY_BULK = 20
+
+# Bulk jobs wait at most this long for interactive requests to finish
+INTERACTIVE_MAX_PAUSE_SECONDS = 30.0
+
+# Minimum time between progress events for a parent job
+PROGRESS_INTERVAL_SECONDS = 0.5
+
+class Job:
+    """A unit of background work, optionally the parent of child jobs"""
+
+    def __init__(
+        self,
+        kind: str,
+        payload: Dict[str, Any],
+        priority: int = PRIORITY_WRITE,
+        key: Optional[str] = None,
+        parent_id: Optional[str] = None,
+        job_id: Optional[str] = None
+    ):
+        self.id = job_id or uuid.uuid4().hex
+        self.kind = kind
+        self.payload = payload
+        self.priority = priority
+        self.key = key
+        self.parent_id = parent_id
+        # A keyed child coalesced into by later fan-outs counts toward each of their parents
+        self.parent_ids: List[str] = [parent_id] if parent_id else []
+        self.status = "queued"
+        self.error: Optional[str] = None
+        self.created_at = time.time()
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self.done = 0
+        self.total = 0
+        self.children_pending = 0
+        # Children from fan_out() that have not finished yet (key -> kind and payload), so a
+        # restart can re-create any that were lost
+        self.planned: Dict[str, Dict[str, Any]] = {}
+        self.result: Optional[Dict[str, Any]] = None  # handler-reported outcome, e.g. counts and throughput
+        self.last_published = 0.0
+
+    def eta_seconds(self) -> Optional[float]:
+        """Remaining time extrapolated from progress so far"""
+        if not self.started_at or not self.done or self.total <= self.done:
+            return None
+        elapsed = time.time() - self.started_at
+        return round(elapsed / self.done * (self.total - self.done), 1)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "id": self.id,
+            "kind": self.kind,
+            "payload": self.payload,
+            "priority": self.priority,
+            "key": self.key,
+            "parent_id": self.parent_id,
+            "parent_ids": self.parent_ids,
+            "status": self.status,
+            "error": self.error,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            "done": self.done,
+            "total": self.total,
+            "children_pending": self.children_pending,
+            "planned": self.planned,
+            "eta_seconds": self.eta_seconds(),
+            "result": self.result
+        }
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "Job":
+        job = cls(
+            data["kind"],
+            data["payload"],
+            priority=data["priority"],
+            key=data.get("key"),
+            parent_id=data.get("parent_id"),
+            job_id=data["id"]
+        )
+        for field in ("parent_ids", "status", "created_at", "started_at", "done", "total", "children_pending", "planned", "result"):
+            if field in data:
+                setattr(job, field, data[field])
+        return job
+
+# A handler receives a batch of jobs of its kind and the queue (to enqueue children/report)
+JobHandler = Callable[[List[Job], "JobQueue"], Awaitable[None]]
+
+class JobQueue:
+    """Priority queue of background jobs run by a small pool of asyncio workers
+
+    Jobs with the same key coalesce while queued: the newest payload wins and
+    the job keeps the most urgent priority. A parent job (e.g. indexing a whole
+    project) fans out into keyed child jobs and completes when they have all
+    run, so interactive work can overtake the remainder of a bulk operation.
+    Bulk jobs also yield while interactive requests are in flight. Queued jobs
+    are saved to ``state_path`` and resumed on restart.
+    """
+
+    def __init__(self, state_path: Optional[str] = None, workers: int = 2, history: int = 200):
+        self.state_path = state_path
+        self.worker_count = workers
+        self.history = history
+        self.jobs: Dict[str, Job] = {}
+        self._heap: List[Any] = []
+        self._sequence = 0
+        self._by_key: Dict[str, Job] = {}
+        self._handlers: Dict[str, JobHandler] = {}
+        self._batch_sizes: Dict[str, Union[int, Callable[[], int]]] = {}
+        self._listeners: List[Callable[[Dict[str, Any]], Awaitable[None]]] = []
+        self._workers: List[asyncio.Task] = []
+        self._wakeup = asyncio.Event()
+        self._idle = asyncio.Event()
+        self._idle.set()
+        self._interactive = 0
+        self._dirty = False
+
+    def register(self, kind: str, handler: JobHandler, batch_size: Union[int, Callable[[], int]] = 1):
+        """Register the handler for a job kind; batch_size > 1 lets it take several queued jobs at once
+
+        batch_size may be a callable, read each time a batch is taken, for limits
+        that change at runtime.
+        """
+        self._handlers[kind] = handler
+        self._batch_sizes[kind] = batch_size
+
+    def subscribe(self, listener: Callable[[Dict[str, Any]], Awaitable[None]]):
+        self._listeners.append(listener)
+
+    def unsubscribe(self, listener: Callable[[Dict[str, Any]], Awaitable[None]]):
+        if listener in self._listeners:
+            self._listeners.remove(listener)
+
+    def depth(self) -> int:
+        """Number of jobs waiting to run"""
+        return sum(1 for job in self.jobs.values() if job.status == "queued")
+
+    async def start(self):
+        """Resume persisted jobs and start the workers"""
+        self._load_state()
+        for _ in range(self.worker_count):
+            self._workers.append(asyncio.create_task(self._worker()))
+        self._workers.append(asyncio.create_task(self._persist_loop()))
+
+    async def stop(self):
+        for task in self._workers:
+            task.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+        self._save_state()
+
+    async def _persist_loop(self):
+        # Batch state writes so fanning out thousands of child jobs stays cheap
+        while True:
+            await asyncio.sleep(1.0)
+            if self._dirty:
+                self._save_state()
+
+    def enqueue(
+        self,
+        kind: str,
+        payload: Dict[str, Any],
+        priority: int = PRIORITY_WRITE,
+        key: Optional[str] = None,
+        parent: Optional[Job] = None
+    ) -> Job:
+        """Queue a job, coalescing with a queued job that has the same key"""
+        existing = self._by_key.get(key) if key else None
+        if existing is not None and existing.status == "queued":
+            existing.payload = payload
+            if priority < existing.priority:
+                existing.priority = priority
+                self._push(existing)
+            if parent is not None and parent.id not in existing.parent_ids:
+                existing.parent_ids.append(parent.id)
+                existing.parent_id = existing.parent_id or parent.id
+                parent.children_pending += 1
+            self._dirty = True
+            return existing
+
+        job = Job(kind, payload, priority=priority, key=key, parent_id=parent.id if parent else None)
+        if parent is not None:
+            parent.children_pending += 1
+        self.jobs[job.id] = job
+        if key:
+            self._by_key[key] = job
+        self._push(job)
+        self._dirty = True
+        return job
+
+    def fan_out(self, parent: Job, kind: str, children: Dict[str, Dict[str, Any]]) -> List[Job]:
+        """Queue a parent's children (key -> payload) all at once and record them on the parent
+
+        Nothing is awaited in between, so a persisted parent never has half its
+        children queued; the plan lets _load_state re-create any that are missing.
+        """
+        parent.total = len(children)
+        parent.planned = {key: {"kind": kind, "payload": payload} for key, payload in children.items()}
+        return [self.enqueue(kind, payload, priority=parent.priority, key=key, parent=parent) for key, payload in children.items()]
+
+    def _push(self, job: Job):
+        # Re-prioritized jobs leave a stale heap entry behind; _pop skips it
+        self._sequence += 1
+        heapq.heappush(self._heap, (job.priority, self._sequence, job.id))
+        self._wakeup.set()
+
+    def _pop(self) -> Optional[Job]:
+        while self._heap:
+            priority, _, job_id = heapq.heappop(self._heap)
+            job = self.jobs.get(job_id)
+            if job is not None and job.status == "queued" and job.priority == priority:
+                return job
+        return None
+
+    def _peek(self) -> Optional[Job]:
+        while self._heap:
+            priority, _, job_id = self._heap[0]
+            job = self.jobs.get(job_id)
+            if job is not None and job.status == "queued" and job.priority == priority:
+                return job
+            heapq.heappop(self._heap)
+        return None
+
+    def _take_batch(self) -> List[Job]:
+        first = self._pop()
+        if first is None:
+            return []
+        batch = [first]
+        batch_size = self._batch_sizes.get(first.kind, 1)
+        if callable(batch_size):
+            batch_size = batch_size()
+        while len(batch) < batch_size:
+            following = self._peek()
+            if following is None or following.kind != first.kind or following.priority != first.priority:
+                break
+            batch.append(self._pop())
+        return batch
+
+    @asynccontextmanager
+    async def interactive(self):
+        """Mark an interactive request in flight; bulk jobs wait until it finishes"""
+        self._interactive += 1
+        self._idle.clear()
+        try:
+            yield
+        finally:
+            self._interactive -= 1
+            if self._interactive == 0:
+                self._idle.set()
+
+    async def _worker(self):
+        while True:
+            batch = self._take_batch()
+            if not batch:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+
+            if batch[0].priority >= PRIORITY_BULK and self._interactive:
+                try:
+                    await asyncio.wait_for(self._idle.wait(), timeout=INTERACTIVE_MAX_PAUSE_SECONDS)
+                except asyncio.TimeoutError:
+                    pass
+
+            try:
+                await self._run(batch)
+            except Exception as e:
+                # Handler errors are handled in _run; this is bookkeeping failing, which must not kill the worker
+                logger.exception(f"Job worker error after running {batch[0].kind}: {e}")
+                for job in batch:
+                    if job.status not in ("completed", "failed"):
+                        job.status = "failed"
+                        job.error = str(e)
+                        job.finished_at = time.time()
+                self._dirty = True
+
+    async def _run(self, batch: List[Job]):
+        handler = self._handlers.get(batch[0].kind)
+        now = time.time()
+        for job in batch:
+            job.status = "running"
+            job.started_at = job.started_at or now
+            if job.key and self._by_key.get(job.key) is job:
+                del self._by_key[job.key]
+
+        try:
+            if handler is None:
+                raise RuntimeError(f"No handler registered for job kind {batch[0].kind}")
+            await handler(batch, self)
+        except Exception as e:
+            logger.error(f"Job {batch[0].kind} failed: {e}")
+            for job in batch:
+                job.status = "failed"
+                job.error = str(e)
+
+        for job in batch:
+            # Parents stay running until their children finish
+            if job.status == "running" and job.children_pending == 0:
+                job.status = "completed"
+            if job.status in ("completed", "failed"):
+                job.finished_at = time.time()
+                await self._child_finished(job)
+            await self.publish(job)
+
+        self._trim_history()
+        self._dirty = True
+
+    async def _child_finished(self, job: Job):
+        for parent_id in job.parent_ids:
+            parent = self.jobs.get(parent_id)
+            if parent is not None:
+                parent.planned.pop(job.key, None)
+                await self._parent_progress(parent)
+
+    async def _parent_progress(self, parent: Job):
+        parent.done += 1
+        parent.children_pending = max(0, parent.children_pending - 1)
+        if parent.children_pending == 0 and parent.status == "running":
+            parent.status = "completed"
+            parent.finished_at = time.time()
+        elif time.time() - parent.last_published < PROGRESS_INTERVAL_SECONDS:
+            return
+        await self.publish(parent)
+
+    async def publish(self, job: Job):
+        """Send a job's progress to every subscriber"""
+        job.last_published = time.time()
+        event = {"type": "job_progress", "data": job.to_dict()}
+        for listener in list(self._listeners):
+            try:
+                await listener(event)
+            except Exception:
+                self.unsubscribe(listener)
+
+    def _trim_history(self):
+        finished = [job for job in self.jobs.values() if job.status in ("completed", "failed")]
+        if len(finished) <= self.history:
+            return
+        finished.sort(key=lambda job: job.finished_at or 0)
+        for job in finished[:len(finished) - self.history]:
+            del self.jobs[job.id]
+
+    def _save_state(self):
+        self._dirty = False
+        if not self.state_path:
+            return
+        pending = [job.to_dict() for job in self.jobs.values() if job.status in ("queued", "running")]
+        try:
+            tmp_path = f"{self.state_path}.tmp"
+            with open(tmp_path, "w") as f:
+                json.dump(pending, f)
+            os.replace(tmp_path, self.state_path)
+        except OSError as e:
+            logger.warning(f"Could not persist job queue: {e}")
+
+    def _load_state(self):
+        if not self.state_path or not os.path.exists(self.state_path):
+            return
+        try:
+            with open(self.state_path, "r") as f:
+                pending = json.load(f)
+        except (OSError, ValueError) as e:
+            logger.warning(f"Could not read persisted job queue: {e}")
+            return
+
+        parents = []
+        for data in pending:
+            job = Job.from_dict(data)
+            self.jobs[job.id] = job
+            # Parents wait on their children; everything else runs again from the start
+            if job.children_pending or job.planned:
+                job.status = "running"
+                if job.planned:
+                    parents.append(job)
+                continue
+            job.status = "queued"
+            if job.key:
+                self._by_key[job.key] = job
+            self._push(job)
+
+        # The saved state can predate some of a parent's children; re-create those from its plan
+        restored = 0
+        for parent in parents:
+            parent.children_pending = len(parent.planned)
+            parent.done = max(0, parent.total - len(parent.planned))
+            for key, child in parent.planned.items():
+                existing = self._by_key.get(key)
+                if existing is not None:
+                    if parent.id not in existing.parent_ids:
+                        existing.parent_ids.append(parent.id)
+                    continue
+                job = Job(child["kind"], child["payload"], priority=parent.priority, key=key, parent_id=parent.id)
+                self.jobs[job.id] = job
+                self._by_key[key] = job
+                self._push(job)
+                restored += 1
+        logger.info(f"Resumed {len(pending)} background jobs ({restored} missing child jobs re-created)")
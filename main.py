@@ -4,23 +4,36 @@ Main application server that orchestrates the AI-powered IDE
 import os
 import asyncio
 import json
+import time
+import re
+import hashlib
 import logging
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Optional, Tuple
 from pathlib import Path
 
 import uvicorn
-from fastapi import FastAPI, HTTPException, WebSocket, WebSocketDisconnect
+from fastapi import FastAPI, HTTPException, Request, WebSocket, WebSocketDisconnect
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.staticfiles import StaticFiles
-from fastapi.responses import HTMLResponse
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
 import aiofiles
 import requests
-from sentence_transformers import SentenceTransformer
-import chromadb
-from chromadb.config import Settings
 import git
 
+from embeddings import load_embedding_backend
+from jobs import Job, JobQueue, PRIORITY_WRITE, PRIORITY_BULK
+from tracing import install_profiling, install_tracing, merge_server_timing, propagation_headers
+from metrics import QUEUE_DEPTH, instrument_app, record_cache, stage
+from prometheus_client import Histogram
+from sessions import ConversationStore
+from vector_store import FlatVectorStore
+from dependency_graph import DependencyGraph
+from patching import EDIT_FORMAT_INSTRUCTIONS, apply_patch, extract_edits
+from retrieval import RETRIEVAL_CANDIDATES, BM25Index, get_reranker, rank_candidates
+from agent_executor import Budget, BudgetExceeded, Step, TaskGraph, TaskGraphExecutor
+from admission import TIMEOUT_HEADER, install_admission_control, parse_limits
+from http_cache import StaticAssets, file_etag, is_fresh, json_response, not_modified
+
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -32,6 +45,40 @@ app = FastAPI(
     version="1.0.0"
 )
 
+class InteractiveRequestMiddleware:
+    """Let bulk background jobs yield to chat and code generation requests while they run
+
+    Installed before admission control so it sits inside it: requests turned
+    away with 429/503 never pause bulk jobs, and an admitted streamed response
+    counts as in flight until its body ends.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope.get("path") not in INTERACTIVE_ROUTES:
+            await self.app(scope, receive, send)
+            return
+        async with job_queue.interactive():
+            await self.app(scope, receive, send)
+
+app.add_middleware(InteractiveRequestMiddleware)
+
+# Bounded concurrency for model-backed routes; overflow waits briefly or gets 503 + Retry-After.
+# Installed before CORS so rejections still carry CORS headers.
+install_admission_control(
+    app,
+    parse_limits(os.getenv("ADMISSION_LIMITS", ""), {
+        "/api/chat": (8, 32),
+        "/api/code/generate": (8, 32),
+        "/api/agent/run": (2, 8)
+    }),
+    max_wait_seconds=float(os.getenv("ADMISSION_MAX_WAIT_SECONDS", "30")),
+    rate_per_second=float(os.getenv("RATE_LIMIT_PER_SECOND", "0")),
+    burst=float(os.getenv("RATE_LIMIT_BURST", "0"))
+)
+
 # Add CORS middleware
 app.add_middleware(
     CORSMiddleware,
@@ -41,14 +88,31 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Mount static files
-app.mount("/static", StaticFiles(directory="static"), name="static")
+# UI assets are held in memory with precompressed variants and content-hash ETags
+static_assets = StaticAssets("static")
+
+# Per-route latency histograms and the /metrics endpoint
+instrument_app(app)
+
+# Request-id propagation, opt-in Server-Timing spans and /admin/profile
+install_tracing(app)
+install_profiling(app)
+
+EMBEDDING_BATCH_SIZE = Histogram(
+    "embedding_batch_size",
+    "Number of texts per embedding call",
+    buckets=(1, 2, 4, 8, 16, 32, 64, 128, 256)
+)
 
 # Initialize components
 embedding_model = None
 vector_db = None
 vllm_base_url = "http://localhost:8000"
 
+# Model ids requested from the AI server, so a small model can serve chat and a larger one code
+chat_model = os.getenv("CHAT_MODEL", "local-model")
+codegen_model = os.getenv("CODEGEN_MODEL", "kimi-k2")
+
 # Data models
 class ChatMessage(BaseModel):
     role: str
@@ -58,39 +122,238 @@ class CodeRequest(BaseModel):
     prompt: str
     context: Optional[str] = None
     file_path: Optional[str] = None
+    project_path: Optional[str] = None
+    language: Optional[str] = None
 
 class FileOperation(BaseModel):
-    operation: str  # read, write, delete, list
+    operation: str  # read, write, patch, delete, list
     path: str
-    content: Optional[str] = None
+    content: Optional[str] = None  # file content for write; unified diff or SEARCH/REPLACE blocks for patch
 
 class ProjectRequest(BaseModel):
     name: str
     description: str
     template: Optional[str] = "basic"
 
+class ProjectIndexRequest(BaseModel):
+    action: str  # stats, drop, compact, rebuild
+    project_path: Optional[str] = None
+
+class GenerationJobRequest(BaseModel):
+    prompt: str  # instructions for each file; may use {path}, {name}, {stem}, {language}
+    project_path: str = "/app/data/projects"
+    glob: str = "**/*.py"
+    output_path: Optional[str] = None  # e.g. "tests/test_{stem}.py"; default rewrites each file in place
+    max_files: Optional[int] = None
+    max_tokens: Optional[int] = None  # default and cap: the AI server's completion limit
+    temperature: float = 0.2
+
 # Global variables
 projects_dir = Path("/app/data/projects")
 vector_db_path = "/app/data/vector_db"
+flat_index_path = "/app/data/flat_index"
+
+# "chroma", or "flat" for the memory-mapped index in vector_store.py (no Chroma import at all)
+vector_store_backend = os.getenv("VECTOR_STORE", "chroma")
+active_project_path = projects_dir.resolve()
+
+# Vector collections are kept per project, keyed by resolved project path
+project_collections: Dict[str, Any] = {}
+
+# Writes to a project's collection, compaction and index rebuilds take the project's lock
+project_index_locks: Dict[str, asyncio.Lock] = {}
+
+# Compaction builds the new collection under this suffix and renames it over the old one
+COMPACT_STAGING_SUFFIX = "-compacting"
+
+# Import graphs per project, built on first use and updated by the indexer
+project_graphs: Dict[str, DependencyGraph] = {}
+
+# BM25 indexes over each project's chunks, for the lexical half of hybrid retrieval
+project_lexical_indexes: Dict[str, BM25Index] = {}
+
+# Context assembly follows imports this many hops from the focus/best-matching files
+CONTEXT_GRAPH_DEPTH = int(os.getenv("CONTEXT_GRAPH_DEPTH", "2"))
+CONTEXT_GRAPH_MAX_FILES = int(os.getenv("CONTEXT_GRAPH_MAX_FILES", "4"))
+
+# Multi-step agent: concurrent steps and default per-request budgets
+AGENT_MAX_PARALLEL_STEPS = int(os.getenv("AGENT_MAX_PARALLEL_STEPS", "4"))
+AGENT_MAX_STEPS = int(os.getenv("AGENT_MAX_STEPS", "24"))
+AGENT_MAX_LLM_CALLS = int(os.getenv("AGENT_MAX_LLM_CALLS", "16"))
+AGENT_MAX_SECONDS = float(os.getenv("AGENT_MAX_SECONDS", "300"))
+
+# Bulk generation jobs: files per batch (0 = the AI server's generation concurrency) and limits
+BULK_GENERATE_BATCH_SIZE = int(os.getenv("BULK_GENERATE_BATCH_SIZE", "0"))
+BULK_GENERATE_MAX_FILES = int(os.getenv("BULK_GENERATE_MAX_FILES", "500"))
+# A long deadline puts bulk calls behind interactive ones in the AI server's deadline-ordered queue
+BULK_GENERATE_TIMEOUT_SECONDS = float(os.getenv("BULK_GENERATE_TIMEOUT_SECONDS", "600"))
+BULK_GENERATE_MAX_RETRIES = 3
+
+# Refreshed from the AI server's /health before each bulk job; these are used until it answers
+generation_limits = {
+    "max_concurrent": BULK_GENERATE_BATCH_SIZE or 2,
+    "max_completion_tokens": 2048
+}
+
+# Background indexing and maintenance work
+job_queue = JobQueue(
+    state_path=os.getenv("JOB_STATE_PATH", "/app/data/jobs.json"),
+    workers=int(os.getenv("JOB_WORKERS", "2"))
+)
+
+QUEUE_DEPTH.labels("jobs").set_function(job_queue.depth)
+
+# Requests that pause bulk background jobs while they are in flight
+INTERACTIVE_ROUTES = {"/api/chat", "/api/code/generate"}
+
+LANGUAGE_BY_EXTENSION = {
+    ".py": "python",
+    ".js": "javascript",
+    ".jsx": "javascript",
+    ".mjs": "javascript",
+    ".cjs": "javascript",
+    ".ts": "typescript",
+    ".tsx": "typescript",
+    ".html": "html",
+    ".css": "css",
+    ".json": "json",
+    ".md": "markdown",
+    ".java": "java",
+    ".go": "go",
+    ".rs": "rust",
+    ".rb": "ruby",
+    ".php": "php",
+    ".c": "c",
+    ".h": "c",
+    ".cpp": "cpp",
+    ".hpp": "cpp",
+    ".sh": "shell",
+    ".yml": "yaml",
+    ".yaml": "yaml",
+    ".toml": "toml",
+    ".sql": "sql",
+}
+
+# Directories and size limits used when (re)indexing a project
+INDEX_SKIP_DIRS = {".git", "node_modules", "__pycache__", ".venv", "venv", "dist", "build"}
+INDEX_MAX_FILE_BYTES = 512 * 1024
+
+# Files are indexed in chunks that end at top-level definitions, so an edit only re-embeds the chunks it touches
+CHUNK_MIN_LINES = 20
+CHUNK_MAX_LINES = 120
+
+def detect_language(path: str) -> str:
+    """Guess a file's language from its extension"""
+    return LANGUAGE_BY_EXTENSION.get(Path(path).suffix.lower(), "text")
+
+def resolve_project_path(project_path: Optional[str] = None) -> Path:
+    """Resolve a project path, defaulting to the active project"""
+    if not project_path:
+        return active_project_path
+    path = Path(project_path)
+    if not path.is_absolute():
+        path = projects_dir / path
+    return path.resolve()
+
+def project_for_file(file_path: Path, project_path: Optional[Path] = None) -> Path:
+    """Find the project a file is indexed under
+
+    A file inside the project a request is scoped to (default: the active
+    project, which may be the projects root) belongs to that project, so
+    retrieval with the same scope finds it. Other files fall back to their
+    top-level folder under the projects root.
+    """
+    file_path = file_path.resolve()
+    project_path = (project_path or active_project_path).resolve()
+    if project_path in file_path.parents:
+        return project_path
+    root = projects_dir.resolve()
+    try:
+        relative = file_path.relative_to(root)
+    except ValueError:
+        return file_path.parent
+    if len(relative.parts) > 1:
+        return root / relative.parts[0]
+    return root
+
+def project_collection_name(project_path: Path) -> str:
+    """Stable Chroma collection name for a project directory"""
+    digest = hashlib.sha1(str(project_path).encode("utf-8")).hexdigest()[:16]
+    return f"project_{digest}"
+
+def project_index_lock(project_path: Optional[Path] = None) -> asyncio.Lock:
+    return project_index_locks.setdefault(str(project_path or active_project_path), asyncio.Lock())
+
+def finish_interrupted_compaction(name: str):
+    """Complete a compaction that stopped after dropping the old collection but before the rename"""
+    if vector_store_backend == "flat":
+        return
+    try:
+        vector_db.get_collection(name)
+        return
+    except Exception:
+        pass
+    try:
+        staging = vector_db.get_collection(name + COMPACT_STAGING_SUFFIX)
+    except Exception:
+        return
+    logger.warning(f"Finishing interrupted compaction of {name}")
+    staging.modify(name=name)
+
+def get_project_collection(project_path: Optional[Path] = None, create: bool = True):
+    """Return the vector collection for a project, creating it lazily"""
+    project_path = project_path or active_project_path
+    key = str(project_path)
+    collection = project_collections.get(key)
+    if collection is None and vector_db is not None:
+        name = project_collection_name(project_path)
+        finish_interrupted_compaction(name)
+        if create:
+            collection = vector_db.get_or_create_collection(
+                name,
+                metadata={"project_path": key}
+            )
+        else:
+            try:
+                collection = vector_db.get_collection(name)
+            except Exception:
+                return None
+        project_collections[key] = collection
+    return collection
+
+def build_metadata_filter(paths: Optional[List[str]] = None, language: Optional[str] = None) -> Optional[Dict[str, Any]]:
+    """Build a Chroma where-filter from optional path and language constraints"""
+    clauses = []
+    if paths:
+        clauses.append({"path": {"$in": paths}})
+    if language:
+        clauses.append({"language": language})
+    if not clauses:
+        return None
+    if len(clauses) == 1:
+        return clauses[0]
+    return {"$and": clauses}
 
 async def initialize_components():
     """Initialize embedding model and vector database"""
     global embedding_model, vector_db
     
     try:
-        # Initialize embedding model
+        # Initialize embedding model (ONNX/int8 when it matches the reference, tuned for this CPU)
         logger.info("Loading embedding model...")
-        embedding_model = SentenceTransformer('all-MiniLM-L6-v2')
+        embedding_model = load_embedding_backend()
+        logger.info(f"Embedding backend: {embedding_model.describe()}")
         
         # Initialize vector database
-        logger.info("Initializing vector database...")
-        vector_db = chromadb.PersistentClient(path=vector_db_path)
+        logger.info(f"Initializing vector database ({vector_store_backend})...")
+        if vector_store_backend == "flat":
+            vector_db = FlatVectorStore(flat_index_path)
+        else:
+            import chromadb
+            vector_db = chromadb.PersistentClient(path=vector_db_path)
         
-        # Create default collection for code context
-        try:
-            collection = vector_db.get_collection("code_context")
-        except:
-            collection = vector_db.create_collection("code_context")
+        # Create the collection for the default project; others are created on first use
+        get_project_collection(active_project_path)
         
         logger.info("Components initialized successfully")
         
@@ -105,13 +368,32 @@ async def startup_event():
     
     # Ensure projects directory exists
     projects_dir.mkdir(parents=True, exist_ok=True)
+    
+    # Start background indexing; pending jobs from the last run are resumed
+    job_queue.register("index_file", run_index_file_jobs, batch_size=embedding_model.batch_size)
+    job_queue.register("index_project", run_index_project_job)
+    job_queue.register("generate_project", run_generate_project_job)
+    job_queue.register("generate_file", run_generate_file_jobs, batch_size=lambda: BULK_GENERATE_BATCH_SIZE or generation_limits["max_concurrent"])
+    await job_queue.start()
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    """Stop background workers and persist pending jobs"""
+    await job_queue.stop()
 
 @app.get("/")
-async def root():
+async def root(request: Request):
     """Serve the main interface"""
-    with open("static/index.html", "r") as f:
-        html_content = f.read()
-    return HTMLResponse(content=html_content, status_code=200)
+    # Revalidated on every load so a new UI is picked up immediately
+    return static_assets.response(request, "index.html", cache_control="no-cache")
+
+@app.get("/static/{name:path}")
+async def static_file(name: str, request: Request):
+    """Serve a UI asset; long-lived when requested with its ?v= fingerprint"""
+    response = static_assets.response(request, name)
+    if response is None:
+        raise HTTPException(status_code=404, detail="Not Found")
+    return response
 
 @app.get("/health")
 async def health_check():
@@ -120,7 +402,9 @@ async def health_check():
         "status": "healthy",
         "services": {
             "embedding_model": embedding_model is not None,
+            "embedding_backend": embedding_model.describe() if embedding_model else None,
             "vector_db": vector_db is not None,
+            "vector_store": vector_store_backend,
             "vllm": await check_vllm_health()
         }
     }
@@ -138,11 +422,85 @@ async def check_vllm_health():
 class AgenticChatRequest(BaseModel):
     message: str
     project_path: str = "/app/data/projects"
+    session_id: Optional[str] = None
+    file_path: Optional[str] = None  # file the user is working on, seeds import-graph context
+
+# Typed reply requested from the AI server; decoding is constrained to this schema
+FILE_OPERATIONS_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "response": {"type": "string"},
+        # Every create/write/patch carries its content; deletes, which have none, are listed apart
+        "operations": {
+            "type": "array",
+            "items": {
+                "type": "object",
+                "properties": {
+                    "operation": {"enum": ["create", "write", "patch"]},
+                    "path": {"type": "string", "minLength": 1},
+                    "content": {"type": "string", "minLength": 1}
+                },
+                "required": ["operation", "path", "content"],
+                "additionalProperties": False
+            }
+        },
+        "deletes": {"type": "array", "items": {"type": "string", "minLength": 1}}
+    },
+    "required": ["response", "operations", "deletes"],
+    "additionalProperties": False
+}
+
+FILE_OPERATIONS_INSTRUCTIONS = """Reply with a JSON object: "response" explains what you did for the user, "operations" lists files to create or change and "deletes" lists paths to delete (both empty if none).
+Each operation has "operation", "path" (relative to the project) and non-empty "content":
+- "create" / "write": content is the complete file
+- "patch": content is one or more SEARCH/REPLACE blocks for an existing file: "<<<<<<< SEARCH", the exact current lines, "=======", their replacement, ">>>>>>> REPLACE" (each marker on its own line)"""
 
 class AgenticChatResponse(BaseModel):
     response: str
     file_operations: List[Dict[str, Any]] = []
     files_modified: bool = False
+    session_id: Optional[str] = None
+
+async def post_chat_completion(payload: Dict[str, Any], timeout: float) -> requests.Response:
+    """Send a chat completion request to the AI server without blocking the event loop"""
+    loop = asyncio.get_running_loop()
+    # The AI server drops queued work once we would have given up on it
+    headers = {"Content-Type": "application/json", TIMEOUT_HEADER: str(timeout), **propagation_headers()}
+    with stage("llm_call"):
+        response = await loop.run_in_executor(None, lambda: requests.post(
+            f"{vllm_base_url}/v1/chat/completions",
+            json=payload,
+            headers=headers,
+            timeout=timeout
+        ))
+    merge_server_timing(response.headers.get("Server-Timing"), "ai_server")
+    return response
+
+async def summarize_conversation(previous_summary: str, turns: List[Dict[str, str]]) -> str:
+    """Fold older conversation turns into a running summary using the AI model"""
+    transcript = "\n\n".join(f"{turn['role']}: {turn['content']}" for turn in turns)
+    payload = {
+        "model": chat_model,
+        "messages": [
+            {"role": "system", "content": "You maintain a concise running summary of a coding session. Keep decisions, file names, requirements and open tasks. Drop pleasantries."},
+            {"role": "user", "content": f"Current summary:\n{previous_summary or '(none)'}\n\nNew conversation turns:\n{transcript}\n\nWrite the updated summary."}
+        ],
+        "temperature": 0.2,
+        "max_tokens": 512
+    }
+    
+    response = await post_chat_completion(payload, timeout=60)
+    response.raise_for_status()
+    return response.json()["choices"][0]["message"]["content"]
+
+# Server-side conversation sessions for /api/chat
+conversation_store = ConversationStore(
+    summarizer=summarize_conversation,
+    max_sessions=int(os.getenv("SESSION_MAX_COUNT", "256")),
+    ttl_seconds=float(os.getenv("SESSION_TTL_SECONDS", "3600")),
+    summary_threshold_tokens=int(os.getenv("SESSION_SUMMARY_THRESHOLD_TOKENS", "2000")),
+    keep_recent_turns=int(os.getenv("SESSION_KEEP_RECENT_TURNS", "4"))
+)
 
 class FolderSelectionRequest(BaseModel):
     folder_path: str
@@ -152,16 +510,28 @@ class FolderSelectionResponse(BaseModel):
     message: str
     folder_path: str
     success: bool = True
+    job_id: Optional[str] = None
 
 @app.post("/api/chat", response_model=AgenticChatResponse)
 async def agentic_chat(request: AgenticChatRequest):
     """Agentic chat interface that can modify files based on user requests"""
+    session = conversation_store.get_or_create(request.session_id)
     try:
         # Analyze the user's request to determine intent
         intent = await analyze_user_intent(request.message)
         
         # Get current project structure
-        project_files = await get_project_structure(request.project_path)
+        with stage("project_structure"):
+            project_files = await get_project_structure(request.project_path)
+        
+        # Code related to the request and the files it imports or is imported by
+        project_path = resolve_project_path(request.project_path)
+        with stage("context_retrieval"):
+            context = await get_relevant_context(
+                request.message,
+                project_path=project_path,
+                focus_paths=focus_paths_for(project_path, request.file_path)
+            )
         
         # Prepare system prompt for agentic behavior
         system_prompt = f"""You are an AI coding agent that can create, modify, and manage files. 
@@ -170,6 +540,9 @@ async def agentic_chat(request: AgenticChatRequest):
         Current project structure:
         {project_files}
         
+        Relevant code from the project:
+        {context or "(none indexed yet)"}
+        
         Based on the user's request, you should:
         1. Understand what they want to accomplish
         2. Determine what files need to be created or modified
@@ -179,52 +552,58 @@ async def agentic_chat(request: AgenticChatRequest):
         Always be helpful, accurate, and explain your actions clearly.
         If you need to create or modify files, describe exactly what you're doing.
         
-        User request: {request.message}
-        
-        Respond with a helpful explanation and indicate any file operations you would perform.
+        {FILE_OPERATIONS_INSTRUCTIONS}
         """
         
-        # Call the AI model
+        # Call the AI model with the session summary and recent turns
         payload = {
-            "model": "local-model",
-            "messages": [
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": request.message}
-            ],
+            "model": chat_model,
+            "messages": session.prompt_messages(system_prompt, request.message),
             "temperature": 0.7,
-            "max_tokens": 2048
+            "max_tokens": 2048,
+            "response_format": {
+                "type": "json_schema",
+                "json_schema": {"name": "file_operations", "schema": FILE_OPERATIONS_SCHEMA}
+            }
         }
         
-        response = requests.post(
-            f"{vllm_base_url}/v1/chat/completions",
-            json=payload,
-            headers={"Content-Type": "application/json"},
-            timeout=60
-        )
+        response = await post_chat_completion(payload, timeout=60)
         
         if response.status_code == 200:
             result = response.json()
             ai_response = result["choices"][0]["message"]["content"]
             
-            # Parse the AI response to extract file operations
-            file_operations = await extract_file_operations(ai_response, request.message)
+            # Typed operations when the server honoured the schema, explicit edit blocks otherwise
+            structured = parse_structured_reply(ai_response)
+            if structured is not None:
+                ai_response, file_operations = structured
+            else:
+                file_operations = extract_file_operations(ai_response)
             
             # Execute file operations if any
             files_modified = False
             if file_operations:
-                files_modified = await execute_file_operations(file_operations, request.project_path)
+                with stage("file_ops"):
+                    files_modified = await execute_file_operations(file_operations, request.project_path)
+            
+            # Record the exchange and compact the session in the background if it grew too large
+            session.add_turn("user", request.message)
+            session.add_turn("assistant", ai_response)
+            conversation_store.maybe_compact(session)
             
             return AgenticChatResponse(
                 response=ai_response,
                 file_operations=file_operations,
-                files_modified=files_modified
+                files_modified=files_modified,
+                session_id=session.session_id
             )
         else:
             # Fallback response if AI service is not available
             return AgenticChatResponse(
                 response="I understand you want to work on your code. However, the AI service is currently unavailable. Please try again later or check the service status.",
                 file_operations=[],
-                files_modified=False
+                files_modified=False,
+                session_id=session.session_id
             )
             
     except Exception as e:
@@ -232,12 +611,279 @@ async def agentic_chat(request: AgenticChatRequest):
         return AgenticChatResponse(
             response=f"I encountered an error while processing your request: {str(e)}. Please try again or rephrase your request.",
             file_operations=[],
-            files_modified=False
+            files_modified=False,
+            session_id=session.session_id
+        )
+
+@app.get("/api/chat/sessions/{session_id}")
+async def get_chat_session(session_id: str):
+    """Inspect a conversation session's summary and recent turns"""
+    session = conversation_store.get(session_id)
+    if session is None:
+        raise HTTPException(status_code=404, detail="Session not found")
+    return session.to_dict()
+
+@app.delete("/api/chat/sessions/{session_id}")
+async def delete_chat_session(session_id: str):
+    """Forget a conversation session"""
+    if not conversation_store.delete(session_id):
+        raise HTTPException(status_code=404, detail="Session not found")
+    return {"message": "Session deleted successfully"}
+
+class AgentRunRequest(BaseModel):
+    message: str
+    project_path: str = "/app/data/projects"
+    session_id: Optional[str] = None
+    file_path: Optional[str] = None
+    max_llm_calls: int = AGENT_MAX_LLM_CALLS
+    max_seconds: float = AGENT_MAX_SECONDS
+    stream: bool = False  # server-sent events with per-step progress
+
+AGENT_PLAN_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "response": {"type": "string"},
+        "steps": {
+            "type": "array",
+            "maxItems": AGENT_MAX_STEPS,
+            "items": {
+                "type": "object",
+                "properties": {
+                    "id": {"type": "string"},
+                    "action": {"enum": ["read", "search", "create", "write", "patch", "delete"]},
+                    "path": {"type": "string"},
+                    "query": {"type": "string"},
+                    "instructions": {"type": "string"},
+                    "depends_on": {"type": "array", "items": {"type": "string"}}
+                },
+                "required": ["id", "action"],
+                "additionalProperties": False
+            }
+        }
+    },
+    "required": ["response", "steps"],
+    "additionalProperties": False
+}
+
+AGENT_PLAN_INSTRUCTIONS = """Plan the work as a JSON object: "response" summarizes the plan for the user, "steps" lists the steps.
+Each step has a unique "id" and an "action":
+- "read" (path) or "search" (query) gathers information
+- "create", "write" or "patch" (path, instructions) changes one file; its content is generated in a later call
+- "delete" (path) removes a file
+List in "depends_on" the ids of steps whose output a step needs. Steps without dependencies run in parallel, so only add real dependencies. Use one step per file."""
+
+FILE_CONTENT_SCHEMA = {
+    "type": "object",
+    "properties": {"content": {"type": "string"}},
+    "required": ["content"],
+    "additionalProperties": False
+}
+
+# Dependency output passed to a step's prompt is truncated to this many characters each
+AGENT_STEP_INPUT_CHARS = 6000
+
+async def agent_llm_call(budget: Budget, messages: List[Dict[str, str]], schema: Dict[str, Any], max_tokens: int) -> Dict[str, Any]:
+    """One budgeted, schema-constrained completion, parsed"""
+    budget.charge_llm_call()
+    payload = {
+        "model": codegen_model,
+        "messages": messages,
+        "temperature": 0.2,
+        "max_tokens": max_tokens,
+        "response_format": {"type": "json_schema", "json_schema": {"name": "agent", "schema": schema}}
+    }
+    response = await post_chat_completion(payload, timeout=max(1.0, budget.remaining_seconds()))
+    response.raise_for_status()
+    return json.loads(response.json()["choices"][0]["message"]["content"])
+
+def plan_to_graph(plan: Dict[str, Any]) -> TaskGraph:
+    """Turn the model's plan into a TaskGraph; raises ValueError for malformed plans"""
+    steps = []
+    for item in plan.get("steps", [])[:AGENT_MAX_STEPS]:
+        action = item["action"]
+        path = item.get("path", "")
+        if action != "search" and not path:
+            raise ValueError(f"Step {item['id']} ({action}) needs a path")
+        steps.append(Step(
+            item["id"],
+            action,
+            payload={key: item[key] for key in ("path", "query", "instructions") if key in item},
+            depends_on=item.get("depends_on", []),
+            reads=[path] if action == "read" else [],
+            writes=[path] if action in ("create", "write", "patch", "delete") else []
+        ))
+    return TaskGraph(steps)
+
+def agent_runners(project_path: Path, budget: Budget, task: str) -> Dict[str, Any]:
+    """Coroutines that carry out each plan action inside one project"""
+
+    def confined(relative_path: str) -> Path:
+        path = (project_path / relative_path).resolve()
+        if project_path not in path.parents:
+            raise ValueError(f"Path outside the project: {relative_path}")
+        return path
+
+    def describe_inputs(inputs: Dict[str, Any]) -> str:
+        return "\n\n".join(
+            f"Output of step {step_id}:\n{str(result)[:AGENT_STEP_INPUT_CHARS]}"
+            for step_id, result in sorted(inputs.items()) if result
+        )
+
+    async def read(step: Step, inputs: Dict[str, Any]) -> str:
+        async with aiofiles.open(confined(step.payload["path"]), 'r') as f:
+            return await f.read()
+
+    async def search(step: Step, inputs: Dict[str, Any]) -> str:
+        return await get_relevant_context(step.payload.get("query") or task, project_path=project_path)
+
+    async def edit(step: Step, inputs: Dict[str, Any]) -> Dict[str, Any]:
+        path = confined(step.payload["path"])
+        current = ""
+        if step.action != "create" and path.is_file():
+            async with aiofiles.open(path, 'r') as f:
+                current = await f.read()
+        if step.action == "patch":
+            wanted = f"SEARCH/REPLACE blocks that make the change.\n{EDIT_FORMAT_INSTRUCTIONS}"
+        else:
+            wanted = "the complete new content of the file"
+        current_section = f"Current content of {step.payload['path']}:\n{current}" if current else ""
+        prompt = f"""Overall task: {task}
+
+This step: {step.action} {step.payload['path']}
+{step.payload.get('instructions', '')}
+
+{current_section}
+
+{describe_inputs(inputs)}
+
+Reply with a JSON object whose "content" is {wanted}"""
+        reply = await agent_llm_call(
+            budget,
+            [{"role": "system", "content": "You are an AI coding agent carrying out one step of a larger plan."},
+             {"role": "user", "content": prompt}],
+            FILE_CONTENT_SCHEMA,
+            max_tokens=2048
+        )
+        operation = {
+            "operation": "PATCH" if step.action == "patch" else "WRITE",
+            "file_path": step.payload["path"],
+            "description": step.payload.get("instructions", "")
+        }
+        operation["patch" if step.action == "patch" else "content"] = reply["content"]
+        await execute_file_operations([operation], str(project_path))
+        if operation.get("status") != "applied":
+            raise RuntimeError(f"{step.action} of {step.payload['path']} was not applied: {operation.get('conflicts') or operation.get('status')}")
+        return {"path": step.payload["path"], "status": "applied"}
+
+    async def delete(step: Step, inputs: Dict[str, Any]) -> Dict[str, Any]:
+        confined(step.payload["path"])
+        operation = {"operation": "DELETE", "file_path": step.payload["path"]}
+        await execute_file_operations([operation], str(project_path))
+        return {"path": step.payload["path"], "status": operation.get("status")}
+
+    return {"read": read, "search": search, "create": edit, "write": edit, "patch": edit, "delete": delete}
+
+async def run_agent(request: AgentRunRequest, emit) -> Dict[str, Any]:
+    """Plan a task graph with one LLM call, then run its steps concurrently within the budget"""
+    session = conversation_store.get_or_create(request.session_id)
+    budget = Budget(request.max_llm_calls, request.max_seconds)
+    project_path = resolve_project_path(request.project_path)
+    
+    with stage("project_structure"):
+        project_files = await get_project_structure(str(project_path))
+    with stage("context_retrieval"):
+        context = await get_relevant_context(
+            request.message,
+            project_path=project_path,
+            focus_paths=focus_paths_for(project_path, request.file_path)
         )
+    
+    system_prompt = f"""You are an AI coding agent that plans multi-step changes to a project.
+    
+    Current project structure:
+    {project_files}
+    
+    Relevant code from the project:
+    {context or "(none indexed yet)"}
+    
+    {AGENT_PLAN_INSTRUCTIONS}
+    """
+    graph = TaskGraph([])
+    try:
+        with stage("agent_plan"):
+            plan = await agent_llm_call(
+                budget,
+                session.prompt_messages(system_prompt, request.message),
+                AGENT_PLAN_SCHEMA,
+                max_tokens=2048
+            )
+        summary = plan.get("response", "")
+        graph = plan_to_graph(plan)
+    except (BudgetExceeded, ValueError, KeyError, requests.RequestException) as e:
+        logger.warning(f"Agent planning failed: {e}")
+        summary = f"I could not plan this request: {e}"
+    await emit({"type": "plan", "data": {"response": summary, "steps": graph.to_dict()}})
+    
+    executor = TaskGraphExecutor(
+        agent_runners(project_path, budget, request.message),
+        budget,
+        max_parallel=AGENT_MAX_PARALLEL_STEPS,
+        on_event=emit
+    )
+    with stage("agent_steps"):
+        await executor.run(graph)
+    
+    steps = graph.to_dict()
+    session.add_turn("user", request.message)
+    session.add_turn("assistant", summary)
+    conversation_store.maybe_compact(session)
+    result = {
+        "response": summary,
+        "steps": steps,
+        "files_modified": any(step["status"] == "done" and step["action"] not in ("read", "search") for step in steps),
+        "budget": budget.to_dict(),
+        "session_id": session.session_id
+    }
+    await emit({"type": "done", "data": result})
+    return result
+
+@app.post("/api/agent/run")
+async def agent_run(request: AgentRunRequest):
+    """Multi-step agent: plan, run independent steps concurrently, optionally stream step progress"""
+    if not request.stream:
+        async def ignore(event: Dict[str, Any]):
+            pass
+        return await run_agent(request, ignore)
+    
+    events: asyncio.Queue = asyncio.Queue()
+    
+    async def produce():
+        try:
+            await run_agent(request, events.put)
+        except Exception as e:
+            logger.error(f"Agent run error: {e}")
+            await events.put({"type": "error", "data": {"detail": str(e)}})
+        finally:
+            await events.put(None)
+    
+    async def event_stream():
+        task = asyncio.create_task(produce())
+        try:
+            while True:
+                event = await events.get()
+                if event is None:
+                    break
+                yield f"event: {event['type']}\ndata: {json.dumps(event['data'], default=str)}\n\n"
+        finally:
+            # The client went away: stop the remaining steps
+            task.cancel()
+    
+    return StreamingResponse(event_stream(), media_type="text/event-stream")
 
 @app.post("/api/folder/select", response_model=FolderSelectionResponse)
 async def select_folder(request: FolderSelectionRequest):
     """Handle folder selection from the frontend"""
+    global active_project_path
     try:
         logger.info(f"Folder selected: {request.folder_path} with {request.file_count} files")
         
@@ -245,6 +891,11 @@ async def select_folder(request: FolderSelectionRequest):
         if not request.folder_path or '..' in request.folder_path:
             raise HTTPException(status_code=400, detail="Invalid folder path")
         
+        # Scope context retrieval to the selected project and index it in the background
+        active_project_path = resolve_project_path(request.folder_path)
+        get_project_collection(active_project_path)
+        job = enqueue_project_index(active_project_path) if active_project_path.is_dir() else None
+        
         # Create a friendly response message
         if request.file_count > 0:
             message = f"Great! I've selected the folder '{request.folder_path}' with {request.file_count} files. I'm ready to help you work with your code!"
@@ -254,7 +905,8 @@ async def select_folder(request: FolderSelectionRequest):
         return FolderSelectionResponse(
             message=message,
             folder_path=request.folder_path,
-            success=True
+            success=True,
+            job_id=job.id if job else None
         )
         
     except Exception as e:
@@ -265,8 +917,16 @@ async def select_folder(request: FolderSelectionRequest):
 async def generate_code(request: CodeRequest):
     """Generate code based on prompt and context"""
     try:
-        # Get relevant context from vector database
-        context = await get_relevant_context(request.prompt)
+        project_path = resolve_project_path(request.project_path)
+        
+        # Get relevant context from the project's vector collection
+        with stage("context_retrieval"):
+            context = await get_relevant_context(
+                request.prompt,
+                project_path=project_path,
+                language=request.language,
+                focus_paths=focus_paths_for(project_path, request.file_path)
+            )
         
         # Prepare system prompt for code generation
         system_prompt = """You are an expert software developer. Generate high-quality, well-documented code based on the user's request. 
@@ -283,25 +943,20 @@ async def generate_code(request: CodeRequest):
         
         # Call the AI model
         payload = {
-            "model": "kimi-k2",
+            "model": codegen_model,
             "messages": messages,
             "temperature": 0.3,
             "max_tokens": 4096
         }
         
-        response = requests.post(
-            f"{vllm_base_url}/v1/chat/completions",
-            json=payload,
-            headers={"Content-Type": "application/json"},
-            timeout=120
-        )
+        response = await post_chat_completion(payload, timeout=120)
         
         if response.status_code == 200:
             result = response.json()
             generated_code = result["choices"][0]["message"]["content"]
             
             # Store the generated code in vector database for future context
-            await store_code_context(request.prompt, generated_code)
+            await store_code_context(request.prompt, generated_code, project_path=project_path)
             
             return {"code": generated_code, "context_used": context}
         else:
@@ -311,61 +966,607 @@ async def generate_code(request: CodeRequest):
         logger.error(f"Code generation error: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
-async def get_relevant_context(query: str, max_results: int = 5) -> str:
-    """Get relevant context from vector database"""
+async def get_relevant_context(
+    query: str,
+    max_results: int = 5,
+    project_path: Optional[Path] = None,
+    paths: Optional[List[str]] = None,
+    language: Optional[str] = None,
+    focus_paths: Optional[List[str]] = None
+) -> str:
+    """Get relevant context from a project's vector collection
+
+    Vector and BM25 hits are fused by reciprocal rank, chunks below the
+    similarity floor are dropped, the rest are optionally reranked by a
+    cross-encoder and picked for diversity (MMR). Besides these, chunks from
+    files near the focus files (or, without any, the best-matching files) in
+    the import graph are prefetched with the same query embedding and ranked
+    by graph distance.
+    """
     try:
         if not vector_db or not embedding_model:
             return ""
         
-        collection = vector_db.get_collection("code_context")
+        project_path = project_path or active_project_path
+        collection = get_project_collection(project_path)
+        if collection is None or collection.count() == 0:
+            return ""
         
         # Generate embedding for the query
-        query_embedding = embedding_model.encode([query])
+        query_embedding = await encode_texts([query])
         
-        # Search for similar content
-        results = collection.query(
-            query_embeddings=query_embedding.tolist(),
-            n_results=max_results
-        )
+        # Search for similar content, optionally scoped by path/language metadata
+        where = build_metadata_filter(paths, language)
+        with stage("vector_query"):
+            results = collection.query(
+                query_embeddings=query_embedding.tolist(),
+                n_results=min(max(max_results, RETRIEVAL_CANDIDATES), collection.count()),
+                where=where
+            )
+        vector_ids = results["ids"][0] if results["ids"] else []
+        
+        # Exact identifiers and rare terms that embeddings blur
+        lexical_index = await get_lexical_index(project_path)
+        with stage("lexical_query"):
+            lexical_hits = lexical_index.search(query, RETRIEVAL_CANDIDATES, where)
         
-        # Combine relevant documents
-        context_parts = []
-        if results["documents"]:
-            for doc in results["documents"][0]:
-                context_parts.append(doc)
+        candidate_ids = list(dict.fromkeys(vector_ids + [doc_id for doc_id, _ in lexical_hits]))
+        entries = collection.get(ids=candidate_ids, include=["documents", "metadatas", "embeddings"]) if candidate_ids else {"ids": []}
+        candidates = {
+            doc_id: (entries["documents"][i], entries["metadatas"][i] or {}, entries["embeddings"][i])
+            for i, doc_id in enumerate(entries["ids"])
+        }
+        reranker = get_reranker()
+        loop = asyncio.get_running_loop()
+        with stage("rerank" if reranker else "rank_fusion"):
+            selected = await loop.run_in_executor(None, lambda: rank_candidates(
+                query, query_embedding[0], vector_ids, lexical_hits, candidates, max_results, reranker
+            ))
+        similar = [(candidates[doc_id][0], candidates[doc_id][1]) for doc_id in selected]
+        
+        # Import-graph neighbours of the focus files, nearest first
+        seeds = focus_paths or [metadata["path"] for _, metadata in similar if metadata and metadata.get("kind") == "file"]
+        ranked: List[Tuple[int, int, str]] = []
+        if seeds and CONTEXT_GRAPH_DEPTH > 0:
+            graph = await get_dependency_graph(project_path)
+            distances = graph.neighbors(seeds, CONTEXT_GRAPH_DEPTH)
+            if not focus_paths:
+                # Best matches are already in the similarity results
+                distances = {path: distance for path, distance in distances.items() if distance > 0}
+            if paths:
+                distances = {path: distance for path, distance in distances.items() if path in paths}
+            nearest = sorted(distances, key=lambda path: (distances[path], path))[:CONTEXT_GRAPH_MAX_FILES]
+            if nearest:
+                with stage("graph_prefetch"):
+                    neighbours = collection.query(
+                        query_embeddings=query_embedding.tolist(),
+                        n_results=min(len(nearest) * 2, collection.count()),
+                        where=build_metadata_filter(nearest, language)
+                    )
+                for rank, (doc, metadata) in enumerate(zip(neighbours["documents"][0], neighbours["metadatas"][0])):
+                    ranked.append((distances[metadata["path"]], rank, doc))
+        
+        # Focus files first, then direct imports/importers, then similarity hits, then the rest
+        ranked.sort()
+        context_parts = [doc for distance, _, doc in ranked if distance <= 1]
+        context_parts += [doc for doc, _ in similar]
+        context_parts += [doc for distance, _, doc in ranked if distance > 1]
         
-        return "\n\n".join(context_parts)
+        return "\n\n".join(dict.fromkeys(context_parts))
         
     except Exception as e:
         logger.error(f"Context retrieval error: {e}")
         return ""
 
-async def store_code_context(prompt: str, code: str):
-    """Store code and prompt in vector database for future context"""
+def focus_paths_for(project_path: Path, file_path: Optional[str]) -> Optional[List[str]]:
+    """Turn a request's file path into a project-relative focus path"""
+    if not file_path:
+        return None
+    path = Path(file_path)
+    if path.is_absolute():
+        try:
+            path = path.resolve().relative_to(project_path)
+        except ValueError:
+            return None
+    return [path.as_posix()]
+
+async def get_dependency_graph(project_path: Path) -> DependencyGraph:
+    """Return a project's import graph, building it from disk on first use"""
+    key = str(project_path)
+    graph = project_graphs.get(key)
+    if graph is not None:
+        return graph
+    
+    def build() -> DependencyGraph:
+        graph = DependencyGraph()
+        files = []
+        if project_path.is_dir():
+            for item in iter_project_files(project_path):
+                try:
+                    files.append((item.relative_to(project_path).as_posix(), item.read_text()))
+                except (UnicodeDecodeError, OSError):
+                    continue
+        graph.build(files)
+        return graph
+    
+    loop = asyncio.get_running_loop()
+    with stage("graph_build"):
+        graph = await loop.run_in_executor(None, build)
+    return project_graphs.setdefault(key, graph)
+
+async def get_lexical_index(project_path: Path) -> BM25Index:
+    """Return a project's BM25 index, building it from the stored chunks on first use
+
+    The build holds the project's index lock, so index writes wait for it and
+    then update the finished index instead of being missed by the snapshot.
+    """
+    key = str(project_path)
+    index = project_lexical_indexes.get(key)
+    if index is not None:
+        return index
+    
+    async with project_index_lock(project_path):
+        index = project_lexical_indexes.get(key)
+        if index is not None:
+            return index
+        collection = get_project_collection(project_path)
+        
+        def build() -> BM25Index:
+            index = BM25Index()
+            entries = collection.get(include=["documents", "metadatas"])
+            for doc_id, document, metadata in zip(entries["ids"], entries["documents"], entries["metadatas"]):
+                index.add(doc_id, document or "", metadata)
+            return index
+        
+        loop = asyncio.get_running_loop()
+        with stage("lexical_build"):
+            index = await loop.run_in_executor(None, build)
+        project_lexical_indexes[key] = index
+        return index
+
+async def store_code_context(prompt: str, code: str, project_path: Optional[Path] = None):
+    """Store generated code and its prompt in vector database for future context
+
+    Snippets are keyed by content hash so identical generations are stored once;
+    project files are indexed by store_file_contexts instead.
+    """
     try:
         if not vector_db or not embedding_model:
             return
         
-        collection = vector_db.get_collection("code_context")
-        
         # Create document content
         document = f"Prompt: {prompt}\n\nCode:\n{code}"
         
-        # Generate embedding
-        embedding = embedding_model.encode([document])
+        doc_id = f"snippet:{hashlib.sha1(document.encode('utf-8')).hexdigest()}"
+        metadata = {"kind": "snippet", "path": "", "language": "text"}
+        
+        # Generate embedding off the event loop
+        embedding = await encode_texts([document])
         
         # Store in vector database
-        collection.add(
-            documents=[document],
-            embeddings=embedding.tolist(),
-            ids=[f"code_{len(collection.get()['ids']) + 1}"]
-        )
+        async with project_index_lock(project_path):
+            collection = get_project_collection(project_path)
+            collection.upsert(
+                documents=[document],
+                embeddings=embedding.tolist(),
+                metadatas=[metadata],
+                ids=[doc_id]
+            )
+            lexical_index = project_lexical_indexes.get(str(project_path or active_project_path))
+            if lexical_index is not None:
+                lexical_index.add(doc_id, document, metadata)
         
     except Exception as e:
         logger.error(f"Context storage error: {e}")
 
+async def remove_code_context(path: str, project_path: Optional[Path] = None):
+    """Remove a file's entries from its project's vector collection"""
+    try:
+        async with project_index_lock(project_path):
+            collection = get_project_collection(project_path, create=False)
+            if collection is not None:
+                collection.delete(where={"path": path})
+            lexical_index = project_lexical_indexes.get(str(project_path or active_project_path))
+            if lexical_index is not None:
+                lexical_index.remove_where({"path": path})
+    except Exception as e:
+        logger.error(f"Context removal error: {e}")
+
+def iter_project_files(project_path: Path):
+    """Yield indexable text files in a project"""
+    for item in project_path.rglob('*'):
+        if not item.is_file() or any(part in INDEX_SKIP_DIRS for part in item.relative_to(project_path).parts):
+            continue
+        if item.stat().st_size > INDEX_MAX_FILE_BYTES:
+            continue
+        yield item
+
+async def encode_texts(texts: List[str]):
+    """Embed texts in a worker thread so the event loop keeps serving requests"""
+    EMBEDDING_BATCH_SIZE.observe(len(texts))
+    loop = asyncio.get_running_loop()
+    with stage("embedding"):
+        return await loop.run_in_executor(None, embedding_model.encode, texts)
+
+def split_into_chunks(content: str) -> List[str]:
+    """Split a file into chunks at unindented lines (top-level definitions)
+
+    Boundaries depend only on nearby content, so after an edit the chunking
+    re-synchronises right after the changed region and untouched chunks keep
+    their content (and therefore their ids).
+    """
+    lines = content.splitlines(keepends=True)
+    chunks = []
+    start = 0
+    previous = ""
+    for i, line in enumerate(lines):
+        size = i - start
+        starts_definition = line[:1].strip() and line[0] not in ")]}" and not previous.startswith("@")
+        if (size >= CHUNK_MIN_LINES and starts_definition) or size >= CHUNK_MAX_LINES:
+            chunks.append("".join(lines[start:i]))
+            start = i
+        if line.strip():
+            previous = line
+    if start < len(lines):
+        chunks.append("".join(lines[start:]))
+    return chunks or [content]
+
+def chunk_ids(path: str, chunks: List[str]) -> List[str]:
+    """Content-addressed chunk ids; repeated identical chunks get an occurrence suffix"""
+    ids = []
+    seen: Dict[str, int] = {}
+    for chunk in chunks:
+        digest = hashlib.sha1(chunk.encode("utf-8")).hexdigest()[:16]
+        seen[digest] = seen.get(digest, 0) + 1
+        ids.append(f"file:{path}:{digest}" + (f"#{seen[digest]}" if seen[digest] > 1 else ""))
+    return ids
+
+async def store_file_contexts(project_path: Path, files: List[Tuple[str, str]]):
+    """Embed and store a batch of files, re-embedding only chunks whose content changed"""
+    if not vector_db or not embedding_model or not files:
+        return
+    
+    async with project_index_lock(project_path):
+        await _store_file_contexts(project_path, files)
+
+async def _store_file_contexts(project_path: Path, files: List[Tuple[str, str]]):
+    collection = get_project_collection(project_path)
+    existing = collection.get(where={"path": {"$in": [path for path, _ in files]}}, include=["metadatas"])
+    stored_ids = {
+        doc_id for doc_id, metadata in zip(existing["ids"], existing["metadatas"])
+        if (metadata or {}).get("kind") == "file"
+    }
+    
+    ids, documents, metadatas = [], [], []
+    current_ids = set()
+    for path, content in files:
+        chunks = split_into_chunks(content)
+        for doc_id, chunk in zip(chunk_ids(path, chunks), chunks):
+            current_ids.add(doc_id)
+            unchanged = doc_id in stored_ids
+            record_cache("index_content_hash", unchanged)
+            if unchanged:
+                continue
+            ids.append(doc_id)
+            documents.append(f"Prompt: File: {path}\n\nCode:\n{chunk}")
+            metadatas.append({"kind": "file", "path": path, "language": detect_language(path)})
+    
+    if ids:
+        embeddings = await encode_texts(documents)
+        collection.upsert(ids=ids, documents=documents, embeddings=embeddings.tolist(), metadatas=metadatas)
+    
+    # Chunks that no longer exist in the new content (including pre-chunking whole-file entries)
+    stale = list(stored_ids - current_ids)
+    if stale:
+        collection.delete(ids=stale)
+    
+    lexical_index = project_lexical_indexes.get(str(project_path))
+    if lexical_index is not None:
+        for doc_id, document, metadata in zip(ids, documents, metadatas):
+            lexical_index.add(doc_id, document, metadata)
+        for doc_id in stale:
+            lexical_index.remove(doc_id)
+
+def enqueue_file_index(project_path: Path, relative_path: str, priority: int = PRIORITY_WRITE, parent: Optional[Job] = None) -> Job:
+    """Queue (re)indexing of one file; a missing file is removed from the index"""
+    return job_queue.enqueue(
+        "index_file",
+        {"project_path": str(project_path), "path": relative_path},
+        priority=priority,
+        key=f"index_file:{project_path}:{relative_path}",
+        parent=parent
+    )
+
+def enqueue_project_index(project_path: Path) -> Job:
+    """Queue indexing of every file in a project at bulk priority"""
+    return job_queue.enqueue(
+        "index_project",
+        {"project_path": str(project_path)},
+        priority=PRIORITY_BULK,
+        key=f"index_project:{project_path}"
+    )
+
+async def run_index_file_jobs(jobs: List[Job], queue: JobQueue):
+    """Job handler: index a batch of files, grouped by project"""
+    by_project: Dict[str, List[str]] = {}
+    for job in jobs:
+        by_project.setdefault(job.payload["project_path"], []).append(job.payload["path"])
+    
+    for project, paths in by_project.items():
+        project_path = Path(project)
+        graph = project_graphs.get(project)
+        files = []
+        for relative_path in paths:
+            file_path = project_path / relative_path
+            if not file_path.is_file():
+                await remove_code_context(relative_path, project_path)
+                if graph is not None:
+                    graph.remove_file(relative_path)
+                continue
+            try:
+                async with aiofiles.open(file_path, 'r') as f:
+                    files.append((relative_path, await f.read()))
+            except (UnicodeDecodeError, OSError):
+                continue
+            if graph is not None:
+                graph.update_file(relative_path, files[-1][1])
+        await store_file_contexts(project_path, files)
+
+async def run_index_project_job(jobs: List[Job], queue: JobQueue):
+    """Job handler: fan a project out into one index_file job per file"""
+    loop = asyncio.get_running_loop()
+    for job in jobs:
+        project_path = Path(job.payload["project_path"])
+        files = await loop.run_in_executor(
+            None,
+            lambda: [str(item.relative_to(project_path)) for item in iter_project_files(project_path)]
+        )
+        job.total = len(files)
+        for relative_path in files:
+            enqueue_file_index(project_path, relative_path, priority=job.priority, parent=job)
+        await queue.publish(job)
+
+# Placeholders allowed in generation prompts and output paths; any other braces are literal text
+GENERATION_TEMPLATE_FIELD = re.compile(r"\{(path|name|stem|language)\}")
+
+def generation_template_fields(relative_path: str) -> Dict[str, str]:
+    path = Path(relative_path)
+    return {"path": relative_path, "name": path.name, "stem": path.stem, "language": detect_language(relative_path)}
+
+def render_generation_template(template: str, fields: Dict[str, str]) -> str:
+    """Replace {path}, {name}, {stem} and {language}; unlike str.format, code braces and attribute lookups stay as written"""
+    return GENERATION_TEMPLATE_FIELD.sub(lambda match: fields[match.group(1)], template)
+
+async def refresh_generation_limits():
+    """Read the AI server's generation concurrency and completion-token cap from its /health"""
+    loop = asyncio.get_running_loop()
+    try:
+        response = await loop.run_in_executor(None, lambda: requests.get(f"{vllm_base_url}/health", timeout=5))
+        generation = response.json()["generation"]
+        generation_limits["max_concurrent"] = max(1, int(generation["max_concurrent"]))
+        if generation.get("max_completion_tokens"):
+            generation_limits["max_completion_tokens"] = int(generation["max_completion_tokens"])
+    except Exception as e:
+        logger.warning(f"Could not read generation limits from the AI server, using {generation_limits}: {e}")
+
+def plan_generation(payload: Dict[str, Any]) -> Dict[str, str]:
+    """Matching files (at most max_files) and their content hashes; files that vanish are left out"""
+    project_path = Path(payload["project_path"])
+    matched = set(project_path.glob(payload["glob"]))
+    files = sorted(str(item.relative_to(project_path)) for item in iter_project_files(project_path) if item in matched)
+    hashes = {}
+    for relative_path in files[:payload["max_files"]]:
+        try:
+            hashes[relative_path] = hashlib.sha256((project_path / relative_path).read_bytes()).hexdigest()
+        except OSError:
+            continue
+    return hashes
+
+async def run_generate_project_job(jobs: List[Job], queue: JobQueue):
+    """Job handler: fan a generation request out into one generate_file job per matching file"""
+    loop = asyncio.get_running_loop()
+    # Re-read per job so batches and token caps follow the AI server's current configuration
+    await refresh_generation_limits()
+    for job in jobs:
+        hashes = await loop.run_in_executor(None, plan_generation, job.payload)
+        job.result = {
+            "files_written": 0, "files_skipped": 0, "files_failed": 0,
+            "completion_tokens": 0, "files_per_minute": 0.0, "tokens_per_second": 0.0
+        }
+        # Every file is hashed before the first child is queued, so the fan-out is all or nothing
+        queue.fan_out(job, "generate_file", {
+            f"generate_file:{job.id}:{relative_path}": {**job.payload, "path": relative_path, "source_sha": source_sha}
+            for relative_path, source_sha in hashes.items()
+        })
+        await queue.publish(job)
+
+async def generate_for_file(job: Job) -> Dict[str, Any]:
+    """Generate one file's output and write it through the normal indexing path"""
+    payload = job.payload
+    project_path = Path(payload["project_path"])
+    source = project_path / payload["path"]
+    async with aiofiles.open(source, 'rb') as f:
+        raw = await f.read()
+    fields = generation_template_fields(payload["path"])
+    output_relative = render_generation_template(payload["output_path"], fields) if payload.get("output_path") else payload["path"]
+    output = (project_path / output_relative).resolve()
+    if project_path.resolve() not in output.parents:
+        raise ValueError(f"Output path outside the project: {output_relative}")
+    if output == source.resolve() and hashlib.sha256(raw).hexdigest() != payload["source_sha"]:
+        # Changed since the job was queued: already rewritten before a restart, or edited by the user
+        return {"status": "skipped", "completion_tokens": 0}
+    
+    content = raw.decode("utf-8")
+    messages = [
+        {"role": "system", "content": "You are an expert software developer processing one file of a larger batch job."},
+        {"role": "user", "content": f"""{render_generation_template(payload['prompt'], fields)}
+
+File: {payload['path']}
+```{fields['language']}
+{content}
+```
+
+Reply with a JSON object whose "content" is the complete content of {output_relative}."""}
+    ]
+    request_payload = {
+        "model": codegen_model,
+        "messages": messages,
+        "temperature": payload["temperature"],
+        "max_tokens": min(payload.get("max_tokens") or generation_limits["max_completion_tokens"], generation_limits["max_completion_tokens"]),
+        "response_format": {"type": "json_schema", "json_schema": {"name": "file", "schema": FILE_CONTENT_SCHEMA}}
+    }
+    for attempt in range(BULK_GENERATE_MAX_RETRIES + 1):
+        response = await post_chat_completion(request_payload, timeout=BULK_GENERATE_TIMEOUT_SECONDS)
+        if response.status_code not in (429, 503) or attempt == BULK_GENERATE_MAX_RETRIES:
+            break
+        # The AI server is saturated (likely by interactive traffic): back off as it asks
+        await asyncio.sleep(float(response.headers.get("Retry-After", "5")))
+    response.raise_for_status()
+    result = response.json()
+    generated = json.loads(result["choices"][0]["message"]["content"])["content"]
+    
+    output.parent.mkdir(parents=True, exist_ok=True)
+    async with aiofiles.open(output, 'w') as f:
+        await f.write(generated)
+    enqueue_file_index(project_path, output_relative, priority=PRIORITY_BULK)
+    return {"status": "written", "completion_tokens": (result.get("usage") or {}).get("completion_tokens", 0)}
+
+async def run_generate_file_jobs(jobs: List[Job], queue: JobQueue):
+    """Job handler: generate a batch of files concurrently; one file's failure doesn't fail the rest"""
+    outcomes = await asyncio.gather(*(generate_for_file(job) for job in jobs), return_exceptions=True)
+    for job, outcome in zip(jobs, outcomes):
+        if isinstance(outcome, Exception):
+            logger.error(f"Generation for {job.payload['path']} failed: {outcome}")
+            job.status = "failed"
+            job.error = str(outcome)
+            outcome = {"status": "failed", "completion_tokens": 0}
+        job.result = outcome
+        for parent_id in job.parent_ids:
+            parent = queue.jobs.get(parent_id)
+            if parent is None or parent.result is None:
+                continue
+            parent.result[f"files_{outcome['status']}"] += 1
+            parent.result["completion_tokens"] += outcome["completion_tokens"]
+            elapsed = max(time.time() - parent.started_at, 1e-6)
+            finished = parent.result["files_written"] + parent.result["files_skipped"] + parent.result["files_failed"]
+            parent.result["files_per_minute"] = round(finished / elapsed * 60, 2)
+            parent.result["tokens_per_second"] = round(parent.result["completion_tokens"] / elapsed, 2)
+
+def _compact_collection(project_path: Path) -> Dict[str, int]:
+    collection = get_project_collection(project_path, create=False)
+    if collection is None:
+        return {"removed": 0, "kept": 0}
+    
+    entries = collection.get(include=["metadatas"])
+    stale = [
+        doc_id for doc_id, metadata in zip(entries["ids"], entries["metadatas"])
+        if (metadata or {}).get("kind") == "file" and not (project_path / (metadata or {}).get("path", "")).is_file()
+    ]
+    kept = len(entries["ids"]) - len(stale)
+    
+    if vector_store_backend == "flat":
+        # The flat store rewrites into a new directory, syncs it and swaps it in; an interrupted
+        # swap is finished or rolled back the next time the store opens the collection
+        if stale:
+            collection.delete(ids=stale)
+        collection.compact()
+        return {"removed": len(stale), "kept": kept}
+    
+    # Build a fresh collection so deleted vectors no longer occupy the HNSW index, and
+    # only replace the live one once it is complete; a crash leaves the old one intact
+    name = project_collection_name(project_path)
+    staging_name = name + COMPACT_STAGING_SUFFIX
+    try:
+        vector_db.delete_collection(staging_name)
+    except Exception:
+        pass
+    staging = vector_db.create_collection(staging_name, metadata={"project_path": str(project_path)})
+    stale_ids = set(stale)
+    keep_ids = [doc_id for doc_id in entries["ids"] if doc_id not in stale_ids]
+    for start in range(0, len(keep_ids), 500):
+        batch = collection.get(ids=keep_ids[start:start + 500], include=["documents", "metadatas", "embeddings"])
+        staging.add(
+            ids=batch["ids"],
+            documents=batch["documents"],
+            metadatas=batch["metadatas"],
+            embeddings=[[float(value) for value in embedding] for embedding in batch["embeddings"]]
+        )
+    
+    vector_db.delete_collection(name)
+    staging.modify(name=name)
+    project_collections[str(project_path)] = vector_db.get_collection(name)
+    return {"removed": len(stale), "kept": kept}
+
+async def compact_project_collection(project_path: Path) -> Dict[str, int]:
+    """Drop stale file entries and rewrite the collection to reclaim index space
+
+    Runs in a worker thread while holding the project's index lock, so index
+    jobs wait for the swap and then write to the new collection.
+    """
+    async with project_index_lock(project_path):
+        loop = asyncio.get_running_loop()
+        result = await loop.run_in_executor(None, _compact_collection, project_path)
+        project_lexical_indexes.pop(str(project_path), None)
+        return result
+
+@app.post("/api/projects/index")
+async def project_index(request: ProjectIndexRequest):
+    """Inspect, drop, compact or rebuild a project's vector collection"""
+    try:
+        if not vector_db or not embedding_model:
+            raise HTTPException(status_code=503, detail="Vector database is not initialized")
+        
+        project_path = resolve_project_path(request.project_path)
+        name = project_collection_name(project_path)
+        
+        if request.action == "stats":
+            collection = get_project_collection(project_path, create=False)
+            return {
+                "project_path": str(project_path),
+                "collection": name,
+                "count": collection.count() if collection is not None else 0
+            }
+        
+        elif request.action == "drop":
+            async with project_index_lock(project_path):
+                project_collections.pop(str(project_path), None)
+                project_graphs.pop(str(project_path), None)
+                project_lexical_indexes.pop(str(project_path), None)
+                try:
+                    vector_db.delete_collection(name)
+                except Exception:
+                    raise HTTPException(status_code=404, detail="Project collection not found")
+            return {"message": f"Dropped collection for {project_path}"}
+        
+        elif request.action == "compact":
+            result = await compact_project_collection(project_path)
+            return {"message": f"Compacted collection for {project_path}", **result}
+        
+        elif request.action == "rebuild":
+            if not project_path.is_dir():
+                raise HTTPException(status_code=404, detail="Project directory not found")
+            async with project_index_lock(project_path):
+                project_collections.pop(str(project_path), None)
+                project_graphs.pop(str(project_path), None)
+                project_lexical_indexes.pop(str(project_path), None)
+                try:
+                    vector_db.delete_collection(name)
+                except Exception:
+                    pass
+            job = enqueue_project_index(project_path)
+            return {"message": f"Rebuilding collection for {project_path}", "job_id": job.id}
+        
+        else:
+            raise HTTPException(status_code=400, detail="Invalid action")
+    
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Project index error: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
 @app.post("/api/files/operation")
-async def file_operation(request: FileOperation):
+async def file_operation(request: FileOperation, http_request: Request):
     """Perform file operations"""
     try:
         file_path = projects_dir / request.path.lstrip("/")
@@ -374,9 +1575,16 @@ async def file_operation(request: FileOperation):
             if not file_path.exists():
                 raise HTTPException(status_code=404, detail="File not found")
             
+            # Validators come from the file's metadata, so an unchanged file is never read
+            stat = file_path.stat()
+            etag = file_etag(stat)
+            if is_fresh(http_request, etag, stat.st_mtime):
+                record_cache("file_read", True)
+                return not_modified(etag, stat.st_mtime)
+            
             async with aiofiles.open(file_path, 'r') as f:
                 content = await f.read()
-            return {"content": content}
+            return json_response(http_request, {"content": content}, etag=etag, last_modified=stat.st_mtime, cache_name="file_read")
         
         elif request.operation == "write":
             # Ensure directory exists
@@ -385,14 +1593,38 @@ async def file_operation(request: FileOperation):
             async with aiofiles.open(file_path, 'w') as f:
                 await f.write(request.content or "")
             
-            # Store file content in vector database for context
-            await store_code_context(f"File: {request.path}", request.content or "")
+            # Index the file content for context in the background
+            project_path = project_for_file(file_path)
+            job = enqueue_file_index(project_path, str(file_path.resolve().relative_to(project_path)))
+            
+            return {"message": "File written successfully", "job_id": job.id}
+        
+        elif request.operation == "patch":
+            if not file_path.is_file():
+                raise HTTPException(status_code=404, detail="File not found")
+            
+            # newline="" keeps CRLF files CRLF through the patch
+            async with aiofiles.open(file_path, 'r', newline="") as f:
+                original = await f.read()
+            result = apply_patch(original, request.content or "")
+            if not result.ok:
+                raise HTTPException(status_code=409, detail={"message": "Patch did not apply", "conflicts": result.conflicts})
+            
+            async with aiofiles.open(file_path, 'w', newline="") as f:
+                await f.write(result.content)
+            
+            # Only the chunks the patch touched are re-embedded
+            project_path = project_for_file(file_path)
+            job = enqueue_file_index(project_path, str(file_path.resolve().relative_to(project_path)))
             
-            return {"message": "File written successfully"}
+            return {"message": "Patch applied successfully", "hunks_applied": result.applied, "job_id": job.id}
         
         elif request.operation == "delete":
             if file_path.exists():
+                project_path = project_for_file(file_path)
+                relative_path = str(file_path.resolve().relative_to(project_path))
                 file_path.unlink()
+                enqueue_file_index(project_path, relative_path)
             return {"message": "File deleted successfully"}
         
         elif request.operation == "list":
@@ -411,6 +1643,8 @@ async def file_operation(request: FileOperation):
         else:
             raise HTTPException(status_code=400, detail="Invalid operation")
             
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"File operation error: {e}")
         raise HTTPException(status_code=500, detail=str(e))
@@ -594,7 +1828,7 @@ async def list_projects():
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.get("/api/files/list")
-async def list_files(path: str = "/app/data/projects"):
+async def list_files(request: Request, path: str = "/app/data/projects"):
     """List files in a directory"""
     try:
         directory = Path(path)
@@ -611,16 +1845,66 @@ async def list_files(path: str = "/app/data/projects"):
                 "size": item.stat().st_size if item.is_file() else 0
             })
         
-        return {"files": files}
+        # The ETag hashes the listing itself, so a 304 means nothing was added, removed or resized
+        return json_response(request, {"files": files}, cache_name="file_list")
         
     except Exception as e:
         logger.error(f"File listing error: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.post("/api/jobs/generate")
+async def create_generation_job(request: GenerationJobRequest):
+    """Run a prompt over every matching file in a project as a resumable, low-priority job"""
+    project_path = resolve_project_path(request.project_path)
+    if not project_path.is_dir():
+        raise HTTPException(status_code=404, detail="Project directory not found")
+    if request.output_path:
+        # A misspelt field would send every file's output to the same literal path
+        unknown = set(re.findall(r"\{[^{}]*\}", GENERATION_TEMPLATE_FIELD.sub("", request.output_path)))
+        if unknown:
+            raise HTTPException(status_code=400, detail=f"Unknown output_path fields: {', '.join(sorted(unknown))}")
+    
+    job = job_queue.enqueue(
+        "generate_project",
+        {
+            "project_path": str(project_path),
+            "glob": request.glob,
+            "prompt": request.prompt,
+            "output_path": request.output_path,
+            "max_files": min(request.max_files or BULK_GENERATE_MAX_FILES, BULK_GENERATE_MAX_FILES),
+            "max_tokens": request.max_tokens,
+            "temperature": request.temperature
+        },
+        priority=PRIORITY_BULK
+    )
+    return {"message": f"Generating over {request.glob} in {project_path}", "job_id": job.id}
+
+@app.get("/api/jobs")
+async def list_jobs():
+    """List background jobs with their progress"""
+    return {
+        "queue_depth": job_queue.depth(),
+        "jobs": [job.to_dict() for job in job_queue.jobs.values() if job.parent_id is None]
+    }
+
+@app.get("/api/jobs/{job_id}")
+async def get_job(job_id: str):
+    """Get a background job's status and progress"""
+    job = job_queue.jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job.to_dict()
+
 @app.websocket("/ws")
 async def websocket_endpoint(websocket: WebSocket):
     """WebSocket endpoint for real-time communication"""
     await websocket.accept()
+    
+    # Stream background job progress (files done, ETA) to the client
+    async def send_job_progress(event: Dict[str, Any]):
+        if event["data"]["parent_id"] is None:
+            await websocket.send_text(json.dumps(event))
+    job_queue.subscribe(send_job_progress)
     try:
         while True:
             data = await websocket.receive_text()
@@ -640,6 +1924,8 @@ async def websocket_endpoint(websocket: WebSocket):
         logger.info("WebSocket disconnected")
     except Exception as e:
         logger.error(f"WebSocket error: {e}")
+    finally:
+        job_queue.unsubscribe(send_job_progress)
 
 # Helper functions for agentic chat
 async def analyze_user_intent(message: str) -> str:
@@ -682,129 +1968,109 @@ async def get_project_structure(project_path: str) -> str:
         logger.error(f"Error getting project structure: {e}")
         return "Could not read project structure"
 
-async def extract_file_operations(ai_response: str, user_message: str) -> List[Dict[str, Any]]:
-    """Extract file operations from AI response and user message"""
-    operations = []
-    
-    # Simple pattern matching for file operations
-    user_lower = user_message.lower()
-    
-    # Detect file creation requests
-    if any(word in user_lower for word in ['create', 'make', 'build', 'generate']):
-        if 'python' in user_lower:
-            operations.append({
-                "operation": "CREATE",
-                "file_path": "main.py",
-                "description": "Creating Python file based on request"
-            })
-        elif 'react' in user_lower or 'javascript' in user_lower:
-            operations.append({
-                "operation": "CREATE",
-                "file_path": "App.js",
-                "description": "Creating React/JavaScript file based on request"
-            })
-        elif 'html' in user_lower or 'web' in user_lower:
-            operations.append({
-                "operation": "CREATE",
-                "file_path": "index.html",
-                "description": "Creating HTML file based on request"
-            })
-        else:
-            operations.append({
-                "operation": "CREATE",
-                "file_path": "new_file.txt",
-                "description": "Creating file based on request"
-            })
+def parse_structured_reply(ai_response: str) -> Optional[Tuple[str, List[Dict[str, Any]]]]:
+    """Explanation and file operations from a FILE_OPERATIONS_SCHEMA reply, or None if it is not one"""
+    try:
+        reply = json.loads(ai_response)
+    except (json.JSONDecodeError, TypeError):
+        return None
+    if not isinstance(reply, dict) or not isinstance(reply.get("operations"), list):
+        return None
     
-    return operations
+    operations = []
+    for item in reply["operations"]:
+        # Without content there is nothing to write; never fill in a template
+        if not isinstance(item, dict) or not item.get("path") or not item.get("content"):
+            continue
+        kind = str(item.get("operation", "")).upper()
+        if kind == "PATCH":
+            operations.append({"operation": "PATCH", "file_path": item["path"], "patch": item["content"], "description": f"Editing {item['path']}"})
+        elif kind in ("CREATE", "WRITE"):
+            operations.append({"operation": kind, "file_path": item["path"], "content": item["content"], "description": f"{kind.title()} {item['path']}"})
+    for path in reply.get("deletes") or []:
+        if isinstance(path, str) and path:
+            operations.append({"operation": "DELETE", "file_path": path, "description": f"Delete {path}"})
+    return str(reply.get("response", "")), operations
+
+def extract_file_operations(ai_response: str) -> List[Dict[str, Any]]:
+    """Patches written out as SEARCH/REPLACE blocks or diffs in a free-text reply"""
+    return [
+        {"operation": "PATCH", "description": f"Editing {edit['file_path']}", **edit}
+        for edit in extract_edits(ai_response)
+    ]
 
 async def execute_file_operations(operations: List[Dict[str, Any]], project_path: str) -> bool:
-    """Execute the file operations"""
+    """Execute the file operations and re-index what they changed under project_path"""
     try:
-        project_dir = Path(project_path)
+        project_dir = resolve_project_path(project_path)
         project_dir.mkdir(parents=True, exist_ok=True)
         
+        modified = False
         for operation in operations:
-            if operation["operation"] == "CREATE":
-                file_path = project_dir / operation["file_path"]
+            file_path = (project_dir / operation["file_path"]).resolve()
+            if project_dir.resolve() not in file_path.parents:
+                operation["status"] = "rejected"
+                logger.warning(f"Ignoring operation outside the project: {operation['file_path']}")
+                continue
+            
+            if operation["operation"] in ("CREATE", "WRITE"):
+                content = operation.get("content")
+                if not content:
+                    operation["status"] = "rejected"
+                    logger.warning(f"Ignoring {operation['operation'].lower()} without content: {operation['file_path']}")
+                    continue
                 file_path.parent.mkdir(parents=True, exist_ok=True)
                 
-                # Generate appropriate content based on file type
-                content = await generate_file_content(operation["file_path"], operation.get("description", ""))
-                
                 async with aiofiles.open(file_path, 'w') as f:
                     await f.write(content)
                 
-                logger.info(f"Created file: {file_path}")
+                operation["status"] = "applied"
+                logger.info(f"Wrote file: {file_path}")
+                modified = True
+            
+            elif operation["operation"] == "DELETE":
+                if not file_path.is_file():
+                    operation["status"] = "missing"
+                    continue
+                file_path.unlink()
+                operation["status"] = "applied"
+                logger.info(f"Deleted file: {file_path}")
+                modified = True
+            
+            elif operation["operation"] == "PATCH":
+                if not file_path.is_file():
+                    operation["status"] = "conflict"
+                    operation["conflicts"] = [{"hunk": 0, "reason": "File not found"}]
+                    continue
+                
+                async with aiofiles.open(file_path, 'r', newline="") as f:
+                    original = await f.read()
+                result = apply_patch(original, operation["patch"])
+                if not result.ok:
+                    operation["status"] = "conflict"
+                    operation["conflicts"] = result.conflicts
+                    logger.warning(f"Patch for {file_path} did not apply: {result.conflicts}")
+                    continue
+                
+                async with aiofiles.open(file_path, 'w', newline="") as f:
+                    await f.write(result.content)
+                operation["status"] = "applied"
+                operation["hunks_applied"] = result.applied
+                logger.info(f"Patched file: {file_path} ({result.applied} hunks)")
+                modified = True
+            
+            else:
+                continue
+            
+            # Re-index what changed so follow-up requests see the new code (deleted files drop out)
+            index_path = project_for_file(file_path, project_dir)
+            enqueue_file_index(index_path, str(file_path.relative_to(index_path)))
         
-        return len(operations) > 0
+        return modified
     except Exception as e:
         logger.error(f"Error executing file operations: {e}")
         return False
 
-async def generate_file_content(file_path: str, description: str) -> str:
-    """Generate appropriate content for a file based on its type"""
-    file_name = Path(file_path).name.lower()
-    
-    if file_name.endswith('.py'):
-        return f'''#!/usr/bin/env python3
-"""
-{description}
-"""
-
-def main():
-    """Main function"""
-    print("Hello from {file_name}!")
-    # TODO: Implement your code here
-    pass
-
-if __name__ == "__main__":
-    main()
-'''
-    elif file_name.endswith('.js') or file_name.endswith('.jsx'):
-        return f'''/**
- * {description}
- */
-
-console.log("Hello from {file_name}!");
-
-// TODO: Implement your code here
-'''
-    elif file_name.endswith('.html'):
-        return f'''<!DOCTYPE html>
-<html lang="en">
-<head>
-    <meta charset="UTF-8">
-    <meta name="viewport" content="width=device-width, initial-scale=1.0">
-    <title>Generated HTML</title>
-</head>
-<body>
-    <h1>Generated HTML File</h1>
-    <p>{description}</p>
-    <!-- TODO: Add your content here -->
-</body>
-</html>
-'''
-    elif file_name.endswith('.css'):
-        return f'''/* {description} */
-
-body {{
-    font-family: Arial, sans-serif;
-    margin: 0;
-    padding: 20px;
-    background-color: #f5f5f5;
-}}
-
-/* TODO: Add your styles here */
-'''
-    else:
-        return f'''# {description}
-
-This file was generated by the Local Coding Agent.
-
-TODO: Add your content here
-'''
-
 if __name__ == "__main__":
     uvicorn.run(
         "main:app",
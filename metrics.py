@@ -0,0 +1,81 @@
+"""
+Prometheus metrics shared by the main API and the AI server
+"""
+import time
+from contextlib import contextmanager
+
+from fastapi import FastAPI, Request, Response
+from prometheus_client import Counter, Gauge, Histogram, CONTENT_TYPE_LATEST, generate_latest
+
+from tracing import record_span
+
+# Latency buckets spanning fast file operations up to multi-minute generations
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+REQUEST_LATENCY = Histogram(
+    "http_request_duration_seconds",
+    "HTTP request latency by route",
+    ["method", "route", "status"],
+    buckets=LATENCY_BUCKETS
+)
+
+REQUESTS_IN_FLIGHT = Gauge(
+    "http_requests_in_flight",
+    "HTTP requests currently being handled"
+)
+
+STAGE_LATENCY = Histogram(
+    "pipeline_stage_duration_seconds",
+    "Time spent in each stage of a chat/codegen request",
+    ["stage"],
+    buckets=LATENCY_BUCKETS
+)
+
+CACHE_REQUESTS = Counter(
+    "cache_requests_total",
+    "Cache lookups by cache and result (hit/miss)",
+    ["cache", "result"]
+)
+
+QUEUE_DEPTH = Gauge(
+    "queue_depth",
+    "Items waiting in an internal queue",
+    ["queue"]
+)
+
+@contextmanager
+def stage(name: str):
+    """Record the wall time of a pipeline stage (and a span when the request is traced)"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        duration = time.perf_counter() - start
+        STAGE_LATENCY.labels(name).observe(duration)
+        record_span(name, start, duration)
+
+def record_cache(cache: str, hit: bool):
+    CACHE_REQUESTS.labels(cache, "hit" if hit else "miss").inc()
+
+def instrument_app(app: FastAPI):
+    """Add per-route latency tracking and a /metrics endpoint to an app"""
+
+    @app.middleware("http")
+    async def record_request_metrics(request: Request, call_next):
+        start = time.perf_counter()
+        status = 500
+        REQUESTS_IN_FLIGHT.inc()
+        try:
+            response = await call_next(request)
+            status = response.status_code
+            return response
+        finally:
+            REQUESTS_IN_FLIGHT.dec()
+            # Label by route template, not raw path, to keep cardinality bounded
+            route = getattr(request.scope.get("route"), "path", "unmatched")
+            REQUEST_LATENCY.labels(request.method, route, str(status)).observe(time.perf_counter() - start)
+
+    @app.get("/metrics", include_in_schema=False)
+    async def metrics():
+        """Prometheus metrics"""
+        return Response(content=generate_latest(), media_type=CONTENT_TYPE_LATEST)
@@ -0,0 +1,309 @@
+"""
+Registry of configured models: on-demand loading, pinning and LRU eviction under a memory budget
+"""
+import os
+import json
+import time
+import asyncio
+import logging
+from contextlib import asynccontextmanager
+from typing import List, Dict, Any, Optional, Callable, Tuple, Iterable
+
+logger = logging.getLogger(__name__)
+
+GIB = 1024 ** 3
+
+# A model that failed to load is not retried for this long, doubling per failure up to the maximum
+LOAD_RETRY_SECONDS = 30.0
+LOAD_RETRY_MAX_SECONDS = 600.0
+
+class ModelSpec:
+    """A servable model: the id clients ask for and where its weights come from"""
+
+    def __init__(
+        self,
+        model_id: str,
+        source: str,
+        pinned: bool = False,
+        size_bytes: Optional[int] = None,
+        aliases: Iterable[str] = ()
+    ):
+        self.id = model_id
+        self.source = source
+        self.pinned = pinned
+        self.size_bytes = size_bytes  # expected footprint, lets eviction happen before loading
+        self.aliases = list(aliases)
+
+class ModelEntry:
+    """Load state of one configured model"""
+
+    def __init__(self, spec: ModelSpec):
+        self.spec = spec
+        self.state = "unloaded"  # unloaded, loading, loaded, failed
+        self.handle: Any = None
+        self.size_bytes = 0
+        self.last_size_bytes = 0  # footprint of the previous load, the estimate for the next one
+        self.reserved_bytes = 0  # budget held while loading
+        self.in_use = 0
+        self.last_used = 0.0
+        self.load_seconds: Optional[float] = None
+        self.error: Optional[str] = None
+        self.failures = 0
+        self.retry_at = 0.0
+        self.lock = asyncio.Lock()
+        self.loading: Optional[asyncio.Future] = None  # the load in flight, outlives cancelled callers
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "id": self.spec.id,
+            "object": "model",
+            "owned_by": "local",
+            "permission": [],
+            "source": self.spec.source,
+            "aliases": self.spec.aliases,
+            "pinned": self.spec.pinned,
+            "state": self.state,
+            "size_bytes": self.size_bytes or self.spec.size_bytes,
+            "in_use": self.in_use,
+            "last_used": self.last_used or None,
+            "load_seconds": self.load_seconds,
+            "error": self.error,
+            "retry_in_seconds": round(self.retry_at - time.time(), 1) if self.state == "failed" and self.retry_at > time.time() else None
+        }
+
+def load_model_specs(config: str, default_source: str) -> Tuple[List[ModelSpec], bool]:
+    """Model specs from a JSON object (inline or a file path), or the single default model
+
+    The JSON maps model ids to {"source", "pinned", "size_gb", "aliases"}. The
+    second value is True when no config was given; unknown model ids then fall
+    back to the default model, as a single-model server always did.
+    """
+    if not config:
+        return [ModelSpec("local-model", default_source, pinned=True)], True
+    if not config.lstrip().startswith("{"):
+        with open(config) as f:
+            config = f.read()
+    specs = []
+    for model_id, options in json.loads(config).items():
+        if isinstance(options, str):
+            options = {"source": options}
+        size_gb = options.get("size_gb")
+        specs.append(ModelSpec(
+            model_id,
+            options["source"],
+            pinned=bool(options.get("pinned", False)),
+            size_bytes=int(size_gb * GIB) if size_gb else None,
+            aliases=options.get("aliases", [])
+        ))
+    return specs, False
+
+class ModelRegistry:
+    """Routes model ids to loaded models, loading on first use
+
+    loader(spec) runs in a worker thread and returns (handle, size in bytes);
+    unloader(handle) frees it, also in a worker thread. When the loaded models
+    exceed the memory budget the least recently used one that is neither
+    pinned nor serving a request is unloaded. A budget of 0 never evicts.
+
+    A load reserves its expected size before it starts, so concurrent loads
+    of different models cannot jointly overshoot the budget; a load that does
+    not fit waits for the loads in flight. A failed load is retried only after
+    a backoff, and requests in between fail fast with the last error. A load
+    keeps running when the request waiting on it is cancelled, and its
+    bookkeeping completes when the loader returns.
+    """
+
+    def __init__(
+        self,
+        specs: List[ModelSpec],
+        loader: Callable[[ModelSpec], Tuple[Any, int]],
+        unloader: Optional[Callable[[Any], None]] = None,
+        memory_budget_bytes: int = 0,
+        fallback_to_default: bool = False
+    ):
+        if not specs:
+            raise ValueError("At least one model must be configured")
+        self.entries: Dict[str, ModelEntry] = {spec.id: ModelEntry(spec) for spec in specs}
+        self.names: Dict[str, str] = {}
+        for spec in specs:
+            self.names[spec.id] = spec.id
+            for alias in spec.aliases:
+                self.names.setdefault(alias, spec.id)
+        self.default_id = specs[0].id
+        self.loader = loader
+        self.unloader = unloader
+        self.memory_budget_bytes = memory_budget_bytes
+        self.fallback_to_default = fallback_to_default
+        self._budget = asyncio.Condition()
+        self._loads_in_flight = 0
+
+    def resolve(self, name: Optional[str]) -> ModelEntry:
+        """The entry for a model id or alias; raises KeyError for unknown models"""
+        model_id = self.names.get(name or self.default_id)
+        if model_id is None:
+            if not self.fallback_to_default:
+                raise KeyError(name)
+            model_id = self.default_id
+        return self.entries[model_id]
+
+    def loaded_bytes(self) -> int:
+        return sum(entry.size_bytes for entry in self.entries.values() if entry.state == "loaded")
+
+    def committed_bytes(self) -> int:
+        """Loaded models plus the reservations of loads in flight"""
+        return self.loaded_bytes() + sum(entry.reserved_bytes for entry in self.entries.values() if entry.state == "loading")
+
+    def _evictable(self, keep: ModelEntry) -> List[ModelEntry]:
+        return [
+            entry for entry in self.entries.values()
+            if entry.state == "loaded" and entry is not keep and not entry.spec.pinned and entry.in_use == 0
+        ]
+
+    def _can_fit(self, needed: int, keep: ModelEntry) -> bool:
+        if not self.memory_budget_bytes:
+            return True
+        reclaimable = sum(entry.size_bytes for entry in self._evictable(keep))
+        return self.committed_bytes() - reclaimable + needed <= self.memory_budget_bytes
+
+    def _evict(self, needed: int, keep: ModelEntry) -> List[Any]:
+        """Detach least recently used models until needed more bytes fit; returns the handles to free"""
+        handles = []
+        if not self.memory_budget_bytes:
+            return handles
+        while self.committed_bytes() + needed > self.memory_budget_bytes:
+            candidates = self._evictable(keep)
+            if not candidates:
+                logger.warning(
+                    f"Models use {self.committed_bytes() / GIB:.1f} GiB (+{needed / GIB:.1f} GiB needed), "
+                    f"over the {self.memory_budget_bytes / GIB:.1f} GiB budget, but none can be evicted"
+                )
+                break
+            handles.append(self._detach(min(candidates, key=lambda entry: entry.last_used)))
+        return handles
+
+    def _detach(self, entry: ModelEntry) -> Any:
+        logger.info(f"Unloading model {entry.spec.id} ({entry.size_bytes / GIB:.2f} GiB)")
+        handle, entry.handle = entry.handle, None
+        entry.state = "unloaded"
+        entry.size_bytes = 0
+        return handle
+
+    async def _free(self, handles: List[Any]):
+        # Dropping weights can take seconds; keep the event loop serving meanwhile
+        if self.unloader is None:
+            return
+        for handle in handles:
+            await asyncio.get_running_loop().run_in_executor(None, self.unloader, handle)
+
+    def _finish_load(self, entry: ModelEntry, handle: Any, size_bytes: int, seconds: float) -> List[Any]:
+        entry.handle = handle
+        entry.size_bytes = entry.last_size_bytes = size_bytes
+        entry.reserved_bytes = 0
+        entry.state = "loaded"
+        entry.error = None
+        entry.failures = 0
+        entry.load_seconds = round(seconds, 2)
+        entry.last_used = time.time()
+        logger.info(f"Loaded model {entry.spec.id} from {entry.spec.source} in {seconds:.1f}s ({size_bytes / GIB:.2f} GiB)")
+        # The real footprint is only known now; make room if the estimate was low
+        return self._evict(0, keep=entry)
+
+    def _load_failed(self, entry: ModelEntry, error: Exception):
+        entry.state = "failed"
+        entry.error = str(error)
+        entry.reserved_bytes = 0
+        entry.failures += 1
+        backoff = min(LOAD_RETRY_SECONDS * 2 ** (entry.failures - 1), LOAD_RETRY_MAX_SECONDS)
+        entry.retry_at = time.time() + backoff
+        logger.error(f"Failed to load model {entry.spec.id}: {error} (next attempt in {backoff:.0f}s)")
+
+    async def _load(self, entry: ModelEntry, released: List[Any]) -> Any:
+        """Run a reserved load to the end and settle the reservation, whatever happens to it"""
+        start = time.perf_counter()
+        error: Optional[BaseException] = None
+        try:
+            await self._free(released)
+            handle, size_bytes = await asyncio.get_running_loop().run_in_executor(None, self.loader, entry.spec)
+        except BaseException as e:
+            error = e
+        async with self._budget:
+            self._loads_in_flight -= 1
+            entry.loading = None
+            if error is None:
+                released = self._finish_load(entry, handle, size_bytes, time.perf_counter() - start)
+            elif isinstance(error, Exception):
+                released = []
+                self._load_failed(entry, error)
+            else:
+                # Cancelled at shutdown: give the reservation back without a backoff
+                released = []
+                entry.state = "unloaded"
+                entry.reserved_bytes = 0
+            self._budget.notify_all()
+        if error is not None:
+            raise error
+        await self._free(released)
+        return entry.handle
+
+    async def _ensure_loaded(self, entry: ModelEntry) -> Any:
+        if entry.state == "loaded":
+            return entry.handle
+        async with entry.lock:
+            if entry.state == "loaded":
+                return entry.handle
+            if entry.loading is None:
+                if entry.state == "failed" and time.time() < entry.retry_at:
+                    raise RuntimeError(
+                        f"Model {entry.spec.id} failed to load ({entry.error}); next attempt in {entry.retry_at - time.time():.0f}s"
+                    )
+
+                needed = entry.spec.size_bytes or entry.last_size_bytes
+                async with self._budget:
+                    # Loads in flight may finish (making room to evict) or fail; don't overshoot alongside them
+                    while self._loads_in_flight and not self._can_fit(needed, entry):
+                        await self._budget.wait()
+                    released = self._evict(needed, keep=entry)
+                    entry.state = "loading"
+                    entry.reserved_bytes = needed
+                    self._loads_in_flight += 1
+                    entry.loading = asyncio.ensure_future(self._load(entry, released))
+                    # Nobody may be left waiting for a failed load; don't warn about its unread error
+                    entry.loading.add_done_callback(lambda task: task.cancelled() or task.exception())
+            loading = entry.loading
+        # Shielded: cancelling this request must not strand the reservation or the loaded weights
+        return await asyncio.shield(loading)
+
+    @asynccontextmanager
+    async def use(self, name: Optional[str]):
+        """Load a model if needed and keep it from being evicted while the block runs"""
+        entry = self.resolve(name)
+        entry.in_use += 1
+        try:
+            handle = await self._ensure_loaded(entry)
+            entry.last_used = time.time()
+            yield handle
+        finally:
+            entry.in_use -= 1
+            entry.last_used = time.time()
+
+    def preload(self, model_ids: Optional[Iterable[str]] = None):
+        """Load models synchronously at startup (pinned ones by default); failures are logged"""
+        for model_id in model_ids if model_ids is not None else [e.spec.id for e in self.entries.values() if e.spec.pinned]:
+            entry = self.entries[model_id]
+            if entry.state == "loaded":
+                continue
+            start = time.perf_counter()
+            try:
+                handle, size_bytes = self.loader(entry.spec)
+            except Exception as e:
+                self._load_failed(entry, e)
+                continue
+            for released in self._finish_load(entry, handle, size_bytes, time.perf_counter() - start):
+                if self.unloader is not None:
+                    self.unloader(released)
+
+    def to_list(self) -> List[Dict[str, Any]]:
+        return [entry.to_dict() for entry in self.entries.values()]
+
+def memory_budget_from_env() -> int:
+    return int(float(os.getenv("MODEL_MEMORY_BUDGET_GB", "0")) * GIB)
@@ -0,0 +1,231 @@
+"""
+Apply model-written edits (unified diffs or SEARCH/REPLACE blocks) to files with fuzzy matching
+"""
+import re
+import difflib
+from typing import List, Dict, Any, Optional, Tuple
+
+# Minimum similarity for a hunk to apply somewhere other than an exact match
+FUZZY_THRESHOLD = 0.8
+# Hunks with fewer non-blank lines than this must match exactly (up to whitespace);
+# a short hunk is similar to too many lines ("x = 5" vs "x = 1") to place it by similarity
+FUZZY_MIN_LINES = 3
+# Fuzzy matches scoring within this of the best one make the placement ambiguous
+FUZZY_TIE_MARGIN = 0.02
+
+HUNK_HEADER = re.compile(r"^@@ -(\d+)(?:,(\d+))? \+(\d+)(?:,(\d+))? @@")
+SEARCH_REPLACE_BLOCK = re.compile(
+    r"^<{5,9} SEARCH[^\n]*\n(.*?)^={5,9}[ \t]*\n(.*?)^>{5,9} REPLACE[^\n]*$",
+    re.MULTILINE | re.DOTALL
+)
+
+class Hunk:
+    """Lines to find (old) and what replaces them (new), with an optional line hint"""
+
+    def __init__(self, old: List[str], new: List[str], hint: Optional[int] = None):
+        self.old = old
+        self.new = new
+        self.hint = hint
+
+class PatchResult:
+    def __init__(self, content: str, applied: int, conflicts: List[Dict[str, Any]]):
+        self.content = content
+        self.applied = applied
+        self.conflicts = conflicts
+
+    @property
+    def ok(self) -> bool:
+        return not self.conflicts
+
+def parse_unified_diff(patch: str) -> List[Hunk]:
+    """Hunks of a single-file unified diff (file headers are ignored)"""
+    hunks = []
+    current: Optional[Hunk] = None
+    for line in patch.splitlines():
+        header = HUNK_HEADER.match(line)
+        if header:
+            # "-N,0" inserts after line N; otherwise the hunk starts at line N
+            start = int(header.group(1))
+            current = Hunk([], [], hint=start if header.group(2) == "0" else max(0, start - 1))
+            hunks.append(current)
+            continue
+        if current is None or line.startswith(("--- ", "+++ ", "\\ No newline")):
+            continue
+        if line.startswith("-"):
+            current.old.append(line[1:])
+        elif line.startswith("+"):
+            current.new.append(line[1:])
+        else:
+            # Context line; models often drop the leading space on blank lines
+            text = line[1:] if line.startswith(" ") else line
+            current.old.append(text)
+            current.new.append(text)
+    return hunks
+
+def parse_search_replace(patch: str) -> List[Hunk]:
+    return [
+        Hunk(search.splitlines(), replace.splitlines())
+        for search, replace in SEARCH_REPLACE_BLOCK.findall(patch)
+    ]
+
+def parse_patch(patch: str) -> List[Hunk]:
+    """Parse SEARCH/REPLACE blocks, falling back to a unified diff"""
+    return parse_search_replace(patch) or parse_unified_diff(patch)
+
+def _normalize(line: str) -> str:
+    return " ".join(line.split())
+
+class AmbiguousMatch(Exception):
+    """A hunk matches several places and nothing singles one out"""
+
+    def __init__(self, count: int):
+        self.count = count
+
+def _nearest(starts: List[int], hint: Optional[int]) -> int:
+    """The single match to use; several are only acceptable when a line hint picks one"""
+    if len(starts) == 1:
+        return starts[0]
+    if hint is not None:
+        ranked = sorted(starts, key=lambda start: abs(start - hint))
+        if abs(ranked[0] - hint) < abs(ranked[1] - hint):
+            return ranked[0]
+    raise AmbiguousMatch(len(starts))
+
+def _locate(lines: List[str], hunk: Hunk) -> Tuple[Optional[int], float]:
+    """Find where hunk.old starts: exact, then whitespace-insensitive, then fuzzy for longer hunks
+
+    Raises AmbiguousMatch when the hunk matches several places equally well.
+    """
+    size = len(hunk.old)
+    if size == 0:
+        return (min(hunk.hint, len(lines)) if hunk.hint is not None else None), 1.0
+    starts = range(len(lines) - size + 1)
+
+    exact = [start for start in starts if lines[start:start + size] == hunk.old]
+    if exact:
+        return _nearest(exact, hunk.hint), 1.0
+
+    wanted = [_normalize(line) for line in hunk.old]
+    normalized = [_normalize(line) for line in lines]
+    loose = [start for start in starts if normalized[start:start + size] == wanted]
+    if loose:
+        return _nearest(loose, hunk.hint), 1.0
+
+    if sum(1 for line in wanted if line) < FUZZY_MIN_LINES:
+        return None, 0.0
+
+    # Character-level similarity of whole windows, so a small change to one line still matches
+    ratios: Dict[int, float] = {}
+    best_ratio = 0.0
+    matcher = difflib.SequenceMatcher(autojunk=False)
+    matcher.set_seq2("\n".join(wanted))
+    for start in starts:
+        matcher.set_seq1("\n".join(normalized[start:start + size]))
+        floor = max(FUZZY_THRESHOLD, best_ratio - FUZZY_TIE_MARGIN)
+        if matcher.real_quick_ratio() < floor or matcher.quick_ratio() < floor:
+            continue
+        ratios[start] = matcher.ratio()
+        best_ratio = max(best_ratio, ratios[start])
+    if best_ratio < FUZZY_THRESHOLD:
+        return None, best_ratio
+
+    # Windows overlapping a better one are the same place shifted by a line or two
+    contenders: List[int] = []
+    for start in sorted(ratios, key=lambda start: -ratios[start]):
+        if ratios[start] < best_ratio - FUZZY_TIE_MARGIN:
+            break
+        if all(abs(start - other) >= size for other in contenders):
+            contenders.append(start)
+    best = _nearest(contenders, hunk.hint)
+    return best, ratios[best]
+
+def apply_patch(original: str, patch: str) -> PatchResult:
+    """Apply every hunk or none of them; conflicts say which hunks failed and why
+
+    Every hunk is located in the original text, so one hunk never matches
+    another's output, and hunks that match several places or overlap are
+    reported instead of guessed at. The file's line endings are preserved.
+    """
+    hunks = parse_patch(patch)
+    if not hunks:
+        return PatchResult(original, 0, [{"hunk": 0, "reason": "No SEARCH/REPLACE blocks or diff hunks found"}])
+
+    newline = "\r\n" if "\r\n" in original else "\n"
+    lines = original.splitlines()
+    trailing_newline = original.endswith("\n") or not original
+    conflicts = []
+    spans: List[Tuple[int, int, int]] = []  # (start, end, hunk index) in the original
+    for index, hunk in enumerate(hunks):
+        expected = "\n".join(hunk.old[:10])
+        if not hunk.old and hunk.hint is None:
+            conflicts.append({"hunk": index, "reason": "Empty SEARCH section; include the lines to replace or insert after", "expected": ""})
+            continue
+        try:
+            start, ratio = _locate(lines, hunk)
+        except AmbiguousMatch as e:
+            conflicts.append({
+                "hunk": index,
+                "reason": f"The lines to replace match {e.count} places; include more surrounding lines",
+                "expected": expected
+            })
+            continue
+        if start is None:
+            conflicts.append({
+                "hunk": index,
+                "reason": "Could not find the lines to replace" + (f" (best match {ratio:.0%})" if ratio else ""),
+                "expected": expected
+            })
+            continue
+        end = start + len(hunk.old)
+        overlapping = [
+            other for other_start, other_end, other in spans
+            if (start < other_end and other_start < end) or start == other_start
+        ]
+        if overlapping:
+            conflicts.append({
+                "hunk": index,
+                "reason": f"Overlaps the lines changed by hunk {overlapping[0]}",
+                "expected": expected
+            })
+            continue
+        spans.append((start, end, index))
+
+    if conflicts:
+        return PatchResult(original, 0, conflicts)
+    # Bottom-up, so earlier positions stay valid
+    for start, end, index in sorted(spans, reverse=True):
+        lines[start:end] = hunks[index].new
+    content = newline.join(lines)
+    if trailing_newline and lines:
+        content += newline
+    return PatchResult(content, len(hunks), [])
+
+# Edits in an agent reply: a file path line followed by SEARCH/REPLACE blocks, or a fenced diff
+AGENT_EDIT_BLOCK = re.compile(
+    r"^[`*]*([\w./-]+\.\w+)[`*:]*[ \t]*\n(?:```[\w+-]*\n)?((?:<{5,9} SEARCH.*?^>{5,9} REPLACE[^\n]*\n?)+)",
+    re.MULTILINE | re.DOTALL
+)
+AGENT_DIFF_BLOCK = re.compile(r"```(?:diff|patch)\n(.*?)```", re.DOTALL)
+DIFF_TARGET = re.compile(r"^\+\+\+ (?:b/)?(\S+)", re.MULTILINE)
+
+def extract_edits(response: str) -> List[Dict[str, str]]:
+    """Per-file patches found in a model response"""
+    edits: Dict[str, List[str]] = {}
+    for path, blocks in AGENT_EDIT_BLOCK.findall(response):
+        edits.setdefault(path, []).append(blocks)
+    for diff in AGENT_DIFF_BLOCK.findall(response):
+        # A fenced diff may cover several files
+        sections = re.split(r"^(?=--- )", diff, flags=re.MULTILINE)
+        for section in sections:
+            target = DIFF_TARGET.search(section)
+            if target and target.group(1) != "/dev/null":
+                edits.setdefault(target.group(1), []).append(section)
+    return [{"file_path": path, "patch": "\n".join(patches)} for path, patches in edits.items()]
+
+EDIT_FORMAT_INSTRUCTIONS = """To change an existing file, do not repeat the whole file. Write the file path on its own line, followed by one or more blocks:
+<<<<<<< SEARCH
+exact lines currently in the file (include a few unchanged lines for context)
+=======
+the lines that replace them
+>>>>>>> REPLACE
+Keep each SEARCH section short and unique within the file. Only write whole files when creating new ones."""
@@ -0,0 +1,244 @@
+"""
+Hybrid retrieval for code context: BM25 over chunk text fused with vector hits by
+reciprocal rank fusion, MMR diversity, and an optional cached cross-encoder reranker
+"""
+import os
+import re
+import math
+import hashlib
+import logging
+from collections import Counter, OrderedDict
+from typing import TYPE_CHECKING, List, Dict, Any, Optional, Sequence, Set, Tuple
+
+import numpy as np
+
+from metrics import record_cache
+from vector_store import matches_where
+
+if TYPE_CHECKING:
+    from sentence_transformers import CrossEncoder
+
+logger = logging.getLogger(__name__)
+
+# Candidates taken from each of the vector and lexical searches before fusion
+RETRIEVAL_CANDIDATES = int(os.getenv("RETRIEVAL_CANDIDATES", "30"))
+# Chunks less cosine-similar to the query than this are dropped, even when they rank
+RETRIEVAL_MIN_SIMILARITY = float(os.getenv("RETRIEVAL_MIN_SIMILARITY", "0.2"))
+# Lexical hits scoring at least this fraction of the best BM25 score are kept regardless of the floor
+LEXICAL_STRONG_FRACTION = 0.5
+# 1.0 ranks purely by relevance; lower values trade relevance for diversity
+RETRIEVAL_MMR_LAMBDA = float(os.getenv("RETRIEVAL_MMR_LAMBDA", "0.7"))
+# A chunk this similar to one already picked adds nothing and is skipped outright
+RETRIEVAL_DUPLICATE_SIMILARITY = float(os.getenv("RETRIEVAL_DUPLICATE_SIMILARITY", "0.95"))
+# Standard RRF constant: damps the influence of the very top ranks of any one list
+RRF_K = 60
+
+# Cross-encoder reranking of the fused candidates; empty disables it
+RERANKER_MODEL = os.getenv("RERANKER_MODEL", "")
+RERANK_TOP_N = int(os.getenv("RERANK_TOP_N", "20"))
+RERANK_CACHE_SIZE = int(os.getenv("RERANK_CACHE_SIZE", "20000"))
+
+IDENTIFIER_PATTERN = re.compile(r"[A-Za-z_][A-Za-z0-9_]*|\d+")
+CAMEL_CASE_PATTERN = re.compile(r"[A-Z]+(?![a-z])|[A-Z]?[a-z]+|\d+")
+
+def tokenize(text: str) -> List[str]:
+    """Lower-cased terms; identifiers also yield their snake_case/camelCase parts"""
+    terms = []
+    for identifier in IDENTIFIER_PATTERN.findall(text):
+        lowered = identifier.lower()
+        parts = [part.lower() for piece in identifier.split("_") for part in CAMEL_CASE_PATTERN.findall(piece)]
+        if len(lowered) > 1:
+            terms.append(lowered)
+        if len(parts) > 1:
+            terms.extend(part for part in parts if len(part) > 1)
+    return terms
+
+class BM25Index:
+    """In-memory Okapi BM25 over chunk documents, updated as chunks are upserted and deleted"""
+
+    def __init__(self, k1: float = 1.2, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self.terms: Dict[str, Counter] = {}
+        self.lengths: Dict[str, int] = {}
+        self.metadatas: Dict[str, Dict[str, Any]] = {}
+        self.postings: Dict[str, Set[str]] = {}
+        self.total_length = 0
+
+    def __len__(self) -> int:
+        return len(self.terms)
+
+    def add(self, doc_id: str, text: str, metadata: Optional[Dict[str, Any]] = None):
+        self.remove(doc_id)
+        counts = Counter(tokenize(text))
+        self.terms[doc_id] = counts
+        self.lengths[doc_id] = sum(counts.values())
+        self.metadatas[doc_id] = metadata or {}
+        self.total_length += self.lengths[doc_id]
+        for term in counts:
+            self.postings.setdefault(term, set()).add(doc_id)
+
+    def remove(self, doc_id: str):
+        counts = self.terms.pop(doc_id, None)
+        if counts is None:
+            return
+        self.total_length -= self.lengths.pop(doc_id)
+        self.metadatas.pop(doc_id, None)
+        for term in counts:
+            ids = self.postings[term]
+            ids.discard(doc_id)
+            if not ids:
+                del self.postings[term]
+
+    def remove_where(self, where: Dict[str, Any]):
+        for doc_id in [doc_id for doc_id, metadata in self.metadatas.items() if matches_where(metadata, where)]:
+            self.remove(doc_id)
+
+    def search(self, query: str, k: int, where: Optional[Dict[str, Any]] = None) -> List[Tuple[str, float]]:
+        """Top k (id, score) for the query, optionally restricted by a metadata filter"""
+        if not self.terms:
+            return []
+        average_length = self.total_length / len(self.terms) or 1.0
+        scores: Dict[str, float] = {}
+        for term in set(tokenize(query)):
+            ids = self.postings.get(term)
+            if not ids:
+                continue
+            idf = math.log(1 + (len(self.terms) - len(ids) + 0.5) / (len(ids) + 0.5))
+            for doc_id in ids:
+                frequency = self.terms[doc_id][term]
+                norm = self.k1 * (1 - self.b + self.b * self.lengths[doc_id] / average_length)
+                scores[doc_id] = scores.get(doc_id, 0.0) + idf * frequency * (self.k1 + 1) / (frequency + norm)
+        ranked = sorted(scores.items(), key=lambda item: -item[1])
+        if where:
+            ranked = (item for item in ranked if matches_where(self.metadatas[item[0]], where))
+        return [item for item, _ in zip(ranked, range(k))]
+
+def reciprocal_rank_fusion(rankings: Sequence[Sequence[str]], k: int = RRF_K) -> List[Tuple[str, float]]:
+    """Merge ranked id lists by summing 1 / (k + rank); needs no score calibration between lists"""
+    scores: Dict[str, float] = {}
+    for ranking in rankings:
+        for rank, doc_id in enumerate(ranking):
+            scores[doc_id] = scores.get(doc_id, 0.0) + 1.0 / (k + rank + 1)
+    return sorted(scores.items(), key=lambda item: -item[1])
+
+def mmr_select(
+    relevance: Sequence[float],
+    vectors: np.ndarray,
+    k: int,
+    lambda_: float = RETRIEVAL_MMR_LAMBDA,
+    duplicate_similarity: float = RETRIEVAL_DUPLICATE_SIMILARITY
+) -> List[int]:
+    """Maximal marginal relevance: greedily pick relevant candidates unlike those already picked
+
+    relevance is in [0, 1]; vectors are the candidates' L2-normalized embeddings.
+    Near-duplicates of a picked candidate are never picked, so fewer than k may
+    be returned. Returns indices into the candidates in selection order.
+    """
+    if not len(relevance):
+        return []
+    similarity = vectors @ vectors.T
+    selected: List[int] = []
+    redundancy = np.full(len(relevance), 0.0)
+    remaining = set(range(len(relevance)))
+    while remaining and len(selected) < k:
+        best = max(remaining, key=lambda i: lambda_ * relevance[i] - (1 - lambda_) * redundancy[i])
+        selected.append(best)
+        remaining.discard(best)
+        redundancy = np.maximum(redundancy, similarity[best])
+        remaining = {i for i in remaining if redundancy[i] < duplicate_similarity}
+    return selected
+
+class CrossEncoderReranker:
+    """Scores (query, chunk) pairs with a small cross-encoder, caching scores by content hash
+
+    Chunks are content-addressed, so a cached score stays valid until the chunk
+    itself changes; repeated questions about the same code skip the model.
+    """
+
+    def __init__(self, model_name: str, cache_size: int = RERANK_CACHE_SIZE):
+        from sentence_transformers import CrossEncoder
+
+        self.model_name = model_name
+        self.model: "CrossEncoder" = CrossEncoder(model_name, device="cpu")
+        self.cache_size = cache_size
+        self._cache: "OrderedDict[str, float]" = OrderedDict()
+
+    @staticmethod
+    def _key(query: str, text: str) -> str:
+        return hashlib.sha256(query.encode("utf-8")).hexdigest()[:16] + hashlib.sha256(text.encode("utf-8")).hexdigest()[:24]
+
+    def score(self, query: str, texts: List[str]) -> List[float]:
+        """Relevance probability per text (blocking; call from a worker thread)"""
+        keys = [self._key(query, text) for text in texts]
+        missing = [i for i, key in enumerate(keys) if key not in self._cache]
+        for _ in range(len(keys) - len(missing)):
+            record_cache("rerank", True)
+        for _ in missing:
+            record_cache("rerank", False)
+        if missing:
+            logits = self.model.predict([(query, texts[i]) for i in missing], show_progress_bar=False)
+            for i, logit in zip(missing, np.atleast_1d(logits)):
+                self._cache[keys[i]] = float(1 / (1 + math.exp(-float(logit))))
+        scores = []
+        for key in keys:
+            self._cache.move_to_end(key)
+            scores.append(self._cache[key])
+        while len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+        return scores
+
+_reranker: Optional[CrossEncoderReranker] = None
+_reranker_failed = False
+
+def get_reranker() -> Optional[CrossEncoderReranker]:
+    """The configured reranker, loaded on first use; None when disabled or unavailable"""
+    global _reranker, _reranker_failed
+    if _reranker is None and RERANKER_MODEL and not _reranker_failed:
+        try:
+            _reranker = CrossEncoderReranker(RERANKER_MODEL)
+            logger.info(f"Loaded reranker {RERANKER_MODEL}")
+        except Exception as e:
+            _reranker_failed = True
+            logger.warning(f"Reranker {RERANKER_MODEL} unavailable, continuing without it: {e}")
+    return _reranker
+
+def rank_candidates(
+    query: str,
+    query_vector: np.ndarray,
+    vector_ids: List[str],
+    lexical_hits: List[Tuple[str, float]],
+    candidates: Dict[str, Tuple[str, Dict[str, Any], np.ndarray]],
+    max_results: int,
+    reranker: Optional[CrossEncoderReranker] = None
+) -> List[str]:
+    """Fuse, threshold, optionally rerank, then diversify candidate chunks
+
+    candidates maps every id in either ranking to (document, metadata, embedding).
+    Returns at most max_results ids, most relevant first.
+    """
+    lexical_ids = [doc_id for doc_id, _ in lexical_hits]
+    fused = [(doc_id, score) for doc_id, score in reciprocal_rank_fusion([vector_ids, lexical_ids]) if doc_id in candidates]
+    if not fused:
+        return []
+    # Exact identifier matches are what embeddings miss, so strong lexical hits skip the floor
+    strong_lexical = {doc_id for doc_id, score in lexical_hits if score >= LEXICAL_STRONG_FRACTION * lexical_hits[0][1]}
+    ids = [doc_id for doc_id, _ in fused]
+    vectors = np.asarray([candidates[doc_id][2] for doc_id in ids], dtype=np.float32)
+    similarity = vectors @ np.asarray(query_vector, dtype=np.float32)
+    keep = [i for i in range(len(ids)) if similarity[i] >= RETRIEVAL_MIN_SIMILARITY or ids[i] in strong_lexical]
+    if not keep:
+        return []
+    ids = [ids[i] for i in keep]
+    vectors = vectors[keep]
+    top_fused = fused[0][1]
+    relevance = [score / top_fused for _, score in (fused[i] for i in keep)]
+
+    if reranker is not None:
+        head = min(len(ids), RERANK_TOP_N)
+        scores = reranker.score(query, [candidates[doc_id][0] for doc_id in ids[:head]])
+        # Reranked candidates keep their lead over those the cross-encoder did not see
+        relevance[:head] = [0.5 + 0.5 * score for score in scores]
+        relevance[head:] = [0.5 * value for value in relevance[head:]]
+
+    return [ids[i] for i in mmr_select(relevance, vectors, max_results)]
@@ -0,0 +1,422 @@
+#!/usr/bin/env python3
+"""
+Retrieval quality vs latency benchmark for the code context pipeline
+
+Builds a labelled corpus of query/target pairs (docstring -> function body,
+with the docstring removed from the target), pads it with distractor chunks
+to each requested index size, and reports for every retrieval backend:
+recall@k, MRR, index build time, index size on disk and query latency
+percentiles. Results for all backends and sizes share one JSON/CSV layout so
+they can be plotted on the same chart.
+
+    python3 retrieval_benchmark.py --corpus synthetic --sizes 10000,100000,1000000
+    python3 retrieval_benchmark.py --corpus repo --repo /app/data/projects/myapp --sizes 10000
+"""
+import ast
+import sys
+import csv
+import json
+import time
+import random
+import itertools
+import shutil
+import argparse
+import tempfile
+from pathlib import Path
+from typing import List, Dict, Any, Optional, Tuple, Callable
+
+import numpy as np
+
+from benchmark import percentile
+from embeddings import load_embedding_backend
+from retrieval import RETRIEVAL_CANDIDATES, BM25Index, rank_candidates
+
+RECALL_KS = [1, 5, 10]
+
+# Directories skipped when scanning a real repository (matches the indexer)
+SKIP_DIRS = {".git", "node_modules", "__pycache__", ".venv", "venv", "dist", "build"}
+
+# Vocabulary for the synthetic corpus
+DOMAINS = ["billing", "inventory", "auth", "analytics", "search", "notifications", "reporting", "storage"]
+VERBS = ["parse", "validate", "load", "save", "merge", "filter", "sort", "render", "encode", "decode",
+         "fetch", "compress", "normalize", "schedule", "retry", "cache", "serialize", "hash", "index", "resize"]
+OBJECTS = ["user profile", "config file", "http request", "csv report", "image thumbnail", "session token",
+           "shopping cart", "log entry", "database row", "email address", "json payload", "search query",
+           "audit event", "invoice", "websocket message", "file upload", "feature flag", "rate limit", "cron job", "api key"]
+QUALIFIERS = ["with exponential backoff", "in place", "from disk", "for the admin dashboard", "using a lookup table",
+              "while preserving order", "in batches of fixed size", "with a timeout", "for legacy clients",
+              "and report invalid fields", "into a temporary directory", "with unicode support"]
+STATEMENTS = [
+    "    result = {name}_helper({arg}, options)",
+    "    if not {arg}:\n        raise ValueError('{arg} is required')",
+    "    for item in {arg}:\n        items.append(transform(item))",
+    "    logger.debug('{name} %s', {arg})",
+    "    with open(path, 'r') as f:\n        data = f.read()",
+    "    cache[key] = value",
+    "    return sorted(items, key=lambda item: item.{field})",
+    "    total += len({arg})",
+]
+
+def format_document(path: str, code: str) -> str:
+    """Same document layout the main server stores for indexed files"""
+    return f"Prompt: File: {path}\n\nCode:\n{code}"
+
+class Corpus:
+    """Labelled chunks plus query -> target chunk pairs"""
+
+    def __init__(self, name: str):
+        self.name = name
+        self.ids: List[str] = []
+        self.documents: List[str] = []
+        self.metadatas: List[Dict[str, Any]] = []
+        self.queries: List[Tuple[str, str]] = []  # (query text, target chunk id)
+
+    def add(self, chunk_id: str, path: str, code: str, language: str):
+        self.ids.append(chunk_id)
+        self.documents.append(format_document(path, code))
+        self.metadatas.append({"kind": "file", "path": path, "language": language})
+
+def synthetic_corpus(count: int, seed: int, offset: int = 0) -> Corpus:
+    """Generated functions whose docstrings serve as queries
+
+    Every query word appears in its target chunk: the domain is part of the
+    function name and the qualifier names the helper the body calls. Each
+    combination of words is used once among the first `offset + count`
+    chunks; past that, chunks reuse combinations from after `offset`, so
+    filler generated with the labelled corpus as offset never duplicates a
+    target.
+    """
+    rng = random.Random(seed)
+    combinations = list(itertools.product(DOMAINS, VERBS, OBJECTS, QUALIFIERS))
+    rng.shuffle(combinations)
+    if offset >= len(combinations):
+        raise ValueError(f"At most {len(combinations)} distinct synthetic chunks")
+    corpus = Corpus("synthetic")
+    for i in range(offset, offset + count):
+        domain, verb, obj, qualifier = combinations[offset + (i - offset) % (len(combinations) - offset)]
+        name = f"{verb}_{domain}_{obj.replace(' ', '_')}"
+        arg = obj.split()[-1] + "s"
+        body = "\n".join(
+            rng.choice(STATEMENTS).format(name=name, arg=arg, field=rng.choice(["id", "name", "created_at"]))
+            for _ in range(rng.randint(3, 8))
+        )
+        helper = qualifier.replace(" ", "_")
+        code = f"def {name}({arg}, options=None):\n    options = {helper}(options)\n{body}\n    return result"
+        chunk_id = f"chunk:{i}"
+        corpus.add(chunk_id, f"{domain}/{obj.split()[0]}/{verb}_{i}.py", code, "python")
+        corpus.queries.append((f"{verb.capitalize()} {domain} {obj} {qualifier}", chunk_id))
+    return corpus
+
+def _strip_docstring(source: str, docstring_node: ast.AST, function: ast.AST) -> str:
+    lines = source.splitlines()
+    start = docstring_node.lineno - function.lineno
+    end = docstring_node.end_lineno - function.lineno
+    return "\n".join(lines[:start] + lines[end + 1:])
+
+def repo_corpus(repo: Path) -> Corpus:
+    """Python functions from a real repository; documented ones become query/target pairs"""
+    corpus = Corpus(f"repo:{repo}")
+    for item in sorted(repo.rglob("*.py")):
+        relative = item.relative_to(repo)
+        if any(part in SKIP_DIRS for part in relative.parts):
+            continue
+        try:
+            text = item.read_text()
+            tree = ast.parse(text)
+        except (OSError, UnicodeDecodeError, SyntaxError, ValueError):
+            continue
+        for node in ast.walk(tree):
+            if not isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef)):
+                continue
+            source = ast.get_source_segment(text, node)
+            if not source:
+                continue
+            chunk_id = f"chunk:{relative}:{node.lineno}"
+            docstring = ast.get_docstring(node)
+            if docstring and node.body and isinstance(node.body[0], ast.Expr):
+                summary = docstring.strip().splitlines()[0]
+                code = _strip_docstring(source, node.body[0], node)
+                if len(summary) >= 12 and code.strip():
+                    corpus.add(chunk_id, str(relative), code, "python")
+                    corpus.queries.append((summary, chunk_id))
+                    continue
+            corpus.add(chunk_id, str(relative), source, "python")
+    return corpus
+
+def distractor_embeddings(base: np.ndarray, count: int, noise: float, seed: int) -> np.ndarray:
+    """Perturbed copies of real embeddings, so padding chunks compete with the targets"""
+    rng = np.random.default_rng(seed)
+    picks = base[rng.integers(0, len(base), size=count)]
+    vectors = picks + rng.normal(0, noise, size=picks.shape).astype(np.float32)
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+class ExactIndex:
+    """Brute-force cosine search over an in-memory matrix; the recall ceiling"""
+
+    def __init__(self, directory: Path):
+        self.directory = directory
+        self.ids: List[str] = []
+        self.blocks: List[np.ndarray] = []
+        self.matrix: Optional[np.ndarray] = None
+
+    def add(self, ids, embeddings, documents=None, metadatas=None):
+        self.blocks.append(np.asarray(embeddings, dtype=np.float32))
+        self.ids.extend(ids)
+        self.matrix = None
+
+    def persist(self):
+        np.save(self.directory / "embeddings.npy", np.concatenate(self.blocks))
+        with open(self.directory / "ids.json", "w") as f:
+            json.dump(self.ids, f)
+
+    def query(self, query_embeddings, n_results: int = 10, where=None, include=None):
+        if self.matrix is None:
+            self.matrix = np.concatenate(self.blocks)
+        scores = np.asarray(query_embeddings, dtype=np.float32) @ self.matrix.T
+        n_results = min(n_results, len(self.ids))
+        top = np.argpartition(-scores, n_results - 1, axis=1)[:, :n_results]
+        order = np.take_along_axis(scores, top, axis=1).argsort(axis=1)[:, ::-1]
+        return {"ids": [[self.ids[i] for i in row] for row in np.take_along_axis(top, order, axis=1)]}
+
+class HybridIndex(ExactIndex):
+    """The server's context pipeline: vector and BM25 hits fused by RRF, thresholded, then MMR
+
+    Vector candidates come from exact search, so differences from the exact
+    backend are down to fusion, the similarity floor and diversification.
+    Queries need their text as well as their embedding.
+    """
+
+    lexical = True
+
+    def __init__(self, directory: Path):
+        super().__init__(directory)
+        self.lexical_index = BM25Index()
+        self.documents: Dict[str, Tuple[str, Dict[str, Any]]] = {}
+        self.rows: Dict[str, int] = {}
+
+    def add(self, ids, embeddings, documents=None, metadatas=None):
+        documents = documents or [""] * len(ids)
+        metadatas = metadatas or [{}] * len(ids)
+        for doc_id, document, metadata in zip(ids, documents, metadatas):
+            self.rows[doc_id] = len(self.rows)
+            # Distractors have no text; they only compete in the vector search
+            if document:
+                self.documents[doc_id] = (document, metadata)
+                self.lexical_index.add(doc_id, document, metadata)
+        super().add(ids, embeddings)
+
+    def query(self, query_embeddings, n_results: int = 10, where=None, include=None, query_texts=None):
+        query_embeddings = np.asarray(query_embeddings, dtype=np.float32)
+        vector_hits = super().query(query_embeddings, n_results=min(max(n_results, RETRIEVAL_CANDIDATES), len(self.ids)))["ids"]
+        results = []
+        for text, vector, vector_ids in zip(query_texts, query_embeddings, vector_hits):
+            lexical_hits = self.lexical_index.search(text, RETRIEVAL_CANDIDATES)
+            candidates = {
+                doc_id: (*self.documents.get(doc_id, ("", {})), self.matrix[self.rows[doc_id]])
+                for doc_id in dict.fromkeys(vector_ids + [doc_id for doc_id, _ in lexical_hits])
+            }
+            results.append(rank_candidates(text, vector, vector_ids, lexical_hits, candidates, n_results))
+        return {"ids": results}
+
+def open_exact(directory: Path):
+    return ExactIndex(directory)
+
+def open_hybrid(directory: Path):
+    return HybridIndex(directory)
+
+def open_chroma(directory: Path):
+    # Same client and collection settings as the main server
+    import chromadb
+    client = chromadb.PersistentClient(path=str(directory))
+    return client.get_or_create_collection("benchmark", metadata={"project_path": "benchmark"})
+
+def open_flat(dtype: str) -> Callable[[Path], Any]:
+    def opener(directory: Path):
+        from vector_store import FlatVectorStore
+        return FlatVectorStore(str(directory), dtype=dtype).get_or_create_collection("benchmark")
+    return opener
+
+# Retrieval backends under test; each opens a collection-like object in a directory
+BACKENDS: Dict[str, Callable[[Path], Any]] = {
+    "exact": open_exact,
+    "hybrid": open_hybrid,
+    "chroma": open_chroma,
+    "flat-int8": open_flat("int8"),
+    "flat-float16": open_flat("float16"),
+}
+
+def directory_size(directory: Path) -> int:
+    return sum(item.stat().st_size for item in directory.rglob("*") if item.is_file())
+
+def evaluate(
+    backend: str,
+    size: int,
+    corpus: Corpus,
+    embeddings: np.ndarray,
+    query_embeddings: np.ndarray,
+    latency_queries: int,
+    work_dir: Path,
+    batch_size: int
+) -> Dict[str, Any]:
+    """Build one backend's index at one size and measure quality and latency"""
+    directory = Path(tempfile.mkdtemp(prefix=f"{backend}_{size}_", dir=work_dir))
+    try:
+        collection = BACKENDS[backend](directory)
+        # Labelled targets go in first so smaller sizes still index them;
+        # queries whose target does not fit are left out of the scores
+        targets = {target for _, target in corpus.queries}
+        order = sorted(range(len(corpus.ids)), key=lambda row: corpus.ids[row] not in targets)
+        rows = (order + list(range(len(corpus.ids), len(embeddings))))[:size]
+        indexed = {corpus.ids[row] for row in rows if row < len(corpus.ids)}
+        queries = [number for number, (_, target) in enumerate(corpus.queries) if target in indexed]
+
+        build_start = time.perf_counter()
+        for start in range(0, size, batch_size):
+            batch = rows[start:start + batch_size]
+            collection.add(
+                ids=[corpus.ids[row] if row < len(corpus.ids) else f"distractor:{row}" for row in batch],
+                embeddings=embeddings[batch],
+                documents=[corpus.documents[row] if row < len(corpus.ids) else "" for row in batch],
+                metadatas=[
+                    corpus.metadatas[row] if row < len(corpus.ids) else {"kind": "file", "path": "", "language": "text"}
+                    for row in batch
+                ]
+            )
+        if hasattr(collection, "persist"):
+            collection.persist()
+        build_seconds = time.perf_counter() - build_start
+
+        def query(numbers: List[int], n_results: int):
+            texts = {"query_texts": [corpus.queries[number][0] for number in numbers]} if getattr(collection, "lexical", False) else {}
+            return collection.query(query_embeddings=query_embeddings[numbers], n_results=n_results, include=[], **texts)
+
+        k = max(RECALL_KS)
+        hits = {cutoff: 0 for cutoff in RECALL_KS}
+        reciprocal_ranks = 0.0
+        for start in range(0, len(queries), 256):
+            batch = queries[start:start + 256]
+            results = query(batch, k)
+            for number, retrieved in zip(batch, results["ids"]):
+                target = corpus.queries[number][1]
+                if target in retrieved:
+                    rank = retrieved.index(target) + 1
+                    reciprocal_ranks += 1 / rank
+                    for cutoff in RECALL_KS:
+                        hits[cutoff] += rank <= cutoff
+
+        latencies = []
+        for number in random.Random(size).sample(queries, min(latency_queries, len(queries))):
+            start = time.perf_counter()
+            query([number], 5)
+            latencies.append(time.perf_counter() - start)
+
+        total = max(len(queries), 1)
+        return {
+            "backend": backend,
+            "size": size,
+            "queries": len(queries),
+            **{f"recall@{cutoff}": round(hits[cutoff] / total, 4) for cutoff in RECALL_KS},
+            "mrr@10": round(reciprocal_ranks / total, 4),
+            "build_seconds": round(build_seconds, 2),
+            "index_bytes": directory_size(directory),
+            "query_ms_p50": percentile(latencies, 50),
+            "query_ms_p95": percentile(latencies, 95),
+            "query_ms_p99": percentile(latencies, 99)
+        }
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure retrieval quality and latency of the context pipeline")
+    parser.add_argument("--corpus", choices=["synthetic", "repo"], default="synthetic", help="Source of query/target pairs")
+    parser.add_argument("--repo", default=".", help="Repository to mine for --corpus repo")
+    parser.add_argument("--pairs", type=int, default=2000, help="Labelled chunks for --corpus synthetic")
+    parser.add_argument("--sizes", default="10000,100000,1000000", help="Comma-separated index sizes in chunks")
+    parser.add_argument("--backends", default=",".join(BACKENDS), help=f"Comma-separated list of {', '.join(BACKENDS)}")
+    parser.add_argument("--distractors", choices=["perturb", "embed"], default="perturb",
+                        help="perturb: noisy copies of real embeddings (fast); embed: embed generated chunks")
+    parser.add_argument("--noise", type=float, default=0.05, help="Gaussian noise for perturbed distractors")
+    parser.add_argument("--latency-queries", type=int, default=200, help="Single queries timed per run")
+    parser.add_argument("--batch-size", type=int, default=5000, help="Chunks per add() call while building")
+    parser.add_argument("--embedding-backend", default=None, help="Override EMBEDDING_BACKEND")
+    parser.add_argument("--work-dir", default=None, help="Where to build indexes (default: a temp dir)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default=None, help="Also write the JSON report to this file")
+    parser.add_argument("--csv", default=None, help="Write one row per backend/size to this CSV file")
+    args = parser.parse_args()
+
+    sizes = sorted(int(size) for size in args.sizes.split(",") if size.strip())
+    backends = [name.strip() for name in args.backends.split(",") if name.strip()]
+    for name in backends:
+        if name not in BACKENDS:
+            parser.error(f"Unknown backend: {name}")
+
+    if args.corpus == "synthetic" and args.pairs >= len(DOMAINS) * len(VERBS) * len(OBJECTS) * len(QUALIFIERS):
+        parser.error("--pairs must leave room for distinct distractors")
+    corpus = synthetic_corpus(args.pairs, args.seed) if args.corpus == "synthetic" else repo_corpus(Path(args.repo).resolve())
+    if not corpus.queries:
+        parser.error("Corpus has no query/target pairs")
+    print(f"📚 {corpus.name}: {len(corpus.ids)} chunks, {len(corpus.queries)} queries", file=sys.stderr)
+
+    embedder = load_embedding_backend(args.embedding_backend)
+    embed_start = time.perf_counter()
+    embeddings = embedder.encode(corpus.documents).astype(np.float32)
+    embed_seconds = time.perf_counter() - embed_start
+    query_embeddings = embedder.encode([query for query, _ in corpus.queries]).astype(np.float32)
+
+    query_latencies = []
+    for query, _ in corpus.queries[:args.latency_queries]:
+        start = time.perf_counter()
+        embedder.encode([query])
+        query_latencies.append(time.perf_counter() - start)
+
+    padding = max(sizes) - len(embeddings)
+    if padding > 0:
+        print(f"🧩 Adding {padding} {args.distractors} distractors...", file=sys.stderr)
+        if args.distractors == "embed":
+            offset = len(corpus.ids) if args.corpus == "synthetic" else 0
+            extra = embedder.encode(synthetic_corpus(padding, args.seed, offset=offset).documents).astype(np.float32)
+        else:
+            extra = distractor_embeddings(embeddings, padding, args.noise, args.seed)
+        embeddings = np.vstack([embeddings, extra])
+
+    work_dir = Path(args.work_dir or tempfile.gettempdir())
+    work_dir.mkdir(parents=True, exist_ok=True)
+    runs = []
+    for size in sizes:
+        for backend in backends:
+            print(f"⏱️  {backend} @ {size} chunks...", file=sys.stderr)
+            runs.append(evaluate(backend, size, corpus, embeddings, query_embeddings, args.latency_queries, work_dir, args.batch_size))
+            print(json.dumps(runs[-1]), file=sys.stderr)
+
+    report = {
+        "config": {
+            "corpus": corpus.name,
+            "chunks": len(corpus.ids),
+            "queries": len(corpus.queries),
+            "distractors": args.distractors,
+            "sizes": sizes,
+            "seed": args.seed
+        },
+        "embedding": {
+            **embedder.describe(),
+            "texts_per_second": round(len(corpus.documents) / embed_seconds, 1),
+            "query_ms_p50": percentile(query_latencies, 50),
+            "query_ms_p95": percentile(query_latencies, 95)
+        },
+        "runs": runs
+    }
+
+    output = json.dumps(report, indent=2)
+    print(output)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output)
+    if args.csv:
+        with open(args.csv, "w", newline="") as f:
+            writer = csv.DictWriter(f, fieldnames=list(runs[0].keys()))
+            writer.writeheader()
+            writer.writerows(runs)
+
+if __name__ == "__main__":
+    main()
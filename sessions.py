@@ -0,0 +1,173 @@
+"""
+Server-side conversation sessions with rolling summarization
+"""
+import time
+import uuid
+import asyncio
+import logging
+from collections import OrderedDict
+from typing import List, Dict, Any, Optional, Callable, Awaitable
+
+logger = logging.getLogger(__name__)
+
+# The extractive fallback keeps only this many of the most recent summary lines
+EXTRACTIVE_SUMMARY_MAX_LINES = 40
+
+def estimate_tokens(text: str) -> int:
+    """Cheap token estimate (~4 characters per token) used for prompt budgeting"""
+    return max(1, len(text) // 4)
+
+class ConversationSession:
+    """A single conversation: a rolling summary plus the most recent turns"""
+
+    def __init__(self, session_id: str):
+        self.session_id = session_id
+        self.summary = ""
+        self.turns: List[Dict[str, str]] = []
+        self.created_at = time.time()
+        self.last_used = self.created_at
+        self.compactions = 0
+        self.compacting = False
+
+    def add_turn(self, role: str, content: str):
+        """Append a message to the session history"""
+        self.turns.append({"role": role, "content": content})
+        self.last_used = time.time()
+
+    def token_count(self) -> int:
+        """Estimated prompt tokens taken by the summary and stored turns"""
+        return estimate_tokens(self.summary) + sum(estimate_tokens(t["content"]) for t in self.turns)
+
+    def prompt_messages(self, system_prompt: str, user_message: str) -> List[Dict[str, str]]:
+        """The system prompt (with the summary folded in), recent turns and the new user message
+
+        The summary goes into the leading system message rather than a second
+        system message mid-conversation, which many chat templates reject.
+        """
+        if self.summary:
+            system_prompt = f"{system_prompt}\n\nSummary of the earlier conversation:\n{self.summary}"
+        return [{"role": "system", "content": system_prompt}, *self.turns, {"role": "user", "content": user_message}]
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "session_id": self.session_id,
+            "summary": self.summary,
+            "turns": list(self.turns),
+            "estimated_tokens": self.token_count(),
+            "compactions": self.compactions,
+            "created_at": self.created_at,
+            "last_used": self.last_used
+        }
+
+# Summarizer receives the previous summary and the turns being folded into it
+Summarizer = Callable[[str, List[Dict[str, str]]], Awaitable[str]]
+
+class ConversationStore:
+    """In-memory session store with TTL/LRU eviction and background compaction
+
+    Once a session's estimated size crosses ``summary_threshold_tokens`` every
+    turn except the last ``keep_recent_turns`` is folded into the session
+    summary by a background task, so the prompt sent for each new turn stays
+    roughly constant no matter how long the conversation runs.
+    """
+
+    def __init__(
+        self,
+        summarizer: Summarizer,
+        max_sessions: int = 256,
+        ttl_seconds: float = 3600,
+        summary_threshold_tokens: int = 2000,
+        keep_recent_turns: int = 4
+    ):
+        self.summarizer = summarizer
+        self.max_sessions = max_sessions
+        self.ttl_seconds = ttl_seconds
+        self.summary_threshold_tokens = summary_threshold_tokens
+        self.keep_recent_turns = keep_recent_turns
+        self._sessions: "OrderedDict[str, ConversationSession]" = OrderedDict()
+        self._tasks = set()
+
+    def __len__(self) -> int:
+        return len(self._sessions)
+
+    def _evict(self):
+        """Drop expired sessions, then the least recently used ones over capacity"""
+        cutoff = time.time() - self.ttl_seconds
+        while self._sessions:
+            session_id, session = next(iter(self._sessions.items()))
+            if session.last_used >= cutoff and len(self._sessions) <= self.max_sessions:
+                break
+            del self._sessions[session_id]
+            logger.info(f"Evicted conversation session {session_id}")
+
+    def get(self, session_id: str) -> Optional[ConversationSession]:
+        """Return an existing live session without creating one"""
+        self._evict()
+        return self._sessions.get(session_id)
+
+    def get_or_create(self, session_id: Optional[str] = None) -> ConversationSession:
+        """Return the session for session_id, creating it (and an id) if needed"""
+        session_id = session_id or uuid.uuid4().hex
+        session = self._sessions.get(session_id)
+        if session is None:
+            session = ConversationSession(session_id)
+            self._sessions[session_id] = session
+        else:
+            self._sessions.move_to_end(session_id)
+        session.last_used = time.time()
+        self._evict()
+        return session
+
+    def delete(self, session_id: str) -> bool:
+        return self._sessions.pop(session_id, None) is not None
+
+    def maybe_compact(self, session: ConversationSession):
+        """Schedule background summarization when the session is over budget"""
+        if session.compacting or session.token_count() <= self.summary_threshold_tokens:
+            return
+        if len(session.turns) <= self.keep_recent_turns:
+            return
+        session.compacting = True
+        task = asyncio.create_task(self._compact(session))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _compact(self, session: ConversationSession):
+        # Snapshot the turns being folded; new turns may arrive while we wait
+        folded_count = len(session.turns) - self.keep_recent_turns
+        folded = session.turns[:folded_count]
+        try:
+            try:
+                summary = await self.summarizer(session.summary, folded)
+            except Exception as e:
+                logger.warning(f"Session summarization failed, using extractive summary: {e}")
+                summary = extractive_summary(session.summary, folded)
+
+            session.summary = summary.strip()
+            del session.turns[:folded_count]
+            session.compactions += 1
+            logger.info(
+                f"Compacted session {session.session_id}: folded {folded_count} turns, "
+                f"~{session.token_count()} tokens remain"
+            )
+        finally:
+            session.compacting = False
+
+def extractive_summary(
+    previous_summary: str,
+    turns: List[Dict[str, str]],
+    max_chars: int = 200,
+    max_lines: int = EXTRACTIVE_SUMMARY_MAX_LINES
+) -> str:
+    """Fallback summary keeping the opening of each folded turn
+
+    Only the most recent max_lines lines are kept, so repeated summarizer
+    failures cannot grow the summary past the budget it exists to protect.
+    """
+    lines = previous_summary.splitlines() if previous_summary else []
+    for turn in turns:
+        excerpt = " ".join(turn["content"].split())
+        if len(excerpt) > max_chars:
+            excerpt = excerpt[:max_chars] + "..."
+        lines.append(f"- {turn['role']}: {excerpt}")
+    return "\n".join(lines[-max_lines:])
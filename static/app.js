@@ -0,0 +1,249 @@
+let isProcessing = false;
+let currentProject = '/app/data/projects';
+// Conversation the server keeps for this project; null starts a new one
+let sessionId = null;
+
+// Initialize the chat interface
+document.addEventListener('DOMContentLoaded', function() {
+    loadProjectStructure();
+    setupFolderSelector();
+});
+
+function setupFolderSelector() {
+    const folderInput = document.getElementById('folderInput');
+    folderInput.addEventListener('change', handleFolderSelection);
+}
+
+function selectFolder() {
+    const folderInput = document.getElementById('folderInput');
+    folderInput.click();
+}
+
+async function handleFolderSelection(event) {
+    const files = event.target.files;
+    if (files.length === 0) return;
+
+    // Get the first file to determine the folder path
+    const firstFile = files[0];
+    const folderPath = firstFile.webkitRelativePath.split('/')[0];
+
+    // Update the display
+    const folderPathInput = document.getElementById('folderPath');
+    folderPathInput.value = folderPath;
+
+    // Update current project path; the conversation belongs to the old project
+    currentProject = folderPath;
+    sessionId = null;
+
+    // Show folder selection message
+    addMessage('system', '📁 Folder Selected', `Working folder changed to: <strong>${folderPath}</strong><br>Found ${files.length} files in the selected folder.`);
+
+    // Send folder info to backend
+    try {
+        const response = await fetch('/api/folder/select', {
+            method: 'POST',
+            headers: {
+                'Content-Type': 'application/json',
+            },
+            body: JSON.stringify({
+                folder_path: folderPath,
+                file_count: files.length
+            })
+        });
+
+        if (response.ok) {
+            const data = await response.json();
+            addMessage('ai', '🤖 AI Agent', data.message || 'Folder selected successfully! I can now work with your files.');
+        }
+    } catch (error) {
+        console.log('Could not notify backend about folder selection:', error);
+    }
+
+    // Load the new project structure
+    setTimeout(loadProjectStructure, 500);
+}
+
+function handleKeyPress(event) {
+    if (event.key === 'Enter' && !event.shiftKey) {
+        event.preventDefault();
+        sendMessage();
+    }
+}
+
+function sendQuickMessage(message) {
+    document.getElementById('messageInput').value = message;
+    sendMessage();
+}
+
+async function sendMessage() {
+    const input = document.getElementById('messageInput');
+    const message = input.value.trim();
+
+    if (!message || isProcessing) return;
+
+    // Add user message to chat
+    addMessage('user', 'You', message);
+    input.value = '';
+
+    // Show typing indicator
+    showTypingIndicator();
+    isProcessing = true;
+    updateSendButton();
+
+    try {
+        // Send message to AI agent
+        const response = await fetch('/api/chat', {
+            method: 'POST',
+            headers: {
+                'Content-Type': 'application/json',
+            },
+            body: JSON.stringify({
+                message: message,
+                project_path: currentProject,
+                session_id: sessionId
+            })
+        });
+
+        const data = await response.json();
+
+        // Hide typing indicator
+        hideTypingIndicator();
+
+        // Check if response is valid
+        if (!response.ok) {
+            throw new Error(`HTTP ${response.status}: ${data.detail || 'Unknown error'}`);
+        }
+
+        // Later messages continue the same conversation
+        if (data.session_id) {
+            sessionId = data.session_id;
+        }
+
+        // Add AI response
+        addMessage('ai', '🤖 AI Agent', data.response || 'No response received');
+
+        // If there were file operations, show them
+        if (data.file_operations && data.file_operations.length > 0) {
+            showFileOperations(data.file_operations);
+        }
+
+        // Refresh project structure if files were modified
+        if (data.files_modified) {
+            setTimeout(loadProjectStructure, 1000);
+        }
+
+    } catch (error) {
+        hideTypingIndicator();
+        addMessage('system', '⚠️ Error', 'Failed to communicate with AI agent: ' + error.message);
+    }
+
+    isProcessing = false;
+    updateSendButton();
+}
+
+function addMessage(type, sender, content) {
+    const messagesContainer = document.getElementById('chatMessages');
+    const messageDiv = document.createElement('div');
+    messageDiv.className = `message ${type}`;
+
+    messageDiv.innerHTML = `
+        <div class="message-header">${sender}</div>
+        <div class="message-content">${formatMessage(content)}</div>
+    `;
+
+    messagesContainer.appendChild(messageDiv);
+    messagesContainer.scrollTop = messagesContainer.scrollHeight;
+}
+
+function formatMessage(content) {
+    // Handle undefined, null, or non-string content
+    if (!content || typeof content !== 'string') {
+        return 'No content available';
+    }
+
+    // Convert markdown-like formatting to HTML
+    return content
+        .replace(/\*\*(.*?)\*\*/g, '<strong>$1</strong>')
+        .replace(/\*(.*?)\*/g, '<em>$1</em>')
+        .replace(/`(.*?)`/g, '<code style="background: rgba(255,255,255,0.1); padding: 2px 4px; border-radius: 3px;">$1</code>')
+        .replace(/\n/g, '<br>');
+}
+
+function showFileOperations(operations) {
+    const messagesContainer = document.getElementById('chatMessages');
+    const operationsDiv = document.createElement('div');
+    operationsDiv.className = 'message system';
+
+    let operationsHtml = '<div class="message-header">📁 File Operations</div><div class="message-content">';
+
+    operations.forEach(op => {
+        operationsHtml += `
+            <div class="file-operation">
+                <strong>${op.operation}</strong>: ${op.file_path}
+                ${op.description ? `<br><em>${op.description}</em>` : ''}
+            </div>
+        `;
+    });
+
+    operationsHtml += '</div>';
+    operationsDiv.innerHTML = operationsHtml;
+
+    messagesContainer.appendChild(operationsDiv);
+    messagesContainer.scrollTop = messagesContainer.scrollHeight;
+}
+
+function showTypingIndicator() {
+    document.getElementById('typingIndicator').style.display = 'block';
+    const messagesContainer = document.getElementById('chatMessages');
+    messagesContainer.scrollTop = messagesContainer.scrollHeight;
+}
+
+function hideTypingIndicator() {
+    document.getElementById('typingIndicator').style.display = 'none';
+}
+
+function updateSendButton() {
+    const button = document.getElementById('sendButton');
+    button.disabled = isProcessing;
+    button.textContent = isProcessing ? 'Processing...' : 'Send';
+}
+
+async function loadProjectStructure() {
+    try {
+        const response = await fetch('/api/files/list?path=' + encodeURIComponent(currentProject));
+        const data = await response.json();
+
+        if (data.files && data.files.length > 0) {
+            showProjectStructure(data.files);
+        }
+    } catch (error) {
+        console.log('Could not load project structure:', error);
+    }
+}
+
+function showProjectStructure(files) {
+    const messagesContainer = document.getElementById('chatMessages');
+    const existingStructure = messagesContainer.querySelector('.project-structure');
+
+    if (existingStructure) {
+        existingStructure.remove();
+    }
+
+    const structureDiv = document.createElement('div');
+    structureDiv.className = 'message system project-structure';
+
+    let structureHtml = '<div class="message-header">📁 Current Project Structure</div><div class="message-content"><div class="file-tree">';
+
+    files.forEach(file => {
+        const icon = file.type === 'directory' ? '📁' : '📄';
+        structureHtml += `<div class="file-tree-item">${icon} ${file.name}</div>`;
+    });
+
+    structureHtml += '</div></div>';
+    structureDiv.innerHTML = structureHtml;
+
+    messagesContainer.appendChild(structureDiv);
+}
+
+// Auto-focus input field
+document.getElementById('messageInput').focus();
@@ -0,0 +1,395 @@
+"""
+JSON-schema-constrained decoding for OpenAI-style response_format requests
+
+JsonSchemaAcceptor is an incremental, character-level JSON parser that only
+accepts documents matching a schema. The logits processor uses it to mask out
+tokens that would break the schema and forces end-of-sequence as soon as the
+document is complete, so a structured answer never needs a retry or re-parse.
+
+Supported schema keywords: type (including lists of types), properties,
+required, additionalProperties, items, minItems, maxItems, enum, const and
+anyOf/oneOf (the first alternative accepting the opening character is used).
+"""
+import re
+import json
+import weakref
+from typing import List, Dict, Any, Optional, Tuple
+
+WHITESPACE = " \t\n\r"
+
+NUMBER_PREFIX = re.compile(r"-?(?:0|[1-9]\d*)?|-?(?:0|[1-9]\d*)\.\d*|-?(?:0|[1-9]\d*)(?:\.\d+)?[eE][+-]?\d*")
+NUMBER_COMPLETE = re.compile(r"-?(?:0|[1-9]\d*)(?:\.\d+)?(?:[eE][+-]?\d+)?")
+INTEGER_PREFIX = re.compile(r"-?(?:0|[1-9]\d*)?")
+INTEGER_COMPLETE = re.compile(r"-?(?:0|[1-9]\d*)")
+
+# Candidates checked per decoding step before falling back to the whole vocabulary
+CANDIDATE_TOKENS = 64
+
+State = Tuple[tuple, ...]
+
+def response_format_schema(response_format: Optional[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+    """The schema a response_format asks for, or None for plain text"""
+    if not response_format or response_format.get("type", "text") == "text":
+        return None
+    if response_format["type"] == "json_object":
+        return {"type": "object"}
+    if response_format["type"] == "json_schema":
+        spec = response_format.get("json_schema") or {}
+        return spec.get("schema") or {"type": "object"}
+    raise ValueError(f"Unsupported response_format type: {response_format['type']}")
+
+def _types(schema: Dict[str, Any]) -> set:
+    if "const" in schema:
+        return {_json_type(schema["const"])}
+    if "enum" in schema:
+        return {_json_type(value) for value in schema["enum"]}
+    declared = schema.get("type")
+    if declared is None:
+        return {"object", "array", "string", "number", "integer", "boolean", "null"}
+    types = set(declared) if isinstance(declared, list) else {declared}
+    if "number" in types:
+        types.add("integer")
+    return types
+
+def _json_type(value: Any) -> str:
+    if value is None:
+        return "null"
+    if isinstance(value, bool):
+        return "boolean"
+    if isinstance(value, int):
+        return "integer"
+    if isinstance(value, float):
+        return "number"
+    if isinstance(value, str):
+        return "string"
+    return "array" if isinstance(value, list) else "object"
+
+def _choices(schema: Dict[str, Any]) -> Optional[List[Any]]:
+    if "const" in schema:
+        return [schema["const"]]
+    return schema.get("enum")
+
+def _allowed_keys(schema: Dict[str, Any]) -> Optional[List[str]]:
+    """Property names an object may use, or None when any key is allowed"""
+    if schema.get("additionalProperties") is False:
+        return list(schema.get("properties", {}))
+    return None
+
+def _property_schema(schema: Dict[str, Any], key: str) -> Dict[str, Any]:
+    if key in schema.get("properties", {}):
+        return schema["properties"][key]
+    extra = schema.get("additionalProperties")
+    return extra if isinstance(extra, dict) else {}
+
+class JsonSchemaAcceptor:
+    """Incremental validator: advance() returns the next state, or None if the text breaks the schema
+
+    States are immutable tuples of parser frames, so a state can be advanced
+    speculatively for every candidate token without copying.
+    """
+
+    def __init__(self, schema: Dict[str, Any]):
+        self.schema = schema
+
+    def initial(self) -> State:
+        return (("value", self.schema),)
+
+    def advance(self, state: Optional[State], text: str) -> Optional[State]:
+        for char in text:
+            if state is None:
+                return None
+            state = self._step(state, char)
+        return state
+
+    def is_complete(self, state: Optional[State]) -> bool:
+        if not state:
+            return False
+        if state[-1][0] == "end":
+            return True
+        # A bare top-level number has no closing character
+        if len(state) == 1 and state[0][0] == "number":
+            _, schema, text = state[0]
+            return bool((INTEGER_COMPLETE if "number" not in _types(schema) else NUMBER_COMPLETE).fullmatch(text))
+        return False
+
+    def _resolve(self, schema: Dict[str, Any], char: str) -> Optional[Dict[str, Any]]:
+        alternatives = schema.get("anyOf") or schema.get("oneOf")
+        if not alternatives:
+            return schema
+        for alternative in alternatives:
+            if self._step((("value", alternative),), char) is not None:
+                return alternative
+        return None
+
+    def _value_done(self, stack: State) -> State:
+        # A value finished: let the enclosing container expect a separator
+        if not stack:
+            return (("end",),)
+        parent = stack[-1]
+        if parent[0] == "object":
+            return stack[:-1] + (("object", parent[1], parent[2], "next", None),)
+        return stack[:-1] + (("array", parent[1], parent[2] + 1, "next"),)
+
+    def _start_value(self, stack: State, schema: Dict[str, Any], char: str) -> Optional[State]:
+        if char in WHITESPACE:
+            return stack + (("value", schema),)
+        schema = self._resolve(schema, char)
+        if schema is None:
+            return None
+        types = _types(schema)
+        choices = _choices(schema)
+        if char == "{" and "object" in types:
+            return stack + (("object", schema, frozenset(), "start", None),)
+        if char == "[" and "array" in types:
+            if choices is not None:
+                return None  # enums of arrays are not supported
+            return stack + (("array", schema, 0, "start"),)
+        if char == '"' and "string" in types:
+            return stack + (("string", schema, "", 0),)
+        if (char == "-" or char.isdigit()) and types & {"number", "integer"}:
+            return stack + (("number", schema, char),)
+        for literal, kind, value in (("true", "boolean", True), ("false", "boolean", False), ("null", "null", None)):
+            if char == literal[0] and kind in types and (choices is None or value in choices):
+                return stack + (("literal", literal[1:]),)
+        return None
+
+    def _step(self, state: State, char: str) -> Optional[State]:
+        frame = state[-1]
+        stack = state[:-1]
+        kind = frame[0]
+
+        if kind == "end":
+            return state if char in WHITESPACE else None
+
+        if kind == "value":
+            return self._start_value(stack, frame[1], char)
+
+        if kind == "literal":
+            if not frame[1] or char != frame[1][0]:
+                return None
+            if len(frame[1]) == 1:
+                return self._value_done(stack)
+            return stack + (("literal", frame[1][1:]),)
+
+        if kind == "number":
+            _, schema, text = frame
+            integer_only = "number" not in _types(schema)
+            prefix, complete = (INTEGER_PREFIX, INTEGER_COMPLETE) if integer_only else (NUMBER_PREFIX, NUMBER_COMPLETE)
+            if prefix.fullmatch(text + char):
+                return stack + (("number", schema, text + char),)
+            if not complete.fullmatch(text):
+                return None
+            choices = _choices(schema)
+            if choices is not None and json.loads(text) not in choices:
+                return None
+            # The number ended; this character belongs to the enclosing container
+            return self._step(self._value_done(stack), char)
+
+        if kind in ("string", "key"):
+            return self._step_string(stack, frame, char)
+
+        if kind == "object":
+            _, schema, seen, phase, key = frame
+            if char in WHITESPACE:
+                return state
+            allowed = _allowed_keys(schema)
+            remaining = None if allowed is None else [name for name in allowed if name not in seen]
+            if phase in ("start", "key") and char == '"':
+                if remaining is not None and not remaining:
+                    return None
+                return stack + (frame, ("key", schema, "", 0))
+            if phase in ("start", "next") and char == "}":
+                if not set(schema.get("required", [])) <= seen:
+                    return None
+                return self._value_done(stack)
+            if phase == "next" and char == ",":
+                if remaining is not None and not remaining:
+                    return None
+                return stack + (("object", schema, seen, "key", None),)
+            if phase == "colon" and char == ":":
+                return stack + (("object", schema, seen, "value", key), ("value", _property_schema(schema, key)))
+            return None
+
+        if kind == "array":
+            _, schema, count, phase = frame
+            if char in WHITESPACE:
+                return state
+            if phase in ("start", "next") and char == "]":
+                return self._value_done(stack) if count >= schema.get("minItems", 0) else None
+            if phase == "next" and char == ",":
+                if "maxItems" in schema and count >= schema["maxItems"]:
+                    return None
+                return stack + (("array", schema, count, "value"), ("value", schema.get("items", {})))
+            if phase == "start":
+                if schema.get("maxItems") == 0:
+                    return None
+                return self._start_value(stack + (("array", schema, count, "value"),), schema.get("items", {}), char)
+            return None
+
+        return None
+
+    def _step_string(self, stack: State, frame: tuple, char: str) -> Optional[State]:
+        kind, schema, text, escape = frame
+        if escape == 1:
+            if char == "u":
+                return stack + ((kind, schema, text + char, 2),)
+            if char not in '"\\/bfnrt':
+                return None
+            text, escape = text + char, 0
+        elif escape >= 2:
+            if char not in "0123456789abcdefABCDEF":
+                return None
+            text, escape = text + char, (escape + 1 if escape < 5 else 0)
+        elif char == "\\":
+            return stack + ((kind, schema, text + char, 1),)
+        elif char == '"':
+            return self._close_string(stack, frame)
+        elif ord(char) < 0x20:
+            return None
+        else:
+            text = text + char
+
+        # Enumerated strings and object keys must stay a prefix of an allowed value
+        options = self._string_options(stack, frame)
+        if options is not None and not any(option.startswith(text) for option in options):
+            return None
+        if kind == "string" and "maxLength" in schema and len(text) > schema["maxLength"]:
+            return None
+        return stack + ((kind, schema, text, escape),)
+
+    def _string_options(self, stack: State, frame: tuple) -> Optional[List[str]]:
+        kind, schema = frame[0], frame[1]
+        if kind == "key":
+            parent = stack[-1]
+            allowed = _allowed_keys(parent[1])
+            if allowed is None:
+                return None
+            return [json.dumps(name)[1:-1] for name in allowed if name not in parent[2]]
+        choices = _choices(schema)
+        if choices is None:
+            return None
+        return [json.dumps(value)[1:-1] for value in choices if isinstance(value, str)]
+
+    def _close_string(self, stack: State, frame: tuple) -> Optional[State]:
+        kind, schema, text, _ = frame
+        options = self._string_options(stack, frame)
+        if options is not None and text not in options:
+            return None
+        if kind == "string":
+            if len(text) < schema.get("minLength", 0):
+                return None
+            return self._value_done(stack)
+        key = json.loads(f'"{text}"')
+        parent = stack[-1]
+        if key in parent[2]:
+            return None
+        return stack[:-1] + (("object", parent[1], parent[2] | {key}, "colon", key),)
+
+# Held weakly, so a vocabulary goes away with its tokenizer when the model is unloaded
+_token_string_cache: "weakref.WeakKeyDictionary[Any, List[Optional[str]]]" = weakref.WeakKeyDictionary()
+
+def token_strings(tokenizer) -> List[Optional[str]]:
+    """Decoded text of every token id (None for special tokens), cached per tokenizer"""
+    cached = _token_string_cache.get(tokenizer)
+    if cached is not None:
+        return cached
+    special = set(tokenizer.all_special_ids)
+    strings: List[Optional[str]] = []
+    for token_id in range(len(tokenizer)):
+        if token_id in special:
+            strings.append(None)
+            continue
+        token = tokenizer.convert_ids_to_tokens(token_id)
+        if token is None:
+            strings.append(None)
+            continue
+        text = tokenizer.convert_tokens_to_string([token])
+        # SentencePiece drops the leading space of a lone token
+        if token.startswith("▁") and not text.startswith(" "):
+            text = " " + text
+        # Partial UTF-8 sequences cannot be validated on their own
+        strings.append(None if "�" in text else text)
+    _token_string_cache[tokenizer] = strings
+    return strings
+
+def allowed_tokens(
+    acceptor: JsonSchemaAcceptor,
+    state: State,
+    vocabulary: List[Optional[str]],
+    ranked_ids: List[int]
+) -> List[int]:
+    """Token ids from ranked_ids (best first) that keep the document valid"""
+    allowed = []
+    for token_id in ranked_ids:
+        text = vocabulary[token_id] if token_id < len(vocabulary) else None
+        if text and acceptor.advance(state, text) is not None:
+            allowed.append(token_id)
+    return allowed
+
+class JsonSchemaLogitsProcessor:
+    """transformers logits processor that keeps generation inside a JSON schema
+
+    Only the CANDIDATE_TOKENS highest-scoring tokens are checked each step;
+    the whole vocabulary is scanned only if none of them fit. Once the
+    document is complete, end-of-sequence is the only allowed token.
+    """
+
+    def __init__(self, schema: Dict[str, Any], tokenizer, prompt_length: int):
+        self.acceptor = JsonSchemaAcceptor(schema)
+        self.state: Optional[State] = self.acceptor.initial()
+        self.vocabulary = token_strings(tokenizer)
+        self.eos_token_id = tokenizer.eos_token_id
+        self.prompt_length = prompt_length
+        self.consumed = 0
+
+    def __call__(self, input_ids, scores):
+        import torch
+
+        generated = input_ids[0, self.prompt_length:].tolist()
+        for token_id in generated[self.consumed:]:
+            if token_id != self.eos_token_id and self.state is not None:
+                self.state = self.acceptor.advance(self.state, self.vocabulary[token_id] or "")
+        self.consumed = len(generated)
+
+        constrained = torch.full_like(scores, float("-inf"))
+        if self.state is None or self.acceptor.is_complete(self.state):
+            constrained[0, self.eos_token_id] = 0.0
+            return constrained
+
+        ranked = torch.topk(scores[0], min(CANDIDATE_TOKENS, scores.shape[-1])).indices.tolist()
+        allowed = allowed_tokens(self.acceptor, self.state, self.vocabulary, ranked)
+        if not allowed:
+            ranked = torch.argsort(scores[0], descending=True).tolist()
+            allowed = allowed_tokens(self.acceptor, self.state, self.vocabulary, ranked)[:CANDIDATE_TOKENS]
+        if not allowed:
+            constrained[0, self.eos_token_id] = 0.0
+            return constrained
+
+        index = torch.tensor(allowed, device=scores.device)
+        constrained[0, index] = scores[0, index]
+        # Earlier warpers (top-k/top-p) may have removed every valid token
+        if torch.isinf(constrained[0, index]).all():
+            constrained[0, index[0]] = 0.0
+        return constrained
+
+def example_instance(schema: Dict[str, Any]) -> Any:
+    """Smallest value matching a schema; used by the fake benchmarking model"""
+    choices = _choices(schema)
+    if choices:
+        return choices[0]
+    alternatives = schema.get("anyOf") or schema.get("oneOf")
+    if alternatives:
+        return example_instance(alternatives[0])
+    types = _types(schema)
+    for kind in ("object", "array", "string", "integer", "number", "boolean", "null"):
+        if kind not in types:
+            continue
+        if kind == "object":
+            return {key: example_instance(_property_schema(schema, key)) for key in schema.get("required", [])}
+        if kind == "array":
+            return [example_instance(schema.get("items", {})) for _ in range(schema.get("minItems", 0))]
+        return {"string": "", "integer": 0, "number": 0, "boolean": False, "null": None}[kind]
+    return None
+
+def schema_instructions(schema: Dict[str, Any]) -> str:
+    return "Respond only with a JSON value that matches this JSON schema:\n" + json.dumps(schema)
@@ -0,0 +1,10 @@
+"""
+Shared setup for the unit tests: import modules from the repository root and
+never load real model weights (ai_server runs with the fake model)
+"""
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+os.environ.setdefault("MODEL_NAME", "fake")
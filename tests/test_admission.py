@@ -0,0 +1,132 @@
+"""Admission control: concurrency limiter, token buckets, the ASGI middleware and its placement"""
+import asyncio
+import time
+from contextlib import asynccontextmanager
+
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from admission import (
+    ConcurrencyLimiter, Rejected, TokenBucketLimiter, install_admission_control, parse_limits
+)
+
+def test_parse_limits_merges_overrides():
+    limits = parse_limits("/a=4:10, /b=2", {"/a": (1, 1), "/c": (3, 3)})
+    assert limits == {"/a": (4, 10), "/b": (2, 2), "/c": (3, 3)}
+
+def test_limiter_queues_and_hands_slots_to_the_earliest_deadline():
+    async def scenario():
+        limiter = ConcurrencyLimiter(max_concurrent=1, max_queue=2, max_wait_seconds=5)
+        limiter.observe(0.1)
+        now = time.monotonic()
+        await limiter.acquire(now + 5)
+        order = []
+
+        async def wait(name, deadline):
+            await limiter.acquire(deadline)
+            order.append(name)
+            limiter.release()
+
+        late = asyncio.create_task(wait("late", now + 4))
+        early = asyncio.create_task(wait("early", now + 2))
+        await asyncio.sleep(0.01)
+        assert limiter.waiting == 2
+        limiter.release()
+        await asyncio.gather(late, early)
+        assert order == ["early", "late"]
+        assert limiter.active == 0
+    asyncio.run(scenario())
+
+def test_limiter_rejects_when_the_queue_is_full_or_the_wait_is_too_long():
+    async def scenario():
+        limiter = ConcurrencyLimiter(max_concurrent=1, max_queue=0, max_wait_seconds=5)
+        await limiter.acquire(time.monotonic() + 5)
+        with pytest.raises(Rejected) as full:
+            await limiter.acquire(time.monotonic() + 5)
+        assert full.value.reason == "queue_full"
+
+        limiter = ConcurrencyLimiter(max_concurrent=1, max_queue=5, max_wait_seconds=5)
+        limiter.observe(10.0)
+        await limiter.acquire(time.monotonic() + 5)
+        with pytest.raises(Rejected) as slow:
+            await limiter.acquire(time.monotonic() + 1)
+        assert slow.value.reason == "deadline"
+        assert slow.value.retry_after >= 10
+    asyncio.run(scenario())
+
+def test_limiter_times_out_waiters():
+    async def scenario():
+        limiter = ConcurrencyLimiter(max_concurrent=1, max_queue=1, max_wait_seconds=0.05)
+        limiter.observe(0.01)
+        await limiter.acquire(time.monotonic() + 5)
+        with pytest.raises(Rejected) as timed_out:
+            await limiter.acquire(time.monotonic() + 5)
+        assert timed_out.value.reason == "timeout"
+        assert limiter.waiting == 0
+    asyncio.run(scenario())
+
+def test_token_bucket_allows_bursts_then_paces():
+    bucket = TokenBucketLimiter(rate=1.0, burst=2)
+    assert bucket.take("a") == 0
+    assert bucket.take("a") == 0
+    assert 0 < bucket.take("a") <= 1.0
+    assert bucket.take("b") == 0
+
+def make_app(limits, **kwargs):
+    app = FastAPI()
+
+    @app.get("/limited")
+    async def limited():
+        return {"ok": True}
+
+    limiters = install_admission_control(app, limits, max_wait_seconds=1, **kwargs)
+    return app, limiters
+
+def test_middleware_rejects_with_retry_after():
+    app, limiters = make_app({"/limited": (1, 0)})
+    client = TestClient(app)
+    assert client.get("/limited").status_code == 200
+    limiters["/limited"].active = 1  # the only slot is taken
+    response = client.get("/limited")
+    assert response.status_code == 503
+    assert response.json()["reason"] == "queue_full"
+    assert int(response.headers["Retry-After"]) >= 1
+
+def test_middleware_rate_limits_per_client():
+    app, _ = make_app({"/limited": (4, 4)}, rate_per_second=0.001, burst=1)
+    client = TestClient(app)
+    assert client.get("/limited", headers={"X-Client-ID": "a"}).status_code == 200
+    assert client.get("/limited", headers={"X-Client-ID": "a"}).status_code == 429
+    assert client.get("/limited", headers={"X-Client-ID": "b"}).status_code == 200
+
+def test_rejected_requests_do_not_pause_bulk_jobs(monkeypatch):
+    import main
+
+    # Installed later means outermost: admission must wrap the interactive tracker
+    names = [middleware.cls.__name__ for middleware in main.app.user_middleware]
+    assert names.index("AdmissionMiddleware") < names.index("InteractiveRequestMiddleware")
+
+    entered = []
+
+    class Queue:
+        @asynccontextmanager
+        async def interactive(self):
+            entered.append(True)
+            yield
+
+    monkeypatch.setattr(main, "job_queue", Queue())
+    app = FastAPI()
+
+    @app.get("/api/chat")
+    async def chat():
+        return {"ok": True}
+
+    app.add_middleware(main.InteractiveRequestMiddleware)
+    limiters = install_admission_control(app, {"/api/chat": (1, 0)}, max_wait_seconds=1)
+    client = TestClient(app)
+    assert client.get("/api/chat").status_code == 200
+    assert entered == [True]
+    limiters["/api/chat"].active = 1
+    assert client.get("/api/chat").status_code == 503
+    assert entered == [True]
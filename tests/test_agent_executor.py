@@ -0,0 +1,126 @@
+"""Agent task graphs: implicit file ordering, validation, concurrency, failures and budgets"""
+import asyncio
+
+import pytest
+
+from agent_executor import Budget, BudgetExceeded, Step, TaskGraph, TaskGraphExecutor
+
+def test_steps_on_the_same_file_are_ordered_as_listed():
+    graph = TaskGraph([
+        Step("read1", "read", reads=["a.py"]),
+        Step("write1", "write", writes=["a.py"]),
+        Step("read2", "read", reads=["a.py"]),
+        Step("other", "read", reads=["b.py"]),
+        Step("write2", "write", writes=["a.py"])
+    ])
+    assert graph.steps["read1"].depends_on == set()
+    assert graph.steps["write1"].depends_on == {"read1"}
+    assert graph.steps["read2"].depends_on == {"write1"}
+    assert graph.steps["other"].depends_on == set()
+    assert graph.steps["write2"].depends_on == {"write1", "read2"}
+
+@pytest.mark.parametrize("steps, message", [
+    ([Step("a", "x"), Step("a", "y")], "Duplicate"),
+    ([Step("a", "x", depends_on=["missing"])], "unknown"),
+    ([Step("a", "x", depends_on=["b"]), Step("b", "x", depends_on=["a"])], "cycle")
+])
+def test_invalid_plans_are_rejected(steps, message):
+    with pytest.raises(ValueError, match=message):
+        TaskGraph(steps)
+
+def run(graph, runners, budget=None, max_parallel=4):
+    events = []
+
+    async def listener(event):
+        events.append((event["data"]["id"], event["data"]["status"]))
+
+    executor = TaskGraphExecutor(runners, budget or Budget(10, 5.0), max_parallel=max_parallel, on_event=listener)
+    asyncio.run(executor.run(graph))
+    return events
+
+def test_independent_steps_run_concurrently_up_to_the_limit():
+    active = []
+    peak = []
+
+    async def work(step, inputs):
+        active.append(step.id)
+        peak.append(len(active))
+        await asyncio.sleep(0.05)
+        active.remove(step.id)
+        return step.id
+
+    graph = TaskGraph([Step(str(i), "work") for i in range(5)])
+    run(graph, {"work": work}, max_parallel=2)
+    assert max(peak) == 2
+    assert all(step.status == "done" for step in graph.steps.values())
+
+def test_dependents_receive_their_inputs():
+    async def produce(step, inputs):
+        return step.payload["value"]
+
+    async def combine(step, inputs):
+        return sum(inputs.values())
+
+    graph = TaskGraph([
+        Step("a", "produce", {"value": 1}),
+        Step("b", "produce", {"value": 2}),
+        Step("sum", "combine", depends_on=["a", "b"])
+    ])
+    run(graph, {"produce": produce, "combine": combine})
+    assert graph.steps["sum"].result == 3
+
+def test_failure_skips_everything_downstream():
+    async def fail(step, inputs):
+        raise RuntimeError("broken")
+
+    async def ok(step, inputs):
+        return True
+
+    graph = TaskGraph([
+        Step("a", "fail"),
+        Step("b", "ok", depends_on=["a"]),
+        Step("c", "ok", depends_on=["b"]),
+        Step("d", "ok")
+    ])
+    events = run(graph, {"fail": fail, "ok": ok})
+    assert graph.steps["a"].status == "failed" and graph.steps["a"].error == "broken"
+    assert graph.steps["b"].status == graph.steps["c"].status == "skipped"
+    assert graph.steps["d"].status == "done"
+    assert ("c", "skipped") in events
+
+def test_unknown_action_fails_the_step():
+    graph = TaskGraph([Step("a", "nope")])
+    run(graph, {})
+    assert graph.steps["a"].status == "failed"
+    assert "Unknown action" in graph.steps["a"].error
+
+def test_llm_call_budget():
+    budget = Budget(max_llm_calls=1, max_seconds=5.0)
+    budget.charge_llm_call()
+    with pytest.raises(BudgetExceeded):
+        budget.charge_llm_call()
+
+    async def llm(step, inputs):
+        budget.charge_llm_call()
+
+    graph = TaskGraph([Step("a", "llm")])
+    run(graph, {"llm": llm}, budget=budget)
+    assert graph.steps["a"].status == "skipped"
+    assert "budget" in graph.steps["a"].error
+
+def test_deadline_cancels_running_steps_and_skips_the_rest():
+    cancelled = []
+
+    async def slow(step, inputs):
+        try:
+            await asyncio.sleep(5)
+        except asyncio.CancelledError:
+            cancelled.append(step.id)
+            raise
+
+    graph = TaskGraph([Step("a", "slow"), Step("b", "slow", depends_on=["a"])])
+    run(graph, {"slow": slow}, budget=Budget(10, 0.1))
+    assert cancelled == ["a"]
+    assert graph.steps["a"].status == "skipped"
+    assert graph.steps["b"].status == "skipped"
+    assert "Budget exhausted" in graph.steps["b"].error
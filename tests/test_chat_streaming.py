@@ -0,0 +1,167 @@
+"""Streamed chat completions: error propagation, timeouts, cancellation and token accounting"""
+import asyncio
+import json
+import queue
+import threading
+import types
+
+import pytest
+
+import ai_server
+
+class FakeStreamer:
+    """Stands in for TextIteratorStreamer: a queue of text pieces ended by None"""
+
+    def __init__(self, tokenizer, skip_prompt=False, timeout=None, **decode_kwargs):
+        self.queue = queue.Queue()
+        self.timeout = timeout
+
+    def put_text(self, text):
+        self.queue.put(text)
+
+    def end(self):
+        self.queue.put(None)
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        value = self.queue.get(timeout=self.timeout)
+        if value is None:
+            raise StopIteration()
+        return value
+
+class FakeOutput:
+    def __init__(self, length):
+        self.shape = (1, length)
+
+def fake_generate(pieces, fail=None, hang=False, stopped=None):
+    def generate(model, streamer, stopping_criteria, input_ids, **kwargs):
+        cancel = stopping_criteria[0]
+        produced = 0
+        for piece in pieces:
+            if cancel.event.is_set():
+                if stopped is not None:
+                    stopped.set()
+                break
+            streamer.put_text(piece)
+            produced += 1
+        if hang:
+            cancel.event.wait(5)
+            if stopped is not None:
+                stopped.set()
+        if fail:
+            raise fail
+        streamer.end()
+        # Two tokens per piece, so token counts differ from piece counts
+        return FakeOutput(input_ids.shape[1] + 2 * produced)
+    return generate
+
+@pytest.fixture
+def fake_transformers(monkeypatch):
+    monkeypatch.setattr(ai_server, "TextIteratorStreamer", FakeStreamer, raising=False)
+    monkeypatch.setattr(ai_server, "StoppingCriteriaList", list, raising=False)
+
+def run_stream(generate, monkeypatch, timeout=None):
+    monkeypatch.setattr(ai_server, "_generate_in_thread", generate)
+    if timeout is not None:
+        monkeypatch.setattr(ai_server, "stream_token_timeout", timeout)
+    loaded = ai_server.LoadedModel(model=object(), tokenizer=object())
+    usage = {}
+    kwargs = {"input_ids": types.SimpleNamespace(shape=(1, 5))}
+
+    async def collect():
+        events = []
+        async for event in ai_server.sse_chat_chunks(ai_server.stream_generated_text(loaded, kwargs, usage), "m", usage):
+            events.append(event)
+        return events
+
+    return asyncio.run(collect()), usage
+
+def contents(events):
+    payloads = [json.loads(event[len("data: "):]) for event in events if event != "data: [DONE]\n\n"]
+    return [p["choices"][0]["delta"].get("content") for p in payloads if "choices" in p], [p["error"] for p in payloads if "error" in p]
+
+def test_streams_text_and_reports_real_token_count(fake_transformers, monkeypatch):
+    events, usage = run_stream(fake_generate(["a", "b", "c"]), monkeypatch)
+    text, errors = contents(events)
+    assert [piece for piece in text if piece] == ["a", "b", "c"]
+    assert not errors
+    assert events[-1] == "data: [DONE]\n\n"
+    assert usage["completion_tokens"] == 6
+
+def test_generation_error_is_sent_to_the_client(fake_transformers, monkeypatch):
+    events, usage = run_stream(fake_generate(["a"], fail=RuntimeError("CUDA out of memory")), monkeypatch)
+    _, errors = contents(events)
+    assert errors and "CUDA out of memory" in errors[0]["message"]
+    assert "data: [DONE]\n\n" not in events
+
+def test_stalled_generation_times_out_and_is_cancelled(fake_transformers, monkeypatch):
+    stopped = threading.Event()
+    events, _ = run_stream(fake_generate(["a"], hang=True, stopped=stopped), monkeypatch, timeout=0.2)
+    _, errors = contents(events)
+    assert errors and "No tokens generated" in errors[0]["message"]
+    assert stopped.wait(2)
+
+def test_closing_the_stream_cancels_generation(fake_transformers, monkeypatch):
+    stopped = threading.Event()
+    monkeypatch.setattr(ai_server, "_generate_in_thread", fake_generate(["a"], hang=True, stopped=stopped))
+    loaded = ai_server.LoadedModel(model=object(), tokenizer=object())
+
+    async def disconnect_after_first_piece():
+        stream = ai_server.stream_generated_text(loaded, {"input_ids": types.SimpleNamespace(shape=(1, 5))}, {})
+        assert await stream.__anext__() == "a"
+        await stream.aclose()
+
+    asyncio.run(disconnect_after_first_piece())
+    assert stopped.wait(2)
+
+def failing_registry():
+    from model_registry import ModelRegistry, ModelSpec
+
+    def load(spec):
+        raise OSError("weights not found")
+
+    return ModelRegistry([ModelSpec("m", "m")], load)
+
+def test_model_load_failure_is_a_503_with_retry_after(monkeypatch):
+    from fastapi.testclient import TestClient
+
+    monkeypatch.setattr(ai_server, "registry", failing_registry())
+    monkeypatch.setattr(ai_server, "canned_fallback", False)
+    client = TestClient(ai_server.app)
+    body = {"model": "m", "messages": [{"role": "user", "content": "hi"}]}
+    for _ in range(2):  # the load error, then the backoff error
+        response = client.post("/v1/chat/completions", json=body)
+        assert response.status_code == 503
+        assert "weights not found" in response.json()["detail"]
+        assert 1 <= int(response.headers["Retry-After"]) <= 30
+
+def test_unconfigured_server_keeps_the_canned_reply(monkeypatch):
+    from fastapi.testclient import TestClient
+
+    monkeypatch.setattr(ai_server, "registry", failing_registry())
+    monkeypatch.setattr(ai_server, "canned_fallback", True)
+    response = TestClient(ai_server.app).post("/v1/chat/completions", json={"model": "m", "messages": [{"role": "user", "content": "hi"}]})
+    assert response.status_code == 200
+    assert "not loaded" in response.json()["choices"][0]["message"]["content"]
+
+@pytest.mark.parametrize("response_format", [None, {"type": "json_schema", "json_schema": {"schema": {
+    "type": "object", "properties": {"content": {"type": "string"}}, "required": ["content"]
+}}}])
+def test_fake_model_records_generation_metrics_once(response_format):
+    from prometheus_client import REGISTRY
+
+    def sample(name):
+        return REGISTRY.get_sample_value(name) or 0.0
+
+    fake_model = ai_server.FakeModel(tokens_per_second=10000, prefill_seconds=0, completion_tokens=12)
+    request = ai_server.ChatRequest(messages=[{"role": "user", "content": "hi"}], max_tokens=5, response_format=response_format)
+    tokens, observations = sample("generated_tokens_total"), sample("generation_tokens_per_second_count")
+    response = asyncio.run(ai_server.fake_chat_completion(fake_model, request))
+    assert response.usage == {"prompt_tokens": 0, "completion_tokens": 5, "total_tokens": 5}
+    if response_format:
+        assert "content" in json.loads(response.choices[0]["message"]["content"])
+    assert sample("generated_tokens_total") - tokens == 5
+    assert sample("generation_tokens_per_second_count") - observations == 1
+    assert sample("generations_in_flight") == 0
@@ -0,0 +1,78 @@
+"""Import graph: resolution rules and incremental updates matching a full rebuild"""
+import random
+
+from dependency_graph import DependencyGraph, extract_imports
+
+FILES = {
+    "app/main.py": "from app.core import db\nfrom .utils import helper\nimport models\n",
+    "app/core/db.py": "from ..models import User\n",
+    "app/core/__init__.py": "",
+    "app/utils.py": "import os\n",
+    "app/models.py": "",
+    "models.py": "from app import models\n",
+    "web/index.js": "import { api } from './api'\nconst ui = require('./components')\n",
+    "web/api.ts": "export { get } from './http.js'\nimport React from 'react'\n",
+    "web/http.js": "",
+    "web/components/index.jsx": "import '../api'\n"
+}
+
+def edges(graph):
+    return {path: sorted(targets) for path, targets in graph.imports.items() if targets}
+
+def rebuilt(files):
+    graph = DependencyGraph()
+    graph.build(files.items())
+    return graph
+
+def test_extract_imports_handles_python_and_js():
+    assert "app.core.db" in extract_imports("a.py", "from app.core import db")
+    assert extract_imports("a.py", "from . import (x,\n") == [".", ".x"]
+    assert extract_imports("a.js", "import x from './x'; require(\"y\"); import('./z')") == ["./x", "y", "./z"]
+    assert extract_imports("a.md", "import x") == []
+
+def test_build_resolves_absolute_relative_and_js_imports():
+    graph = rebuilt(FILES)
+    # "import models" prefers the candidate next to the importer
+    assert graph.imports["app/main.py"] == {"app/core/db.py", "app/utils.py", "app/models.py", "app/core/__init__.py"}
+    assert graph.imports["app/core/db.py"] == {"app/models.py"}
+    assert graph.imports["web/index.js"] == {"web/api.ts", "web/components/index.jsx"}
+    assert graph.imports["web/api.ts"] == {"web/http.js"}
+    assert graph.importers["web/api.ts"] == {"web/index.js", "web/components/index.jsx"}
+
+def test_new_file_satisfies_earlier_unresolved_imports():
+    files = {"app/main.py": "from app.services import billing\n", "web/a.js": "import './lib'\n"}
+    graph = rebuilt(files)
+    assert not graph.imports["app/main.py"]
+    graph.update_file("app/services/billing.py", "")
+    graph.update_file("web/lib/index.js", "")
+    assert graph.imports["app/main.py"] == {"app/services/billing.py"}
+    assert graph.imports["web/a.js"] == {"web/lib/index.js"}
+
+def test_new_file_only_re_resolves_files_that_could_import_it(monkeypatch):
+    graph = rebuilt(FILES)
+    resolved = []
+    original = graph._resolve
+    monkeypatch.setattr(graph, "_resolve", lambda path: (resolved.append(path), original(path)))
+    graph.update_file("app/helpers.py", "")
+    assert resolved == ["app/helpers.py"]
+
+def test_incremental_updates_match_a_full_rebuild():
+    rng = random.Random(7)
+    names = list(FILES)
+    graph = DependencyGraph()
+    current = {}
+    for _ in range(300):
+        path = rng.choice(names)
+        if path in current and rng.random() < 0.3:
+            del current[path]
+            graph.remove_file(path)
+        else:
+            content = rng.choice(list(FILES.values()))
+            current[path] = content
+            graph.update_file(path, content)
+        assert edges(graph) == edges(rebuilt(current))
+
+def test_neighbors_walk_both_directions_up_to_depth():
+    graph = rebuilt(FILES)
+    distances = graph.neighbors(["app/core/db.py"], max_depth=1)
+    assert distances == {"app/core/db.py": 0, "app/models.py": 1, "app/main.py": 1}
@@ -0,0 +1,105 @@
+"""Embedding backend selection: the agreement check, fallback to PyTorch and thread tuning"""
+import sys
+import types
+
+import numpy as np
+import pytest
+
+import embeddings
+
+class FakeSentenceTransformer:
+    def __init__(self, name, **kwargs):
+        self.name = name
+
+    def encode(self, texts, **kwargs):
+        return np.ones((len(texts), 4), dtype=np.float32) / 2
+
+@pytest.fixture
+def fake_torch(monkeypatch, tmp_path):
+    state = {"threads": 6}
+    torch = types.ModuleType("torch")
+    torch.get_num_threads = lambda: state["threads"]
+    torch.set_num_threads = lambda threads: state.update(threads=threads)
+    sentence_transformers = types.ModuleType("sentence_transformers")
+    sentence_transformers.SentenceTransformer = FakeSentenceTransformer
+    monkeypatch.setitem(sys.modules, "torch", torch)
+    monkeypatch.setitem(sys.modules, "sentence_transformers", sentence_transformers)
+    monkeypatch.setattr(embeddings, "EMBEDDING_CACHE_DIR", tmp_path)
+    return state
+
+def test_torch_backend_is_not_tuned_when_threads_are_shared(fake_torch, monkeypatch):
+    monkeypatch.setattr(embeddings, "autotune", lambda *args: pytest.fail("autotune must not run"))
+    backend = embeddings.load_embedding_backend("torch", tune=True, tune_torch_threads=False)
+    assert backend.name == "torch"
+    assert backend.threads is None
+    assert fake_torch["threads"] == 6
+
+def test_torch_autotune_applies_the_best_thread_count(fake_torch, monkeypatch):
+    monkeypatch.setattr(embeddings, "thread_candidates", lambda: [1, 2])
+    monkeypatch.setattr(embeddings, "_measure", lambda model, texts, batch_size: fake_torch["threads"] * 10 + batch_size / 1000)
+    backend = embeddings.load_embedding_backend("torch", tune=True)
+    assert backend.threads == 2
+    assert fake_torch["threads"] == 2
+
+def test_failed_autotune_restores_the_thread_count(fake_torch, monkeypatch):
+    monkeypatch.setattr(embeddings, "thread_candidates", lambda: [1, 2])
+
+    def measure(model, texts, batch_size):
+        raise MemoryError("out of memory")
+
+    monkeypatch.setattr(embeddings, "_measure", measure)
+    with pytest.raises(MemoryError):
+        embeddings.load_embedding_backend("torch", tune=True)
+    assert fake_torch["threads"] == 6
+
+class SkewedModel(FakeSentenceTransformer):
+    """An optimized model whose embeddings are off from the reference by a fixed angle"""
+
+    def __init__(self, name, cosine):
+        super().__init__(name)
+        self.cosine = cosine
+
+    def encode(self, texts, **kwargs):
+        # The reference embeds everything as (1, 1, 1, 1) / 2; tilt it towards an orthogonal unit vector
+        row = self.cosine * np.ones(4) / 2 + np.sqrt(1 - self.cosine ** 2) * np.array([1, -1, 1, -1]) / 2
+        return np.tile(row.astype(np.float32), (len(texts), 1))
+
+def onnx_models(monkeypatch, **cosines):
+    def load(backend, threads=None):
+        if backend not in cosines:
+            raise ImportError(f"no {backend}")
+        return SkewedModel(backend, cosines[backend])
+
+    monkeypatch.setattr(embeddings, "_load", load)
+
+@pytest.mark.parametrize("cosine", [0.97, 0.9799])
+def test_int8_below_the_agreement_threshold_falls_back_to_torch(fake_torch, monkeypatch, cosine):
+    onnx_models(monkeypatch, **{"onnx-int8": cosine})
+    backend = embeddings.load_embedding_backend("auto", tune=False)
+    assert backend.name == "torch"
+    assert isinstance(backend.model, FakeSentenceTransformer) and not isinstance(backend.model, SkewedModel)
+    described = backend.describe()
+    assert described["rejected"]["onnx-int8"].startswith(f"cosine agreement {cosine:.4f} < 0.98")
+    assert described["rejected"]["onnx"].startswith("unavailable")
+
+def test_int8_at_the_agreement_threshold_is_used(fake_torch, monkeypatch):
+    onnx_models(monkeypatch, **{"onnx-int8": 0.99, "onnx": 1.0})
+    backend = embeddings.load_embedding_backend("auto", tune=False)
+    assert backend.name == "onnx-int8"
+    assert backend.describe()["agreement"] == pytest.approx(0.99, abs=1e-4)
+    assert backend.rejected == {}
+
+def test_forced_onnx_backend_still_has_to_agree(fake_torch, monkeypatch):
+    onnx_models(monkeypatch, onnx=0.5)
+    assert embeddings.load_embedding_backend("onnx", tune=False).name == "torch"
+
+def test_autotuned_throughput_is_reported_and_cached(fake_torch, monkeypatch):
+    onnx_models(monkeypatch, **{"onnx-int8": 0.995})
+    monkeypatch.setattr(embeddings, "thread_candidates", lambda: [1, 2])
+    monkeypatch.setattr(embeddings, "_measure", lambda model, texts, batch_size: 100.0 + batch_size)
+    tuned = embeddings.load_embedding_backend("auto", tune=True).describe()
+    assert (tuned["backend"], tuned["batch_size"], tuned["texts_per_second"]) == ("onnx-int8", 128, 228.0)
+
+    monkeypatch.setattr(embeddings, "_measure", lambda *args: pytest.fail("cached results must be reused"))
+    assert embeddings.load_embedding_backend("auto", tune=True).describe()["texts_per_second"] == 228.0
+    assert embeddings.load_embedding_backend("torch", tune=False).describe()["texts_per_second"] is None
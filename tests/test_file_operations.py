@@ -0,0 +1,51 @@
+"""Agent file operations: the typed reply schema, parsing it and applying the operations"""
+import asyncio
+import json
+
+import main
+from jobs import JobQueue
+from structured_output import JsonSchemaAcceptor
+
+def accepted(reply):
+    acceptor = JsonSchemaAcceptor(main.FILE_OPERATIONS_SCHEMA)
+    return acceptor.is_complete(acceptor.advance(acceptor.initial(), json.dumps(reply)))
+
+def test_schema_requires_content_for_every_write():
+    ok = {"response": "done", "operations": [{"operation": "create", "path": "a.py", "content": "x = 1\n"}], "deletes": ["b.py"]}
+    assert accepted(ok)
+    assert not accepted({**ok, "operations": [{"operation": "write", "path": "a.py"}]})
+    assert not accepted({**ok, "operations": [{"operation": "patch", "path": "a.py", "content": ""}]})
+    assert not accepted({**ok, "operations": [{"operation": "delete", "path": "a.py", "content": "x"}]})
+    assert not accepted({**ok, "deletes": [""]})
+
+def test_structured_reply_skips_operations_without_content():
+    reply = json.dumps({
+        "response": "done",
+        "operations": [
+            {"operation": "create", "path": "a.py", "content": "x = 1\n"},
+            {"operation": "write", "path": "empty.py", "content": ""},
+            {"operation": "patch", "path": "b.py", "content": "<<<<<<< SEARCH\nx\n=======\ny\n>>>>>>> REPLACE"}
+        ],
+        "deletes": ["old.py"]
+    })
+    text, operations = main.parse_structured_reply(reply)
+    assert text == "done"
+    assert [(op["operation"], op["file_path"]) for op in operations] == [("CREATE", "a.py"), ("PATCH", "b.py"), ("DELETE", "old.py")]
+
+def test_free_text_replies_only_yield_explicit_edits():
+    assert main.extract_file_operations("Sure, I will create a python web scraper for you.") == []
+    edit = "a.py\n<<<<<<< SEARCH\nx = 1\n=======\nx = 2\n>>>>>>> REPLACE\n"
+    assert [op["file_path"] for op in main.extract_file_operations(edit)] == ["a.py"]
+
+def test_writes_without_content_are_rejected_not_templated(monkeypatch, tmp_path):
+    monkeypatch.setattr(main, "projects_dir", tmp_path)
+    monkeypatch.setattr(main, "active_project_path", tmp_path)
+    monkeypatch.setattr(main, "job_queue", JobQueue(workers=0))
+    operations = [
+        {"operation": "CREATE", "file_path": "stub.py", "description": "a stub"},
+        {"operation": "WRITE", "file_path": "real.py", "content": "print('hi')\n"}
+    ]
+    assert asyncio.run(main.execute_file_operations(operations, str(tmp_path)))
+    assert [op["status"] for op in operations] == ["rejected", "applied"]
+    assert not (tmp_path / "stub.py").exists()
+    assert (tmp_path / "real.py").read_text() == "print('hi')\n"
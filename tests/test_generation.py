@@ -0,0 +1,73 @@
+"""Bulk generation templates: only the known fields are substituted, everything else is literal"""
+import asyncio
+import hashlib
+import json
+import types
+
+import pytest
+from fastapi import HTTPException
+
+import main
+from jobs import JobQueue
+
+def test_templates_only_substitute_known_fields():
+    fields = main.generation_template_fields("src/pkg/util.py")
+    assert main.render_generation_template("tests/test_{stem}.py", fields) == "tests/test_util.py"
+    assert main.render_generation_template("{path} {name} {language}", fields) == "src/pkg/util.py util.py python"
+    prompt = 'Use f"{value}" and {"key": 1} in {name}, never {path.__class__} or {0}'
+    assert main.render_generation_template(prompt, fields) == 'Use f"{value}" and {"key": 1} in util.py, never {path.__class__} or {0}'
+
+class Response:
+    status_code = 200
+    headers = {}
+
+    def __init__(self, content):
+        self.content = content
+
+    def json(self):
+        return {"choices": [{"message": {"content": json.dumps({"content": self.content})}}], "usage": {"completion_tokens": 7}}
+
+    def raise_for_status(self):
+        pass
+
+@pytest.fixture
+def project(monkeypatch, tmp_path):
+    monkeypatch.setattr(main, "projects_dir", tmp_path)
+    monkeypatch.setattr(main, "job_queue", JobQueue(workers=0))
+    (tmp_path / "src").mkdir()
+    (tmp_path / "src" / "util.py").write_text("def f(x):\n    return {x}\n")
+    return tmp_path
+
+def test_generated_file_goes_to_the_rendered_output_path(project, monkeypatch):
+    sent = []
+
+    async def post_chat_completion(payload, timeout):
+        sent.append(payload)
+        return Response("def test_f():\n    assert f(1) == {1}\n")
+
+    monkeypatch.setattr(main, "post_chat_completion", post_chat_completion)
+    raw = (project / "src" / "util.py").read_bytes()
+    job = types.SimpleNamespace(payload={
+        "project_path": str(project),
+        "path": "src/util.py",
+        "source_sha": hashlib.sha256(raw).hexdigest(),
+        "prompt": "Test {name}; results look like {'ok': True}",
+        "output_path": "tests/test_{stem}.py",
+        "temperature": 0.2
+    })
+    assert asyncio.run(main.generate_for_file(job)) == {"status": "written", "completion_tokens": 7}
+    assert (project / "tests" / "test_util.py").read_text() == "def test_f():\n    assert f(1) == {1}\n"
+    assert sent[0]["messages"][1]["content"].startswith("Test util.py; results look like {'ok': True}\n")
+
+def test_generation_job_accepts_literal_braces_in_prompts(project):
+    request = main.GenerationJobRequest(project_path=str(project), prompt="Add {name} to the {'a': 1} table", output_path="docs/{stem}.md")
+    result = asyncio.run(main.create_generation_job(request))
+    assert main.job_queue.jobs[result["job_id"]].payload["prompt"] == "Add {name} to the {'a': 1} table"
+
+@pytest.mark.parametrize("output_path", ["tests/test_{stme}.py", "out/{path.__class__}.py", "out/{}.py"])
+def test_generation_job_rejects_unknown_output_path_fields(project, output_path):
+    request = main.GenerationJobRequest(project_path=str(project), prompt="Test {name}", output_path=output_path)
+    with pytest.raises(HTTPException) as error:
+        asyncio.run(main.create_generation_job(request))
+    assert error.value.status_code == 400
+    assert not main.job_queue.jobs
@@ -0,0 +1,106 @@
+"""HTTP caching: Accept-Encoding negotiation, validators and fingerprinted static assets"""
+import os
+
+import pytest
+from fastapi import FastAPI, Request
+from fastapi.testclient import TestClient
+
+import http_cache
+from http_cache import IMMUTABLE_CACHE_CONTROL, REVALIDATE_CACHE_CONTROL, StaticAssets, accepted_encodings
+
+class Headers:
+    def __init__(self, accept_encoding):
+        self.headers = {"accept-encoding": accept_encoding}
+
+@pytest.mark.parametrize("header, expected", [
+    ("gzip, br", "br"),
+    ("gzip", "gzip"),
+    ("br;q=0, gzip", "gzip"),
+    ("br;q=0.0, gzip", "gzip"),
+    ("br; q=0, gzip", "gzip"),
+    ("br;Q=0.000, gzip", "gzip"),
+    ("br;q=0.5, gzip;q=0.8", "gzip"),
+    ("br;q=0.8, gzip;q=0.8", "br"),
+    ("*", "br"),
+    ("*;q=0", None),
+    ("gzip;q=0, *", "br"),
+    ("br;q=oops, gzip", "gzip"),
+    ("identity", None),
+    ("", None)
+])
+def test_preferred_encoding_honours_q_values(header, expected):
+    assert http_cache.preferred_encoding(Headers(header), ("br", "gzip")) == expected
+
+def test_preferred_encoding_only_picks_available_codings():
+    assert http_cache.preferred_encoding(Headers("br, gzip;q=0.1"), ("gzip",)) == "gzip"
+
+def test_accepted_encodings_clamps_q():
+    assert accepted_encodings("br;q=2, gzip;q=-1") == {"br": 1.0, "gzip": 0.0}
+
+@pytest.fixture
+def assets(tmp_path):
+    (tmp_path / "app.css").write_text("body { color: red; }\n" * 100)
+    (tmp_path / "app.js").write_text("console.log('hi');\n")
+    (tmp_path / "index.html").write_text(
+        '<link rel="stylesheet" href="/static/app.css">\n'
+        "<script src='/static/app.js'></script>\n"
+        '<img src="/static/missing.png">\n'
+    )
+    return StaticAssets(str(tmp_path))
+
+def client_for(assets):
+    app = FastAPI()
+
+    @app.get("/")
+    async def root(request: Request):
+        return assets.response(request, "index.html", cache_control="no-cache")
+
+    @app.get("/static/{name:path}")
+    async def static(name: str, request: Request):
+        return assets.response(request, name)
+
+    return TestClient(app)
+
+def test_pages_link_fingerprinted_urls(assets):
+    page = client_for(assets).get("/").text
+    css = assets.url("app.css")
+    assert css.startswith("/static/app.css?v=") and len(css.split("?v=")[1]) == 12
+    assert f'href="{css}"' in page
+    assert f"src='{assets.url('app.js')}'" in page
+    # Unknown assets are left alone
+    assert '"/static/missing.png"' in page
+
+def test_only_the_exact_fingerprint_is_immutable(assets):
+    client = client_for(assets)
+    version = assets.url("app.js").split("?v=")[1]
+    assert client.get(f"/static/app.js?v={version}").headers["cache-control"] == IMMUTABLE_CACHE_CONTROL
+    for stale in ("", version[:1], version[:11], version + "0", "0" * 12):
+        assert client.get(f"/static/app.js?v={stale}").headers["cache-control"] == REVALIDATE_CACHE_CONTROL
+    assert client.get("/static/app.js").headers["cache-control"] == REVALIDATE_CACHE_CONTROL
+
+def test_compressed_variant_and_revalidation(assets):
+    client = client_for(assets)
+    response = client.get("/static/app.css", headers={"Accept-Encoding": "gzip"})
+    assert response.headers["content-encoding"] == "gzip"
+    assert response.text.startswith("body { color: red; }")
+    etag = response.headers["etag"]
+    assert client.get("/static/app.css", headers={"If-None-Match": etag}).status_code == 304
+    assert client.get("/static/app.js", headers={"Accept-Encoding": "gzip"}).headers.get("content-encoding") is None
+
+def test_unknown_assets_have_no_response(assets):
+    assert assets.response(Headers("gzip"), "nope.css") is None
+
+def test_editing_an_asset_refreshes_the_page_fingerprint(assets, tmp_path):
+    client = client_for(assets)
+    old_url = assets.url("app.js")
+    old_page = client.get("/")
+    path = tmp_path / "app.js"
+    path.write_text("console.log('changed');\n")
+    stat = path.stat()
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000))
+
+    page = client.get("/", headers={"If-None-Match": old_page.headers["etag"]})
+    assert page.status_code == 200
+    new_url = assets.url("app.js")
+    assert new_url != old_url and new_url in page.text
+    assert client.get(new_url).text == "console.log('changed');\n"
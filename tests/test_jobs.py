@@ -0,0 +1,183 @@
+"""Background job queue: coalescing, parent/child accounting, worker resilience and resume"""
+import asyncio
+import json
+
+from jobs import PRIORITY_BULK, PRIORITY_WRITE, JobQueue
+
+async def drain(queue: JobQueue, timeout: float = 2.0):
+    async def idle():
+        while queue.depth() or any(job.status == "running" and not job.children_pending for job in queue.jobs.values()):
+            await asyncio.sleep(0.01)
+    await asyncio.wait_for(idle(), timeout)
+
+def test_keyed_jobs_coalesce_to_the_newest_payload_and_most_urgent_priority():
+    async def scenario():
+        queue = JobQueue(workers=0)
+        first = queue.enqueue("index", {"v": 1}, priority=PRIORITY_BULK, key="a.py")
+        second = queue.enqueue("index", {"v": 2}, priority=PRIORITY_WRITE, key="a.py")
+        assert first is second
+        assert first.payload == {"v": 2}
+        assert first.priority == PRIORITY_WRITE
+        assert queue.depth() == 1
+    asyncio.run(scenario())
+
+def test_coalesced_child_counts_toward_every_parent():
+    async def scenario():
+        queue = JobQueue(workers=1)
+        ran = []
+
+        async def handler(jobs, queue):
+            ran.extend(job.payload["path"] for job in jobs)
+
+        queue.register("child", handler)
+        first = queue.enqueue("parent", {})
+        second = queue.enqueue("parent", {})
+        for parent in (first, second):
+            parent.status = "running"
+            queue.enqueue("child", {"path": "a.py"}, key="a.py", parent=parent)
+        assert first.children_pending == 1
+        assert second.children_pending == 1
+
+        await queue.start()
+        await drain(queue)
+        await queue.stop()
+        assert ran == ["a.py"]
+        assert first.status == "completed" and first.done == 1
+        assert second.status == "completed" and second.done == 1
+    asyncio.run(scenario())
+
+def test_handler_failure_marks_the_batch_failed():
+    async def scenario():
+        queue = JobQueue(workers=1)
+
+        async def handler(jobs, queue):
+            raise ValueError("boom")
+
+        queue.register("work", handler)
+        job = queue.enqueue("work", {})
+        await queue.start()
+        await drain(queue)
+        await queue.stop()
+        assert job.status == "failed"
+        assert job.error == "boom"
+    asyncio.run(scenario())
+
+def test_worker_survives_errors_outside_the_handler():
+    async def scenario():
+        queue = JobQueue(workers=1)
+        ran = []
+
+        async def handler(jobs, queue):
+            ran.append(jobs[0].payload["n"])
+
+        async def broken_child_finished(job):
+            raise RuntimeError("bookkeeping")
+
+        queue.register("work", handler)
+        queue._child_finished = broken_child_finished
+        first = queue.enqueue("work", {"n": 1})
+        second = queue.enqueue("work", {"n": 2})
+        await queue.start()
+        await drain(queue)
+        await queue.stop()
+        assert ran == [1, 2]
+        assert first.status == second.status == "completed"
+    asyncio.run(scenario())
+
+def test_batches_take_jobs_of_one_kind_and_priority():
+    async def scenario():
+        queue = JobQueue(workers=1)
+        batches = []
+
+        async def handler(jobs, queue):
+            batches.append([job.payload["n"] for job in jobs])
+
+        queue.register("work", handler, batch_size=2)
+        for n in range(3):
+            queue.enqueue("work", {"n": n})
+        await queue.start()
+        await drain(queue)
+        await queue.stop()
+        assert batches == [[0, 1], [2]]
+    asyncio.run(scenario())
+
+def test_queued_jobs_resume_after_restart(tmp_path):
+    state_path = str(tmp_path / "jobs.json")
+
+    async def save():
+        queue = JobQueue(state_path=state_path, workers=0)
+        parent = queue.enqueue("parent", {})
+        parent.status = "running"
+        queue.enqueue("child", {"path": "a.py"}, key="a.py", parent=parent)
+        queue._save_state()
+        return parent.id
+
+    async def resume(parent_id):
+        queue = JobQueue(state_path=state_path, workers=1)
+        queue.register("child", lambda jobs, queue: asyncio.sleep(0))
+        await queue.start()
+        await drain(queue)
+        await queue.stop()
+        return queue.jobs[parent_id]
+
+    parent_id = asyncio.run(save())
+    parent = asyncio.run(resume(parent_id))
+    assert parent.status == "completed"
+    assert parent.done == 1
+
+def test_batch_size_is_read_when_the_batch_is_taken():
+    async def scenario():
+        queue = JobQueue(workers=1)
+        limit = {"size": 1}
+        batches = []
+
+        async def handler(jobs, queue):
+            batches.append(len(jobs))
+            limit["size"] = 3
+
+        queue.register("work", handler, batch_size=lambda: limit["size"])
+        for n in range(4):
+            queue.enqueue("work", {"n": n})
+        await queue.start()
+        await drain(queue)
+        await queue.stop()
+        assert batches == [1, 3]
+    asyncio.run(scenario())
+
+def test_fan_out_re_creates_children_missing_from_the_saved_state(tmp_path):
+    state_path = str(tmp_path / "jobs.json")
+
+    async def save():
+        queue = JobQueue(state_path=state_path, workers=0)
+        parent = queue.enqueue("parent", {})
+        parent.status = "running"
+        children = queue.fan_out(parent, "child", {f"child:{name}": {"path": name} for name in ("a.py", "b.py", "c.py")})
+        assert parent.total == 3 and parent.children_pending == 3
+        # a.py finished; the state was saved before b.py was queued
+        children[0].status = "completed"
+        await queue._child_finished(children[0])
+        children[1].status = "completed"
+        queue._save_state()
+        return parent.id
+
+    async def resume(parent_id):
+        queue = JobQueue(state_path=state_path, workers=1)
+        ran = []
+
+        async def handler(jobs, queue):
+            ran.extend(job.payload["path"] for job in jobs)
+
+        queue.register("child", handler)
+        await queue.start()
+        parent = queue.jobs[parent_id]
+        assert parent.children_pending == 2 and parent.done == 1
+        await drain(queue)
+        await queue.stop()
+        return parent, ran
+
+    parent_id = asyncio.run(save())
+    children_state = [job for job in json.load(open(state_path)) if job["kind"] == "child"]
+    assert [job["payload"]["path"] for job in children_state] == ["c.py"]
+    parent, ran = asyncio.run(resume(parent_id))
+    assert sorted(ran) == ["b.py", "c.py"]
+    assert parent.status == "completed" and parent.done == 3 and parent.planned == {}
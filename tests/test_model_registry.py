@@ -0,0 +1,180 @@
+"""Model registry: resolution, LRU eviction under a budget, concurrent loads and failure backoff"""
+import asyncio
+import threading
+import time
+
+import pytest
+
+import model_registry
+from model_registry import GIB, ModelRegistry, ModelSpec, load_model_specs
+
+class Loader:
+    """Records loads/unloads; each model "weighs" its spec size (or 1 GiB)"""
+
+    def __init__(self, delay: float = 0.0, fail=()):
+        self.delay = delay
+        self.fail = set(fail)
+        self.loads = []
+        self.unloads = []
+        self.unload_threads = []
+        self.peak_bytes = 0
+        self.resident = {}
+
+    def load(self, spec):
+        time.sleep(self.delay)
+        if spec.id in self.fail:
+            raise OSError(f"cannot load {spec.id}")
+        self.loads.append(spec.id)
+        size = spec.size_bytes or GIB
+        self.resident[spec.id] = size
+        self.peak_bytes = max(self.peak_bytes, sum(self.resident.values()))
+        return spec.id, size
+
+    def unload(self, handle):
+        self.unloads.append(handle)
+        self.unload_threads.append(threading.current_thread())
+        self.resident.pop(handle, None)
+
+def registry(specs, loader, budget_gb=0):
+    return ModelRegistry(specs, loader.load, loader.unload, memory_budget_bytes=int(budget_gb * GIB))
+
+def use(reg, name):
+    async def run():
+        async with reg.use(name) as handle:
+            return handle
+    return run()
+
+def test_load_model_specs():
+    specs, fallback = load_model_specs("", "org/model")
+    assert fallback and specs[0].source == "org/model" and specs[0].pinned
+    specs, fallback = load_model_specs('{"a": "org/a", "b": {"source": "org/b", "size_gb": 2, "aliases": ["bee"]}}', "x")
+    assert not fallback
+    assert [spec.id for spec in specs] == ["a", "b"]
+    assert specs[1].size_bytes == 2 * GIB and specs[1].aliases == ["bee"]
+
+def test_resolve_aliases_and_unknown_models():
+    loader = Loader()
+    reg = registry([ModelSpec("a", "org/a", aliases=["alpha"]), ModelSpec("b", "org/b")], loader)
+    assert reg.resolve("alpha").spec.id == "a"
+    assert reg.resolve(None).spec.id == "a"
+    with pytest.raises(KeyError):
+        reg.resolve("nope")
+
+def test_least_recently_used_model_is_evicted_in_a_worker_thread():
+    loader = Loader()
+    reg = registry([ModelSpec("a", "a"), ModelSpec("b", "b"), ModelSpec("c", "c")], loader, budget_gb=2)
+
+    async def scenario():
+        await use(reg, "a")
+        await use(reg, "b")
+        await use(reg, "a")
+        await use(reg, "c")
+
+    asyncio.run(scenario())
+    assert loader.unloads == ["b"]
+    assert threading.main_thread() not in loader.unload_threads
+    assert reg.entries["b"].state == "unloaded"
+    assert reg.loaded_bytes() == 2 * GIB
+
+def test_pinned_and_in_use_models_are_not_evicted():
+    loader = Loader()
+    reg = registry([ModelSpec("a", "a", pinned=True), ModelSpec("b", "b"), ModelSpec("c", "c")], loader, budget_gb=2)
+
+    async def scenario():
+        await use(reg, "a")
+        async with reg.use("b"):
+            await use(reg, "c")
+
+    asyncio.run(scenario())
+    assert loader.unloads == []
+    assert reg.loaded_bytes() == 3 * GIB
+
+def test_concurrent_loads_do_not_jointly_exceed_the_budget():
+    loader = Loader(delay=0.05)
+    specs = [ModelSpec(name, name, size_bytes=GIB) for name in "abc"]
+    reg = registry(specs, loader, budget_gb=2)
+
+    async def scenario():
+        await use(reg, "a")
+        await asyncio.gather(use(reg, "b"), use(reg, "c"))
+
+    asyncio.run(scenario())
+    assert loader.peak_bytes <= 2 * GIB
+    assert reg.loaded_bytes() <= 2 * GIB
+    assert sorted(loader.loads) == ["a", "b", "c"]
+
+def test_failed_load_backs_off_before_retrying(monkeypatch):
+    loader = Loader(fail={"a"})
+    reg = registry([ModelSpec("a", "a")], loader)
+
+    async def attempt():
+        with pytest.raises(Exception) as error:
+            await use(reg, "a")
+        return str(error.value)
+
+    assert "cannot load a" in asyncio.run(attempt())
+    entry = reg.entries["a"]
+    assert entry.state == "failed" and entry.failures == 1
+
+    # Within the backoff the load is not attempted again
+    loader.fail.clear()
+    assert "next attempt in" in asyncio.run(attempt())
+    assert loader.loads == []
+    assert entry.to_dict()["retry_in_seconds"] > 0
+
+    entry.retry_at = time.time() - 1
+    assert asyncio.run(use(reg, "a")) == "a"
+    assert entry.failures == 0 and entry.state == "loaded"
+
+def test_backoff_doubles_up_to_the_maximum(monkeypatch):
+    monkeypatch.setattr(model_registry, "LOAD_RETRY_SECONDS", 10.0)
+    monkeypatch.setattr(model_registry, "LOAD_RETRY_MAX_SECONDS", 25.0)
+    loader = Loader(fail={"a"})
+    reg = registry([ModelSpec("a", "a")], loader)
+    entry = reg.entries["a"]
+    waits = []
+    for _ in range(3):
+        reg.preload(["a"])
+        waits.append(round(entry.retry_at - time.time()))
+    assert waits == [10, 20, 25]
+
+def test_preload_loads_pinned_models():
+    loader = Loader()
+    reg = registry([ModelSpec("a", "a", pinned=True), ModelSpec("b", "b")], loader)
+    reg.preload()
+    assert loader.loads == ["a"]
+    assert reg.entries["a"].state == "loaded"
+
+def test_cancelled_load_settles_its_reservation():
+    loader = Loader(delay=0.2)
+    specs = [ModelSpec("a", "a", size_bytes=10 * GIB), ModelSpec("b", "b", size_bytes=10 * GIB)]
+    reg = registry(specs, loader, budget_gb=15)
+
+    async def scenario():
+        request = asyncio.create_task(use(reg, "a"))
+        await asyncio.sleep(0.05)
+        request.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await request
+        # The load finishes in the background and is then evicted to make room for b
+        assert await asyncio.wait_for(use(reg, "b"), timeout=2) == "b"
+
+    asyncio.run(scenario())
+    assert loader.loads == ["a", "b"]
+    assert loader.unloads == ["a"]
+    assert reg.entries["a"].state == "unloaded" and reg.entries["a"].reserved_bytes == 0
+    assert reg._loads_in_flight == 0
+    assert reg.loaded_bytes() == 10 * GIB
+
+def test_callers_share_a_load_in_flight():
+    loader = Loader(delay=0.1)
+    reg = registry([ModelSpec("a", "a")], loader)
+
+    async def scenario():
+        first = asyncio.create_task(use(reg, "a"))
+        await asyncio.sleep(0.02)
+        first.cancel()
+        return await use(reg, "a")
+
+    assert asyncio.run(scenario()) == "a"
+    assert loader.loads == ["a"]
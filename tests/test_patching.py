@@ -0,0 +1,105 @@
+"""Edit application: SEARCH/REPLACE and unified diffs, fuzzy matching limits, conflicts and line endings"""
+from patching import apply_patch, extract_edits, parse_unified_diff
+
+def search_replace(search: str, replace: str) -> str:
+    return f"<<<<<<< SEARCH\n{search}=======\n{replace}>>>>>>> REPLACE\n"
+
+SOURCE = """def load(path):
+    with open(path) as f:
+        data = f.read()
+    return parse(data)
+
+def save(path, data):
+    with open(path, "w") as f:
+        f.write(data)
+"""
+
+def test_exact_search_replace():
+    result = apply_patch(SOURCE, search_replace("        data = f.read()\n", "        data = f.read().strip()\n"))
+    assert result.ok and result.applied == 1
+    assert "data = f.read().strip()" in result.content
+    assert result.content.endswith("f.write(data)\n")
+
+def test_whitespace_differences_still_match():
+    result = apply_patch(SOURCE, search_replace("data   =  f.read()\n", "        data = f.read(1024)\n"))
+    assert result.ok
+    assert "f.read(1024)" in result.content
+
+def test_fuzzy_match_for_longer_hunks():
+    search = "def load(path):\n    with open(path) as fh:\n        data = f.read()\n    return parse(data)\n"
+    result = apply_patch(SOURCE, search_replace(search, "def load(path):\n    return parse(open(path).read())\n"))
+    assert result.ok
+    assert result.content.startswith("def load(path):\n    return parse(open(path).read())\n\ndef save")
+
+def test_short_hunk_never_matches_by_similarity():
+    original = "x = 1\ny = 2\n"
+    result = apply_patch(original, search_replace("x = 5\n", "x = 6\n"))
+    assert not result.ok
+    assert result.content == original
+
+def test_duplicate_exact_matches_are_ambiguous():
+    original = "a()\nb()\na()\n"
+    result = apply_patch(original, search_replace("a()\n", "c()\n"))
+    assert not result.ok
+    assert "2 places" in result.conflicts[0]["reason"]
+
+def test_diff_line_numbers_disambiguate_repeated_lines():
+    original = "a()\nb()\na()\n"
+    patch = "--- a/f.py\n+++ b/f.py\n@@ -3,1 +3,1 @@\n-a()\n+c()\n"
+    result = apply_patch(original, patch)
+    assert result.ok
+    assert result.content == "a()\nb()\nc()\n"
+
+def test_identical_hunks_do_not_match_each_others_output():
+    original = "value = 1\nother = 2\n"
+    block = search_replace("value = 1\n", "value = 1\nvalue = 1\n")
+    result = apply_patch(original, block + block)
+    assert not result.ok
+    assert "Overlaps" in result.conflicts[0]["reason"]
+    assert result.content == original
+
+def test_hunks_match_against_the_original_text():
+    original = "a = 1\nb = 2\n"
+    patch = search_replace("a = 1\n", "b = 2\n") + search_replace("b = 2\n", "b = 3\n")
+    result = apply_patch(original, patch)
+    assert result.ok
+    assert result.content == "b = 2\nb = 3\n"
+
+def test_empty_search_is_rejected():
+    result = apply_patch(SOURCE, search_replace("", "import os\n"))
+    assert not result.ok
+    assert "Empty SEARCH" in result.conflicts[0]["reason"]
+
+def test_pure_insertion_diff_inserts_after_the_given_line():
+    patch = "@@ -1,0 +2,1 @@\n+    # read the whole file\n"
+    result = apply_patch(SOURCE, patch)
+    assert result.ok
+    assert result.content.splitlines()[1] == "    # read the whole file"
+
+def test_all_or_nothing_when_a_hunk_fails():
+    patch = search_replace("def load(path):\n", "def load(path, mode):\n") + search_replace("missing()\n", "x\n")
+    result = apply_patch(SOURCE, patch)
+    assert not result.ok
+    assert result.applied == 0
+    assert [conflict["hunk"] for conflict in result.conflicts] == [1]
+    assert result.content == SOURCE
+
+def test_crlf_line_endings_are_preserved():
+    original = SOURCE.replace("\n", "\r\n")
+    result = apply_patch(original, search_replace("        data = f.read()\n", "        data = f.read()\n        data = data.strip()\n"))
+    assert result.ok
+    assert "\r\n" in result.content
+    assert "\n" not in result.content.replace("\r\n", "")
+    assert result.content.endswith("\r\n")
+
+def test_unified_diff_hints_for_following_hunks():
+    hunks = parse_unified_diff("@@ -2,2 +2,2 @@\n a\n-b\n+c\n@@ -10,0 +11,1 @@\n+d\n")
+    assert [hunk.hint for hunk in hunks] == [1, 10]
+    assert hunks[0].old == ["a", "b"] and hunks[0].new == ["a", "c"]
+
+def test_extract_edits_from_a_reply():
+    reply = "Here you go.\n\nsrc/app.py\n" + search_replace("a\n", "b\n") + "\n```diff\n--- a/lib.js\n+++ b/lib.js\n@@ -1 +1 @@\n-x\n+y\n```\n"
+    edits = {edit["file_path"]: edit["patch"] for edit in extract_edits(reply)}
+    assert set(edits) == {"src/app.py", "lib.js"}
+    assert apply_patch("a\n", edits["src/app.py"]).content == "b\n"
+    assert apply_patch("x\n", edits["lib.js"]).content == "y\n"
@@ -0,0 +1,59 @@
+"""Project scoping: files the agent writes are indexed where retrieval with the same scope looks"""
+import asyncio
+import hashlib
+import re
+
+import numpy as np
+import pytest
+
+import main
+from jobs import JobQueue
+from vector_store import FlatVectorStore
+
+class HashingEncoder:
+    """Bag-of-words embedding: enough for identifiers to find their chunk"""
+
+    def encode(self, texts):
+        vectors = np.zeros((len(texts), 64), dtype=np.float32)
+        for row, text in enumerate(texts):
+            for word in re.findall(r"[a-z_]+", text.lower()):
+                vectors[row, int(hashlib.md5(word.encode()).hexdigest(), 16) % 64] += 1
+        return vectors / np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-9)
+
+@pytest.fixture
+def projects(monkeypatch, tmp_path):
+    root = (tmp_path / "projects").resolve()
+    root.mkdir()
+    monkeypatch.setattr(main, "projects_dir", root)
+    monkeypatch.setattr(main, "active_project_path", root)
+    monkeypatch.setattr(main, "vector_store_backend", "flat")
+    monkeypatch.setattr(main, "vector_db", FlatVectorStore(str(tmp_path / "flat")))
+    monkeypatch.setattr(main, "embedding_model", HashingEncoder())
+    monkeypatch.setattr(main, "job_queue", JobQueue(workers=0))
+    for name in ("project_collections", "project_lexical_indexes", "project_index_locks", "project_graphs"):
+        monkeypatch.setattr(main, name, {})
+    return root
+
+async def write_and_index(operation, project_path):
+    await main.execute_file_operations([operation], project_path)
+    jobs = list(main.job_queue.jobs.values())
+    await main.run_index_file_jobs(jobs, main.job_queue)
+    return jobs
+
+def test_agent_writes_are_retrieved_with_the_default_project(projects):
+    async def scenario():
+        # The UI's default scope is the projects root
+        scope = str(main.resolve_project_path(None))
+        operation = {"operation": "CREATE", "file_path": "app/x.py", "content": "def frobnicate_widget_totals():\n    return 42\n"}
+        jobs = await write_and_index(operation, scope)
+        assert operation["status"] == "applied"
+        assert [job.payload["project_path"] for job in jobs] == [str(projects)]
+        return await main.get_relevant_context("frobnicate_widget_totals", project_path=main.resolve_project_path(scope))
+
+    assert "frobnicate_widget_totals" in asyncio.run(scenario())
+
+def test_project_for_file_follows_the_request_scope(projects):
+    app = projects / "app"
+    assert main.project_for_file(app / "x.py") == projects
+    assert main.project_for_file(app / "x.py", app) == app
+    assert main.project_for_file(projects / "other" / "y.py", app) == projects / "other"
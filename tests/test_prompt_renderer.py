@@ -0,0 +1,51 @@
+"""Prompt rendering and truncation in ai_server.PromptRenderer"""
+import pytest
+
+from ai_server import PromptRenderer, PromptTooLong, TokenCache
+
+class WordTokenizer:
+    """One token per whitespace-separated word; no chat template (fallback format)"""
+    chat_template = None
+
+    def encode(self, text, add_special_tokens=False):
+        return [hash(word) % 1000 for word in text.split()]
+
+def renderer():
+    tokenizer = WordTokenizer()
+    return PromptRenderer(tokenizer, TokenCache(tokenizer))
+
+def conversation(turns):
+    messages = [{"role": "system", "content": "you are a careful assistant"}]
+    for i in range(turns):
+        messages.append({"role": "user", "content": f"question {i} " + "word " * 10})
+        messages.append({"role": "assistant", "content": f"answer {i} " + "word " * 10})
+    messages.append({"role": "user", "content": "final question"})
+    return messages
+
+def test_prompt_that_fits_is_unchanged():
+    r = renderer()
+    messages = conversation(2)
+    assert r.render_ids(messages, max_prompt_tokens=10_000) == r.render_ids(messages)
+
+def test_truncation_drops_whole_oldest_turns_and_keeps_system_prompt():
+    r = renderer()
+    messages = conversation(5)
+    full = r.render_ids(messages)
+    budget = len(full) - 20
+    ids = r.render_ids(messages, max_prompt_tokens=budget)
+    assert len(ids) <= budget
+    # The result is exactly a rendering of the system prompt plus a suffix of whole turns
+    kept = None
+    for start in range(1, len(messages)):
+        if r.render_ids([messages[0]] + messages[start:]) == ids:
+            kept = messages[start:]
+            break
+    assert kept is not None
+    assert kept[0]["role"] == "user"
+    assert kept[-1]["content"] == "final question"
+
+def test_system_prompt_and_last_turn_that_do_not_fit_raise():
+    r = renderer()
+    messages = [{"role": "system", "content": "word " * 50}, {"role": "user", "content": "hi"}]
+    with pytest.raises(PromptTooLong):
+        r.render_ids(messages, max_prompt_tokens=10)
@@ -0,0 +1,159 @@
+"""Hybrid retrieval: tokenizing, BM25, rank fusion, MMR, candidate ranking and the lexical index lifecycle"""
+import asyncio
+import sys
+import time
+import types
+
+import numpy as np
+import pytest
+
+import retrieval
+from retrieval import BM25Index, mmr_select, rank_candidates, reciprocal_rank_fusion, tokenize
+
+def unit(*values):
+    vector = np.asarray(values, dtype=np.float32)
+    return vector / np.linalg.norm(vector)
+
+def test_tokenize_splits_identifiers():
+    assert tokenize("parseHTTPRequest") == ["parsehttprequest", "parse", "http", "request"]
+    assert tokenize("load_user_profile(x)") == ["load_user_profile", "load", "user", "profile"]
+    assert tokenize("a 42") == ["42"]
+
+def test_bm25_ranks_rare_terms_and_stays_in_sync():
+    index = BM25Index()
+    index.add("a", "def parse_invoice(): return total", {"path": "a.py"})
+    index.add("b", "def render(): return total", {"path": "b.py"})
+    index.add("c", "def render_invoice(): return total", {"path": "c.py"})
+    assert [doc_id for doc_id, _ in index.search("parse invoice", 3)] == ["a", "c"]
+    assert [doc_id for doc_id, _ in index.search("invoice", 3, where={"path": "c.py"})] == ["c"]
+
+    index.add("a", "def unrelated(): pass", {"path": "a.py"})
+    assert [doc_id for doc_id, _ in index.search("parse", 3)] == []
+    index.remove_where({"path": "c.py"})
+    assert len(index) == 2
+    assert index.search("invoice", 3) == []
+    assert BM25Index().search("anything", 3) == []
+
+def test_reciprocal_rank_fusion_rewards_agreement():
+    fused = reciprocal_rank_fusion([["a", "b", "c"], ["b", "d"]])
+    assert [doc_id for doc_id, _ in fused] == ["b", "a", "d", "c"]
+    assert fused[0][1] == pytest.approx(1 / 62 + 1 / 61)
+
+def test_mmr_skips_near_duplicates_and_trades_relevance_for_diversity():
+    vectors = np.stack([unit(1, 0), unit(1, 0.01), unit(0.6, 0.8)])
+    assert mmr_select([1.0, 0.99, 0.5], vectors, k=3) == [0, 2]
+    assert mmr_select([1.0, 0.99, 0.5], vectors, k=3, lambda_=1.0, duplicate_similarity=1.1) == [0, 1, 2]
+    assert mmr_select([], np.zeros((0, 2)), k=3) == []
+
+def test_rank_candidates_applies_the_similarity_floor_except_for_strong_lexical_hits():
+    query = unit(1, 0)
+    candidates = {
+        "close": ("close", {}, unit(1, 0.2)),
+        "far": ("far", {}, unit(0, 1)),
+        "exact_name": ("exact_name", {}, unit(-0.1, 1))
+    }
+    selected = rank_candidates("q", query, ["close", "far"], [("exact_name", 5.0)], candidates, max_results=5)
+    assert selected == ["close", "exact_name"]
+    assert rank_candidates("q", query, [], [], {}, max_results=5) == []
+
+def test_reranker_scores_are_cached_by_content(monkeypatch):
+    calls = []
+
+    class CrossEncoder:
+        def __init__(self, name, device=None):
+            pass
+
+        def predict(self, pairs, show_progress_bar=False):
+            calls.append(len(pairs))
+            return np.asarray([len(text) for _, text in pairs], dtype=np.float32)
+
+    monkeypatch.setitem(sys.modules, "sentence_transformers", types.SimpleNamespace(CrossEncoder=CrossEncoder))
+    reranker = retrieval.CrossEncoderReranker("fake", cache_size=2)
+    first = reranker.score("q", ["a", "bbb"])
+    assert first[1] > first[0]
+    assert reranker.score("q", ["bbb", "a"]) == [first[1], first[0]]
+    assert calls == [2]
+    reranker.score("q", ["cc"])
+    assert calls == [2, 1]
+    assert len(reranker._cache) == 2
+
+def test_hybrid_benchmark_backend_uses_query_text(tmp_path):
+    from retrieval_benchmark import BACKENDS
+
+    index = BACKENDS["hybrid"](tmp_path)
+    index.add(
+        ids=["target", "distractor:0", "distractor:1"],
+        embeddings=np.stack([unit(0.5, 1), unit(1, 0), unit(1, 0.05)]),
+        documents=["def checksum_adler32(data): ...", "", ""],
+        metadatas=[{"kind": "file"}] * 3
+    )
+    query = np.stack([unit(1, 0.3)])
+    assert index.query(query, n_results=1, query_texts=["adler32 checksum"])["ids"] == [["target"]]
+    assert BACKENDS["exact"](tmp_path).__class__.__name__ == "ExactIndex"
+
+def test_synthetic_queries_only_use_words_from_their_target():
+    from retrieval_benchmark import synthetic_corpus
+
+    corpus = synthetic_corpus(50, seed=0)
+    documents = dict(zip(corpus.ids, corpus.documents))
+    for query, target in corpus.queries:
+        code = documents[target].split("Code:", 1)[1]
+        assert set(tokenize(query)) <= set(tokenize(code)), query
+    filler = synthetic_corpus(100, seed=0, offset=50)
+    # Filler past the labelled chunks never repeats a target's combination of words
+    assert not {query for query, _ in corpus.queries} & {query for query, _ in filler.queries}
+
+def test_smaller_sizes_still_index_the_labelled_targets(tmp_path):
+    from retrieval_benchmark import Corpus, evaluate
+
+    corpus = Corpus("test")
+    for i in range(6):
+        corpus.add(f"chunk:{i}", f"f{i}.py", f"def f{i}(): pass", "python")
+    # Only the last chunks are labelled, as when a repo's documented functions come late
+    corpus.queries = [("f4", "chunk:4"), ("f5", "chunk:5")]
+    embeddings = np.eye(8, dtype=np.float32)
+    query_embeddings = embeddings[[4, 5]]
+    small = evaluate("exact", 2, corpus, embeddings, query_embeddings, 2, tmp_path, batch_size=1)
+    assert small["queries"] == 2 and small["recall@1"] == 1.0
+    smallest = evaluate("hybrid", 1, corpus, embeddings, query_embeddings, 2, tmp_path, batch_size=1)
+    assert smallest["queries"] == 1 and smallest["recall@1"] == 1.0
+    full = evaluate("exact", 8, corpus, embeddings, query_embeddings, 2, tmp_path, batch_size=3)
+    assert full["queries"] == 2 and full["recall@1"] == 1.0
+
+class SlowCollection:
+    """Collection whose full read takes a while, as for a large project"""
+
+    def __init__(self):
+        self.entries = {"a.py:0": ("def a(): pass", {"kind": "file", "path": "a.py"})}
+
+    def get(self, include=None):
+        snapshot = dict(self.entries)
+        time.sleep(0.1)
+        return {
+            "ids": list(snapshot),
+            "documents": [document for document, _ in snapshot.values()],
+            "metadatas": [metadata for _, metadata in snapshot.values()]
+        }
+
+    def delete(self, where=None):
+        self.entries = {doc_id: entry for doc_id, entry in self.entries.items() if entry[1]["path"] != where["path"]}
+
+def test_updates_during_a_lexical_build_are_not_lost(monkeypatch, tmp_path):
+    import main
+
+    collection = SlowCollection()
+    monkeypatch.setattr(main, "project_lexical_indexes", {})
+    monkeypatch.setattr(main, "project_index_locks", {})
+    monkeypatch.setattr(main, "get_project_collection", lambda project_path=None, create=True: collection)
+
+    async def scenario():
+        build = asyncio.create_task(main.get_lexical_index(tmp_path))
+        await asyncio.sleep(0.02)
+        await main.remove_code_context("a.py", tmp_path)
+        index = await build
+        assert index is await main.get_lexical_index(tmp_path)
+        return index
+
+    index = asyncio.run(scenario())
+    assert collection.entries == {}
+    assert index.search("def", 5) == []
@@ -0,0 +1,48 @@
+"""Conversation sessions: prompt assembly, compaction and the extractive fallback"""
+import asyncio
+
+from sessions import EXTRACTIVE_SUMMARY_MAX_LINES, ConversationSession, ConversationStore, extractive_summary
+
+def test_summary_is_merged_into_the_leading_system_message():
+    session = ConversationSession("s")
+    session.summary = "User is building a CLI"
+    session.add_turn("user", "add a flag")
+    session.add_turn("assistant", "done")
+    messages = session.prompt_messages("You are helpful.", "next")
+    assert [m["role"] for m in messages] == ["system", "user", "assistant", "user"]
+    assert messages[0]["content"].startswith("You are helpful.")
+    assert "User is building a CLI" in messages[0]["content"]
+    assert messages[-1]["content"] == "next"
+
+def test_no_summary_leaves_system_prompt_unchanged():
+    messages = ConversationSession("s").prompt_messages("sys", "hi")
+    assert messages == [{"role": "system", "content": "sys"}, {"role": "user", "content": "hi"}]
+
+def test_extractive_summary_is_capped_across_repeated_failures():
+    summary = ""
+    for round_ in range(50):
+        turns = [{"role": "user", "content": f"message {round_}-{i} " * 30} for i in range(4)]
+        summary = extractive_summary(summary, turns)
+    lines = summary.splitlines()
+    assert len(lines) == EXTRACTIVE_SUMMARY_MAX_LINES
+    # The most recent turns survive
+    assert "message 49-3" in lines[-1]
+    assert all(len(line) < 260 for line in lines)
+
+def test_failed_summarizer_falls_back_and_keeps_recent_turns():
+    async def failing(previous, turns):
+        raise RuntimeError("model down")
+
+    async def run():
+        store = ConversationStore(failing, summary_threshold_tokens=10, keep_recent_turns=2)
+        session = store.get_or_create("s")
+        for i in range(6):
+            session.add_turn("user" if i % 2 == 0 else "assistant", f"turn {i} " * 20)
+        store.maybe_compact(session)
+        await asyncio.gather(*store._tasks)
+        return session
+
+    session = asyncio.run(run())
+    assert len(session.turns) == 2
+    assert session.compactions == 1
+    assert "turn 0" in session.summary
@@ -0,0 +1,109 @@
+"""Schema-constrained decoding: the incremental acceptor, token masking and the vocabulary cache"""
+import gc
+import json
+
+import pytest
+
+import structured_output
+from structured_output import (
+    JsonSchemaAcceptor, allowed_tokens, example_instance, response_format_schema, token_strings
+)
+
+SCHEMA = {
+    "type": "object",
+    "properties": {
+        "name": {"type": "string", "minLength": 1},
+        "count": {"type": "integer"},
+        "tags": {"type": "array", "items": {"type": "string"}, "maxItems": 2},
+        "mode": {"enum": ["fast", "slow"]}
+    },
+    "required": ["name", "count"],
+    "additionalProperties": False
+}
+
+def complete(schema, text):
+    acceptor = JsonSchemaAcceptor(schema)
+    state = acceptor.advance(acceptor.initial(), text)
+    return state is not None and acceptor.is_complete(state)
+
+def viable(schema, text):
+    acceptor = JsonSchemaAcceptor(schema)
+    return acceptor.advance(acceptor.initial(), text) is not None
+
+@pytest.mark.parametrize("text", [
+    '{"name": "a", "count": 3}',
+    '{"count": -12, "name": "x", "tags": ["p", "q"], "mode": "slow"}',
+    '{ "name" : "a\\"b" , "count" : 0 }'
+])
+def test_valid_documents_complete(text):
+    assert complete(SCHEMA, text)
+    json.loads(text)
+
+@pytest.mark.parametrize("text", [
+    '{"name": "a"}',  # missing required
+    '{"name": "", "count": 1}',  # minLength
+    '{"name": "a", "count": 1.5}',  # integer
+    '{"name": "a", "count": 1, "extra": 1}',  # additionalProperties
+    '{"name": "a", "count": 1, "tags": ["a", "b", "c"]}',  # maxItems
+    '{"name": "a", "count": 1, "mode": "medium"}',  # enum
+    '{"name": "a", "name": "b", "count": 1}',  # duplicate key
+    '[1]'
+])
+def test_invalid_documents_are_rejected(text):
+    assert not complete(SCHEMA, text)
+
+def test_prefixes_stay_viable_until_they_break_the_schema():
+    assert viable(SCHEMA, '{"name": "a", "cou')
+    assert viable(SCHEMA, '{"name": "a", "mode": "fa')
+    assert not viable(SCHEMA, '{"name": "a", "mode": "fx')
+    assert not viable(SCHEMA, '{"nam": ')
+    assert not complete(SCHEMA, '{"name": "a", "count": 1')
+
+def test_response_format_schema():
+    assert response_format_schema(None) is None
+    assert response_format_schema({"type": "text"}) is None
+    assert response_format_schema({"type": "json_object"}) == {"type": "object"}
+    assert response_format_schema({"type": "json_schema", "json_schema": {"schema": SCHEMA}}) is SCHEMA
+    with pytest.raises(ValueError):
+        response_format_schema({"type": "xml"})
+
+def test_example_instance_has_the_required_fields():
+    assert example_instance(SCHEMA) == {"name": "", "count": 0}
+    schema = {"type": "object", "required": ["n", "mode"], "properties": {"n": {"type": "number"}, "mode": {"enum": ["fast"]}}}
+    assert complete(schema, json.dumps(example_instance(schema)))
+
+class Tokenizer:
+    """Minimal tokenizer: ids map to fixed strings, id 0 is end-of-sequence"""
+
+    def __init__(self, pieces):
+        self.pieces = pieces
+        self.all_special_ids = [0]
+        self.eos_token_id = 0
+
+    def __len__(self):
+        return len(self.pieces)
+
+    def convert_ids_to_tokens(self, token_id):
+        return self.pieces[token_id]
+
+    def convert_tokens_to_string(self, tokens):
+        return "".join(tokens)
+
+def test_allowed_tokens_filters_ranked_candidates():
+    tokenizer = Tokenizer(["</s>", "{", '"name"', '"count"', "}", ":", " 1", '"x"', ","])
+    vocabulary = token_strings(tokenizer)
+    acceptor = JsonSchemaAcceptor(SCHEMA)
+    state = acceptor.advance(acceptor.initial(), "{")
+    assert allowed_tokens(acceptor, state, vocabulary, list(range(len(vocabulary)))) == [2, 3]
+    state = acceptor.advance(state, '"count":')
+    assert allowed_tokens(acceptor, state, vocabulary, list(range(len(vocabulary)))) == [6]
+
+def test_token_strings_are_cached_per_tokenizer_and_released_with_it():
+    first = Tokenizer(["</s>", "a", "b"])
+    assert token_strings(first) == [None, "a", "b"]
+    assert token_strings(first) is token_strings(first)
+    second = Tokenizer(["</s>", "c"])
+    assert token_strings(second) == [None, "c"]
+    del first, second
+    gc.collect()
+    assert len(structured_output._token_string_cache) == 0
@@ -0,0 +1,76 @@
+"""Request tracing: X-Request-ID propagation, Server-Timing spans and the /admin/profile access check"""
+import time
+
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+import tracing
+from tracing import install_profiling, install_tracing, merge_server_timing, propagation_headers, record_span
+
+def traced_app():
+    app = FastAPI()
+    install_tracing(app)
+    install_profiling(app)
+
+    @app.get("/work")
+    async def work():
+        record_span("retrieval", time.perf_counter(), 0.0125)
+        merge_server_timing("total;dur=40.5, generate;dur=38", "ai")
+        return {"downstream": propagation_headers(), "request_id": tracing.current_request_id.get()}
+
+    return app
+
+def from_host(app, host):
+    """ASGI wrapper that makes requests look like they come from host"""
+    async def wrapped(scope, receive, send):
+        if scope["type"] == "http":
+            scope = {**scope, "client": (host, 50000)}
+        await app(scope, receive, send)
+    return wrapped
+
+def test_request_id_is_kept_and_passed_downstream():
+    client = TestClient(traced_app())
+    response = client.get("/work", headers={"X-Request-ID": "req-123"})
+    assert response.headers["X-Request-ID"] == "req-123"
+    assert response.json() == {"downstream": {"X-Request-ID": "req-123"}, "request_id": "req-123"}
+    assert "Server-Timing" not in response.headers
+
+    generated = client.get("/work")
+    request_id = generated.headers["X-Request-ID"]
+    assert len(request_id) == 32 and generated.json()["request_id"] == request_id
+    assert client.get("/work").headers["X-Request-ID"] != request_id
+    assert tracing.current_request_id.get() is None
+
+def test_debug_trace_returns_server_timing():
+    response = TestClient(traced_app()).get("/work", headers={"X-Debug-Trace": "1"})
+    assert response.json()["downstream"] == {"X-Request-ID": response.headers["X-Request-ID"], "X-Debug-Trace": "1"}
+    entries = [entry.strip() for entry in response.headers["Server-Timing"].split(",")]
+    assert entries[0].startswith("total;dur=")
+    assert entries[1:] == ["retrieval;dur=12.50", "ai.total;dur=40.50", "ai.generate;dur=38.00"]
+    assert tracing.current_trace.get() is None
+
+@pytest.mark.parametrize("host, token, sent, status", [
+    ("127.0.0.1", None, None, 200),
+    ("::1", None, None, 200),
+    ("10.0.0.8", None, None, 403),
+    ("10.0.0.8", "secret", "secret", 200),
+    ("10.0.0.8", "secret", "wrong", 403),
+    ("127.0.0.1", "secret", None, 403)
+])
+def test_profile_requires_localhost_or_the_admin_token(monkeypatch, host, token, sent, status):
+    if token:
+        monkeypatch.setenv("ADMIN_TOKEN", token)
+    else:
+        monkeypatch.delenv("ADMIN_TOKEN", raising=False)
+    client = TestClient(from_host(traced_app(), host))
+    headers = {"X-Admin-Token": sent} if sent else {}
+    response = client.post("/admin/profile", params={"seconds": 0.05, "mode": "cprofile"}, headers=headers)
+    assert response.status_code == status
+    if status == 200:
+        assert "function calls" in response.text
+
+def test_profile_validates_its_arguments():
+    client = TestClient(from_host(traced_app(), "127.0.0.1"))
+    assert client.post("/admin/profile", params={"seconds": 0}).status_code == 400
+    assert client.post("/admin/profile", params={"seconds": 0.01, "mode": "trace"}).status_code == 400
@@ -0,0 +1,138 @@
+"""Flat vector store: where filters, upsert/delete/compact and crash recovery"""
+import numpy as np
+import pytest
+
+import vector_store
+from vector_store import FlatVectorStore, matches_where
+
+def unit(*values):
+    vector = np.asarray(values, dtype=np.float32)
+    return vector / np.linalg.norm(vector)
+
+@pytest.fixture
+def collection(tmp_path):
+    collection = FlatVectorStore(str(tmp_path), dtype="float16").get_or_create_collection("c")
+    collection.upsert(
+        ids=["a", "b", "c", "d"],
+        embeddings=[unit(1, 0, 0), unit(0.9, 0.1, 0), unit(0, 1, 0), unit(0, 0, 1)],
+        documents=["alpha", "beta", "gamma", "delta"],
+        metadatas=[
+            {"kind": "file", "path": "a.py"},
+            {"kind": "file", "path": "b.py"},
+            {"kind": "snippet", "path": ""},
+            {"kind": "file", "path": "d.py", "language": "python"}
+        ]
+    )
+    return collection
+
+WHERE_CLAUSES = [
+    None,
+    {"kind": "file"},
+    {"kind": {"$eq": "snippet"}},
+    {"kind": {"$ne": "file"}},
+    {"path": {"$in": ["a.py", "d.py", "missing.py"]}},
+    {"path": {"$nin": ["a.py"]}},
+    {"language": "python"},
+    {"language": {"$ne": "python"}},
+    {"language": None},
+    {"$and": [{"kind": "file"}, {"path": {"$ne": "b.py"}}]},
+    {"$or": [{"kind": "snippet"}, {"path": "b.py"}]},
+    {"kind": "nothing"}
+]
+
+@pytest.mark.parametrize("where", WHERE_CLAUSES)
+def test_where_filters_agree_with_matches_where(collection, where):
+    expected = [doc_id for doc_id, metadata in zip("abcd", collection.get()["metadatas"]) if matches_where(metadata, where)]
+    assert collection.get(where=where)["ids"] == expected
+    hits = collection.query([unit(1, 1, 1)], n_results=10, where=where)["ids"][0]
+    assert sorted(hits) == expected
+
+def test_query_ranks_by_similarity_and_respects_where(collection):
+    result = collection.query([unit(1, 0, 0)], n_results=2)
+    assert result["ids"][0] == ["a", "b"]
+    assert result["documents"][0] == ["alpha", "beta"]
+    assert collection.query([unit(1, 0, 0)], n_results=2, where={"kind": "snippet"})["ids"][0] == ["c"]
+
+def test_upsert_replaces_metadata_in_the_filter_index(collection):
+    collection.upsert(ids=["a"], embeddings=[unit(1, 0, 0)], documents=["alpha2"], metadatas=[{"kind": "snippet", "path": ""}])
+    assert collection.get(where={"kind": "snippet"})["ids"] == ["c", "a"]
+    assert "a" not in collection.get(where={"kind": "file"})["ids"]
+    assert collection.count() == 4
+
+def test_delete_by_where_and_compact(collection):
+    collection.delete(where={"kind": "file", "path": {"$ne": "d.py"}})
+    assert sorted(collection.get()["ids"]) == ["c", "d"]
+    assert collection.compact() == {"removed": 2, "kept": 2}
+    assert collection.get(where={"kind": "file"})["ids"] == ["d"]
+    assert collection.query([unit(0, 0, 1)], n_results=1)["ids"][0] == ["d"]
+
+def test_reload_replays_the_log(tmp_path, collection):
+    collection.delete(ids=["b"])
+    reopened = FlatVectorStore(str(tmp_path)).get_collection("c")
+    assert reopened.get(where={"kind": "file"})["ids"] == ["a", "d"]
+    np.testing.assert_allclose(reopened.get(ids=["d"], include=["embeddings"])["embeddings"][0], unit(0, 0, 1), atol=1e-3)
+
+def test_torn_last_log_line_is_dropped_on_load(tmp_path, collection):
+    log_path = tmp_path / "c" / "entries.jsonl"
+    vectors_path = tmp_path / "c" / "vectors.bin"
+    # A crash during an upsert: vectors written, the log line cut off
+    with open(vectors_path, "ab") as f:
+        f.write(np.zeros(3, dtype=np.float16).tobytes())
+    with open(log_path, "a") as f:
+        f.write('{"id": "e", "row": 4, "meta')
+    reopened = FlatVectorStore(str(tmp_path)).get_collection("c")
+    assert reopened.count() == 4
+    assert log_path.read_text().endswith("\n")
+    assert vectors_path.stat().st_size == 4 * 3 * 2
+    reopened.upsert(ids=["e"], embeddings=[unit(1, 1, 0)], metadatas=[{"kind": "file"}])
+    assert FlatVectorStore(str(tmp_path)).get_collection("c").count() == 5
+
+def test_corrupt_line_inside_the_log_still_fails(tmp_path, collection):
+    log_path = tmp_path / "c" / "entries.jsonl"
+    log_path.write_text("not json\n" + log_path.read_text())
+    with pytest.raises(ValueError):
+        FlatVectorStore(str(tmp_path)).get_collection("c").count()
+
+def test_auto_compaction_keeps_filters_consistent(tmp_path, monkeypatch):
+    monkeypatch.setattr(vector_store, "COMPACT_MIN_ROWS", 4)
+    collection = FlatVectorStore(str(tmp_path), dtype="int8").get_or_create_collection("c")
+    collection.upsert(ids=list("abcd"), embeddings=np.eye(4), metadatas=[{"n": i % 2} for i in range(4)])
+    collection.delete(ids=["a", "b"])
+    assert len(collection._entries) == 2
+    assert collection.get(where={"n": 1})["ids"] == ["d"]
+
+def test_compaction_interrupted_between_renames_is_finished_on_open(tmp_path, collection, monkeypatch):
+    collection.delete(ids=["a", "b"])
+    real_replace = vector_store.os.replace
+    calls = []
+
+    def crash_on_second_rename(source, target):
+        calls.append(target)
+        if len(calls) == 2:
+            raise OSError("power lost")
+        real_replace(source, target)
+
+    monkeypatch.setattr(vector_store.os, "replace", crash_on_second_rename)
+    with pytest.raises(OSError):
+        collection.compact()
+    monkeypatch.setattr(vector_store.os, "replace", real_replace)
+    assert not (tmp_path / "c").exists()
+
+    reopened = FlatVectorStore(str(tmp_path)).get_collection("c")
+    assert sorted(reopened.get()["ids"]) == ["c", "d"]
+    assert len(reopened._entries) == 2
+    assert sorted(item.name for item in tmp_path.iterdir()) == ["c"]
+
+def test_compaction_without_a_finished_copy_is_rolled_back(tmp_path, collection):
+    collection.delete(ids=["a"])
+    (tmp_path / "c").rename(tmp_path / "c.old")
+    reopened = FlatVectorStore(str(tmp_path)).get_collection("c")
+    assert sorted(reopened.get()["ids"]) == ["b", "c", "d"]
+    assert sorted(item.name for item in tmp_path.iterdir()) == ["c"]
+
+def test_leftover_partial_copy_is_discarded(tmp_path, collection):
+    (tmp_path / "c.compact").mkdir()
+    (tmp_path / "c.compact" / "vectors.bin").write_bytes(b"partial")
+    store = FlatVectorStore(str(tmp_path))
+    assert store.get_collection("c").count() == 4
+    assert sorted(item.name for item in tmp_path.iterdir()) == ["c"]
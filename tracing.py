@@ -0,0 +1,168 @@
+"""
+Per-request span tracing and on-demand profiling hooks
+"""
+import io
+import os
+import sys
+import time
+import uuid
+import pstats
+import asyncio
+import cProfile
+import threading
+from collections import Counter
+from contextvars import ContextVar
+from typing import List, Dict, Any, Optional
+
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.responses import PlainTextResponse
+
+REQUEST_ID_HEADER = "X-Request-ID"
+TRACE_HEADER = "X-Debug-Trace"
+
+class Trace:
+    """Spans recorded for one request that opted in with the X-Debug-Trace header"""
+
+    def __init__(self, request_id: str):
+        self.request_id = request_id
+        self.started = time.perf_counter()
+        self.spans: List[Dict[str, Any]] = []
+
+    def add(self, name: str, start: Optional[float], duration: float):
+        self.spans.append({
+            "name": name,
+            "start_ms": round((start - self.started) * 1000, 2) if start is not None else None,
+            "duration_ms": round(duration * 1000, 2)
+        })
+
+    def server_timing(self) -> str:
+        """Render spans as a Server-Timing header value"""
+        total = (time.perf_counter() - self.started) * 1000
+        entries = [f"total;dur={total:.2f}"]
+        entries.extend(f"{span['name']};dur={span['duration_ms']:.2f}" for span in self.spans)
+        return ", ".join(entries)
+
+# Request id for log correlation and propagation; set for every request
+current_request_id: ContextVar[Optional[str]] = ContextVar("current_request_id", default=None)
+
+# Active trace; None unless the caller asked for one, so recording costs nothing otherwise
+current_trace: ContextVar[Optional[Trace]] = ContextVar("current_trace", default=None)
+
+def record_span(name: str, start: float, duration: float):
+    """Attach a span to the active trace, if any"""
+    trace = current_trace.get()
+    if trace is not None:
+        trace.add(name, start, duration)
+
+def propagation_headers() -> Dict[str, str]:
+    """Headers that carry the request id (and trace opt-in) to a downstream service"""
+    headers = {}
+    request_id = current_request_id.get()
+    if request_id:
+        headers[REQUEST_ID_HEADER] = request_id
+    if current_trace.get() is not None:
+        headers[TRACE_HEADER] = "1"
+    return headers
+
+def merge_server_timing(header: Optional[str], prefix: str):
+    """Add a downstream service's Server-Timing entries to the active trace"""
+    trace = current_trace.get()
+    if trace is None or not header:
+        return
+    for entry in header.split(","):
+        name, _, params = entry.strip().partition(";")
+        for param in params.split(";"):
+            key, _, value = param.partition("=")
+            if key.strip() == "dur":
+                try:
+                    trace.add(f"{prefix}.{name}", None, float(value) / 1000)
+                except ValueError:
+                    pass
+
+def install_tracing(app: FastAPI):
+    """Propagate X-Request-ID and return Server-Timing spans when X-Debug-Trace is set"""
+
+    @app.middleware("http")
+    async def trace_request(request: Request, call_next):
+        request_id = request.headers.get(REQUEST_ID_HEADER) or uuid.uuid4().hex
+        id_token = current_request_id.set(request_id)
+        trace = Trace(request_id) if request.headers.get(TRACE_HEADER) else None
+        trace_token = current_trace.set(trace)
+        try:
+            response = await call_next(request)
+        finally:
+            current_trace.reset(trace_token)
+            current_request_id.reset(id_token)
+        response.headers[REQUEST_ID_HEADER] = request_id
+        if trace is not None:
+            response.headers["Server-Timing"] = trace.server_timing()
+        return response
+
+def _frame_label(frame) -> str:
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+def sample_stacks(seconds: float, interval: float) -> Counter:
+    """Sample every thread's stack; returns folded stacks mapped to sample counts"""
+    counts: Counter = Counter()
+    sampler_id = threading.get_ident()
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline:
+        names = {thread.ident: thread.name for thread in threading.enumerate()}
+        for thread_id, frame in sys._current_frames().items():
+            if thread_id == sampler_id:
+                continue
+            stack = []
+            while frame is not None:
+                stack.append(_frame_label(frame))
+                frame = frame.f_back
+            stack.append(names.get(thread_id, str(thread_id)))
+            counts[";".join(reversed(stack))] += 1
+        time.sleep(interval)
+    return counts
+
+_profile_lock = asyncio.Lock()
+
+def install_profiling(app: FastAPI):
+    """Add POST /admin/profile, which profiles the process for a few seconds
+
+    mode=sample (default) returns folded stacks for flamegraph.pl/speedscope;
+    mode=cprofile returns pstats output for the event loop thread. Nothing runs
+    until the endpoint is called. Requests must carry X-Admin-Token matching
+    ADMIN_TOKEN, or come from localhost when ADMIN_TOKEN is unset.
+    """
+
+    @app.post("/admin/profile", response_class=PlainTextResponse)
+    async def profile(request: Request, seconds: float = 10.0, mode: str = "sample", interval_ms: float = 5.0):
+        """Profile the server for N seconds and return a flamegraph-compatible dump"""
+        admin_token = os.getenv("ADMIN_TOKEN")
+        if admin_token:
+            if request.headers.get("X-Admin-Token") != admin_token:
+                raise HTTPException(status_code=403, detail="Invalid admin token")
+        elif request.client is None or request.client.host not in ("127.0.0.1", "::1", "localhost"):
+            raise HTTPException(status_code=403, detail="Profiling is only available from localhost")
+
+        if not 0 < seconds <= 120:
+            raise HTTPException(status_code=400, detail="seconds must be between 0 and 120")
+        if _profile_lock.locked():
+            raise HTTPException(status_code=409, detail="A profile is already running")
+
+        async with _profile_lock:
+            if mode == "sample":
+                loop = asyncio.get_running_loop()
+                counts = await loop.run_in_executor(None, sample_stacks, seconds, interval_ms / 1000)
+                return "\n".join(f"{stack} {count}" for stack, count in counts.most_common())
+
+            elif mode == "cprofile":
+                profiler = cProfile.Profile()
+                profiler.enable()
+                try:
+                    await asyncio.sleep(seconds)
+                finally:
+                    profiler.disable()
+                output = io.StringIO()
+                pstats.Stats(profiler, stream=output).sort_stats("cumulative").print_stats(100)
+                return output.getvalue()
+
+            else:
+                raise HTTPException(status_code=400, detail="mode must be 'sample' or 'cprofile'")
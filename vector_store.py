@@ -0,0 +1,545 @@
+"""
+Memory-mapped flat vector index: a lightweight alternative to Chroma
+
+Each collection is a directory holding an append-only matrix of quantized
+embeddings (float16, or int8 with a per-row scale), an append-only document
+file and a JSONL log of ids/metadata and tombstones. Nothing is read until the
+collection is first used, and the matrix is memory-mapped, so opening is
+instant and resident memory stays small until queries touch the pages.
+
+The client and collection classes mirror the subset of the chromadb API the
+main server uses, so either store can sit behind get_relevant_context and
+store_code_context.
+"""
+import os
+import json
+import shutil
+import logging
+import threading
+from pathlib import Path
+from typing import List, Dict, Any, Optional, Sequence
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Rows scored per block, bounding the float32 working set of a query
+QUERY_BLOCK_ROWS = 65536
+
+# Rewrite a collection once this share of its rows is dead (and it has enough rows to matter)
+COMPACT_DEAD_RATIO = 0.3
+COMPACT_MIN_ROWS = 1000
+
+DTYPES = ("float16", "int8")
+
+# Directories next to a collection while compact() swaps in the rewritten copy
+COMPACT_SUFFIX = ".compact"
+OLD_SUFFIX = ".old"
+
+def _fsync(path: Path):
+    """Flush a file's or directory's contents to disk"""
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+def recover_interrupted_compaction(directory: Path):
+    """Finish or roll back a compaction that stopped part way through its swap
+
+    compact() writes and syncs the new copy in <name>.compact, renames the live
+    directory to <name>.old, then renames the copy into place. Without a live
+    directory the crash came between the renames: the copy is complete, so it
+    is moved in (or, if it is missing, the old directory is moved back).
+    Leftovers next to a live directory are simply removed.
+    """
+    compacted = directory.with_name(directory.name + COMPACT_SUFFIX)
+    old = directory.with_name(directory.name + OLD_SUFFIX)
+    if not directory.exists():
+        if compacted.exists() and (compacted / "manifest.json").exists():
+            logger.warning(f"Finishing interrupted compaction of flat collection {directory.name}")
+            os.replace(compacted, directory)
+        elif old.exists():
+            logger.warning(f"Rolling back interrupted compaction of flat collection {directory.name}")
+            os.replace(old, directory)
+        else:
+            return
+        _fsync(directory.parent)
+    shutil.rmtree(compacted, ignore_errors=True)
+    shutil.rmtree(old, ignore_errors=True)
+
+def matches_where(metadata: Dict[str, Any], where: Optional[Dict[str, Any]]) -> bool:
+    """Evaluate a Chroma-style where filter ($and/$or, $eq/$ne/$in/$nin or plain equality)"""
+    if not where:
+        return True
+    for key, condition in where.items():
+        if key == "$and":
+            if not all(matches_where(metadata, clause) for clause in condition):
+                return False
+        elif key == "$or":
+            if not any(matches_where(metadata, clause) for clause in condition):
+                return False
+        elif isinstance(condition, dict):
+            value = metadata.get(key)
+            for operator, operand in condition.items():
+                if operator == "$eq" and value != operand:
+                    return False
+                if operator == "$ne" and value == operand:
+                    return False
+                if operator == "$in" and value not in operand:
+                    return False
+                if operator == "$nin" and value in operand:
+                    return False
+        elif metadata.get(key) != condition:
+            return False
+    return True
+
+class FlatCollection:
+    """One collection: quantized vectors, documents and an id/metadata log on disk"""
+
+    def __init__(self, directory: Path, name: str, metadata: Optional[Dict[str, Any]] = None, dtype: str = "int8"):
+        self.directory = directory
+        self.name = name
+        self.metadata = metadata or {}
+        self.dtype = dtype
+        self.dimension: Optional[int] = None
+        self._lock = threading.RLock()
+        self._loaded = False
+        self._rows: Dict[str, int] = {}  # live id -> row
+        self._entries: List[Optional[Dict[str, Any]]] = []  # row -> {"id", "row", "metadata", "offset", "length"}, None when dead
+        self._live = bytearray()  # row -> 1 while live, viewed as a bool mask when querying
+        self._postings: Dict[str, Dict[Any, set]] = {}  # metadata field -> value -> live rows, for where filters
+        self._vectors: Optional[np.memmap] = None
+        self._scales: Optional[np.memmap] = None
+        self._mapped_rows = 0
+
+    # Files
+
+    @property
+    def _vectors_path(self) -> Path:
+        return self.directory / "vectors.bin"
+
+    @property
+    def _scales_path(self) -> Path:
+        return self.directory / "scales.bin"
+
+    @property
+    def _documents_path(self) -> Path:
+        return self.directory / "documents.bin"
+
+    @property
+    def _log_path(self) -> Path:
+        return self.directory / "entries.jsonl"
+
+    def _write_manifest(self):
+        manifest = {"name": self.name, "metadata": self.metadata, "dtype": self.dtype, "dimension": self.dimension}
+        tmp_path = self.directory / "manifest.json.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(manifest, f)
+        os.replace(tmp_path, self.directory / "manifest.json")
+
+    def _load(self):
+        # Replay the log on first use; opening the collection reads nothing
+        if self._loaded:
+            return
+        with self._lock:
+            if self._loaded:
+                return
+            if self._log_path.exists():
+                with open(self._log_path, "rb") as f:
+                    offset = 0
+                    for line in f:
+                        if line.strip():
+                            try:
+                                record = json.loads(line)
+                            except ValueError:
+                                if line.endswith(b"\n"):
+                                    raise
+                                # A crash mid-append leaves a partial last line; its rows are dropped below
+                                logger.warning(f"Dropping incomplete last log entry of flat collection {self.name}")
+                                os.truncate(self._log_path, offset)
+                                break
+                            if record.get("deleted"):
+                                self._kill(record["id"])
+                            else:
+                                self._place(record)
+                        offset += len(line)
+            # Drop rows written before a crash but never logged
+            if self.dimension is not None:
+                self._truncate(self._vectors_path, len(self._entries) * self.dimension * np.dtype(self.dtype).itemsize)
+                if self.dtype == "int8":
+                    self._truncate(self._scales_path, len(self._entries) * 4)
+            self._loaded = True
+
+    def _truncate(self, path: Path, size: int):
+        if path.exists() and path.stat().st_size > size:
+            os.truncate(path, size)
+
+    def _kill(self, doc_id: str):
+        row = self._rows.pop(doc_id, None)
+        if row is not None:
+            for field, value in self._entries[row]["metadata"].items():
+                rows = self._postings[field][value]
+                rows.discard(row)
+                if not rows:
+                    del self._postings[field][value]
+            self._entries[row] = None
+            self._live[row] = 0
+
+    def _place(self, record: Dict[str, Any]):
+        self._kill(record["id"])
+        row = record["row"]
+        if row >= len(self._entries):
+            missing = row + 1 - len(self._entries)
+            self._entries.extend([None] * missing)
+            self._live.extend(b"\0" * missing)
+        self._entries[row] = record
+        self._live[row] = 1
+        self._rows[record["id"]] = row
+        for field, value in record["metadata"].items():
+            self._postings.setdefault(field, {}).setdefault(value, set()).add(row)
+
+    def _rows_mask(self, rows) -> np.ndarray:
+        mask = np.zeros(len(self._entries), dtype=bool)
+        if rows:
+            mask[np.fromiter(rows, dtype=np.int64, count=len(rows))] = True
+        return mask
+
+    def _equal_mask(self, field: str, values) -> np.ndarray:
+        postings = self._postings.get(field, {})
+        rows = set()
+        for value in values:
+            rows.update(postings.get(value, ()))
+        return self._rows_mask(rows)
+
+    def _where_mask(self, where: Optional[Dict[str, Any]]) -> np.ndarray:
+        """Rows matching a where filter, from the per-field postings rather than a scan of every row"""
+        live = np.frombuffer(bytes(self._live), dtype=bool)
+        if not where:
+            return live
+        mask = live.copy()
+        for key, condition in where.items():
+            if key == "$and":
+                for clause in condition:
+                    mask &= self._where_mask(clause)
+            elif key == "$or":
+                any_clause = np.zeros(len(mask), dtype=bool)
+                for clause in condition:
+                    any_clause |= self._where_mask(clause)
+                mask &= any_clause
+            else:
+                operators = condition if isinstance(condition, dict) else {"$eq": condition}
+                for operator, operand in operators.items():
+                    if operator in ("$eq", "$in", "$ne", "$nin"):
+                        values = operand if operator in ("$in", "$nin") else [operand]
+                        if None in values:
+                            # Rows without the field compare equal to None; only a scan finds them
+                            mask &= self._scan_mask({key: {operator: operand}})
+                        elif operator in ("$eq", "$in"):
+                            mask &= self._equal_mask(key, values)
+                        else:
+                            mask &= ~self._equal_mask(key, values)
+        return mask
+
+    def _scan_mask(self, where: Dict[str, Any]) -> np.ndarray:
+        return np.array([entry is not None and matches_where(entry["metadata"], where) for entry in self._entries], dtype=bool)
+
+    def _matrix(self):
+        # Remap only when rows were appended since the last query
+        total = len(self._entries)
+        if self._vectors is None or self._mapped_rows != total:
+            if total == 0 or self.dimension is None:
+                return None, None
+            self._vectors = np.memmap(self._vectors_path, dtype=self.dtype, mode="r", shape=(total, self.dimension))
+            if self.dtype == "int8":
+                self._scales = np.memmap(self._scales_path, dtype=np.float32, mode="r", shape=(total,))
+            self._mapped_rows = total
+        return self._vectors, self._scales
+
+    def _quantize(self, embeddings: np.ndarray):
+        if self.dtype == "int8":
+            scales = np.abs(embeddings).max(axis=1) / 127.0
+            scales[scales == 0] = 1.0
+            return np.round(embeddings / scales[:, None]).astype(np.int8), scales.astype(np.float32)
+        return embeddings.astype(np.float16), None
+
+    def _dequantize(self, rows: np.ndarray) -> np.ndarray:
+        vectors, scales = self._matrix()
+        block = np.asarray(vectors[rows], dtype=np.float32)
+        if scales is not None:
+            block *= np.asarray(scales[rows])[:, None]
+        return block
+
+    def _read_documents(self, entries: Sequence[Dict[str, Any]]) -> List[Optional[str]]:
+        if not self._documents_path.exists():
+            return [None] * len(entries)
+        documents = []
+        with open(self._documents_path, "rb") as f:
+            for entry in entries:
+                if entry.get("length") is None:
+                    documents.append(None)
+                    continue
+                f.seek(entry["offset"])
+                documents.append(f.read(entry["length"]).decode("utf-8"))
+        return documents
+
+    # Chroma-compatible API
+
+    def count(self) -> int:
+        self._load()
+        return len(self._rows)
+
+    def add(self, ids: List[str], embeddings, documents: Optional[List[str]] = None, metadatas: Optional[List[Dict[str, Any]]] = None):
+        self.upsert(ids=ids, embeddings=embeddings, documents=documents, metadatas=metadatas)
+
+    def upsert(self, ids: List[str], embeddings, documents: Optional[List[str]] = None, metadatas: Optional[List[Dict[str, Any]]] = None):
+        """Append rows; a re-used id tombstones its previous row"""
+        if not ids:
+            return
+        self._load()
+        matrix = np.asarray(embeddings, dtype=np.float32)
+        with self._lock:
+            if self.dimension is None:
+                self.dimension = int(matrix.shape[1])
+                self._write_manifest()
+            elif matrix.shape[1] != self.dimension:
+                raise ValueError(f"Embedding dimension {matrix.shape[1]} does not match collection dimension {self.dimension}")
+
+            # Rows continue after the last logged row; the log is written last, so a
+            # crash mid-write leaves only unreferenced bytes that _load truncates
+            first_row = len(self._entries)
+            quantized, scales = self._quantize(matrix)
+            with open(self._vectors_path, "ab") as f:
+                f.write(quantized.tobytes())
+            if scales is not None:
+                with open(self._scales_path, "ab") as f:
+                    f.write(scales.tobytes())
+
+            records = []
+            with open(self._documents_path, "ab") as f:
+                offset = f.tell()
+                for i, doc_id in enumerate(ids):
+                    record = {"id": doc_id, "row": first_row + i, "metadata": (metadatas[i] if metadatas else None) or {}}
+                    if documents is not None and documents[i] is not None:
+                        data = documents[i].encode("utf-8")
+                        f.write(data)
+                        record["offset"], record["length"] = offset, len(data)
+                        offset += len(data)
+                    records.append(record)
+
+            with open(self._log_path, "a") as f:
+                for record in records:
+                    f.write(json.dumps(record) + "\n")
+                    self._place(record)
+        self._maybe_compact()
+
+    def delete(self, ids: Optional[List[str]] = None, where: Optional[Dict[str, Any]] = None):
+        """Tombstone rows by id and/or metadata filter"""
+        self._load()
+        with self._lock:
+            targets = set(ids or [])
+            if where:
+                targets.update(self._entries[row]["id"] for row in np.flatnonzero(self._where_mask(where)))
+            targets = [doc_id for doc_id in targets if doc_id in self._rows]
+            if not targets:
+                return
+            with open(self._log_path, "a") as f:
+                for doc_id in targets:
+                    f.write(json.dumps({"id": doc_id, "deleted": True}) + "\n")
+                    self._kill(doc_id)
+        self._maybe_compact()
+
+    def get(
+        self,
+        ids: Optional[List[str]] = None,
+        where: Optional[Dict[str, Any]] = None,
+        limit: Optional[int] = None,
+        include: Sequence[str] = ("metadatas", "documents")
+    ) -> Dict[str, Any]:
+        self._load()
+        with self._lock:
+            mask = self._where_mask(where)
+            if ids is not None:
+                rows = [row for row in (self._rows[doc_id] for doc_id in ids if doc_id in self._rows) if mask[row]][:limit]
+            else:
+                rows = np.flatnonzero(mask)[:limit].tolist()
+            entries = [self._entries[row] for row in rows]
+            result: Dict[str, Any] = {"ids": [entry["id"] for entry in entries]}
+            result["metadatas"] = [entry["metadata"] for entry in entries] if "metadatas" in include else None
+            result["documents"] = self._read_documents(entries) if "documents" in include else None
+            result["embeddings"] = (
+                self._dequantize(np.array(rows, dtype=np.int64)) if rows else np.zeros((0, self.dimension or 0), dtype=np.float32)
+            ) if "embeddings" in include else None
+            return result
+
+    def query(
+        self,
+        query_embeddings,
+        n_results: int = 10,
+        where: Optional[Dict[str, Any]] = None,
+        include: Sequence[str] = ("metadatas", "documents", "distances")
+    ) -> Dict[str, Any]:
+        """Exact top-k by cosine similarity; distances are squared L2 like Chroma's default"""
+        self._load()
+        queries = np.asarray(query_embeddings, dtype=np.float32)
+        with self._lock:
+            vectors, scales = self._matrix()
+            allowed = self._where_mask(where)
+            k = min(n_results, int(allowed.sum()))
+            result: Dict[str, Any] = {"ids": [], "metadatas": [], "documents": [], "distances": []}
+            if vectors is None or k == 0:
+                for _ in queries:
+                    for field in result:
+                        result[field].append([])
+                return result
+
+            # Keep each block's top k so memory stays bounded by the block size
+            candidate_rows, candidate_scores = [], []
+            for start in range(0, len(allowed), QUERY_BLOCK_ROWS):
+                end = min(len(allowed), start + QUERY_BLOCK_ROWS)
+                scores = queries @ np.asarray(vectors[start:end], dtype=np.float32).T
+                if scales is not None:
+                    scores *= np.asarray(scales[start:end])
+                scores[:, ~allowed[start:end]] = -np.inf
+                block_k = min(k, end - start)
+                top = np.argpartition(-scores, block_k - 1, axis=1)[:, :block_k]
+                candidate_rows.append(top + start)
+                candidate_scores.append(np.take_along_axis(scores, top, axis=1))
+            rows = np.concatenate(candidate_rows, axis=1)
+            scores = np.concatenate(candidate_scores, axis=1)
+            order = np.argsort(-scores, axis=1)[:, :k]
+            rows = np.take_along_axis(rows, order, axis=1)
+            scores = np.take_along_axis(scores, order, axis=1)
+
+            for query_rows, query_scores in zip(rows, scores):
+                entries = [self._entries[row] for row, score in zip(query_rows, query_scores) if score > -np.inf]
+                result["ids"].append([entry["id"] for entry in entries])
+                result["metadatas"].append([entry["metadata"] for entry in entries])
+                result["documents"].append(self._read_documents(entries) if "documents" in include else [])
+                result["distances"].append([float(2 - 2 * score) for score in query_scores[:len(entries)]])
+            return result
+
+    # Maintenance
+
+    def _maybe_compact(self):
+        total = len(self._entries)
+        dead = total - len(self._rows)
+        if total >= COMPACT_MIN_ROWS and dead / total >= COMPACT_DEAD_RATIO:
+            self.compact()
+
+    def compact(self) -> Dict[str, int]:
+        """Rewrite the collection without dead rows"""
+        self._load()
+        with self._lock:
+            live = [row for row, entry in enumerate(self._entries) if entry is not None]
+            removed = len(self._entries) - len(live)
+            if removed == 0:
+                return {"removed": 0, "kept": len(live)}
+
+            entries = [self._entries[row] for row in live]
+            documents = self._read_documents(entries)
+            vectors, scales = self._matrix()
+            tmp = self.directory.with_name(self.directory.name + COMPACT_SUFFIX)
+            shutil.rmtree(tmp, ignore_errors=True)
+            tmp.mkdir(parents=True)
+            rows = np.array(live, dtype=np.int64)
+            with open(tmp / "vectors.bin", "wb") as f:
+                for start in range(0, len(rows), QUERY_BLOCK_ROWS):
+                    f.write(np.asarray(vectors[rows[start:start + QUERY_BLOCK_ROWS]]).tobytes())
+            if scales is not None:
+                with open(tmp / "scales.bin", "wb") as f:
+                    f.write(np.asarray(scales[rows]).tobytes())
+
+            records = []
+            offset = 0
+            with open(tmp / "documents.bin", "wb") as f:
+                for row, (entry, document) in enumerate(zip(entries, documents)):
+                    record = {"id": entry["id"], "row": row, "metadata": entry["metadata"]}
+                    if document is not None:
+                        data = document.encode("utf-8")
+                        f.write(data)
+                        record["offset"], record["length"] = offset, len(data)
+                        offset += len(data)
+                    records.append(record)
+            with open(tmp / "entries.jsonl", "w") as f:
+                for record in records:
+                    f.write(json.dumps(record) + "\n")
+            shutil.copy(self.directory / "manifest.json", tmp / "manifest.json")
+            # The copy must be on disk before the live directory moves aside
+            for item in tmp.iterdir():
+                _fsync(item)
+            _fsync(tmp)
+
+            # Swap directories (recover_interrupted_compaction completes a swap cut short), then drop the old mapping
+            self._vectors = self._scales = None
+            old = self.directory.with_name(self.directory.name + OLD_SUFFIX)
+            shutil.rmtree(old, ignore_errors=True)
+            os.replace(self.directory, old)
+            os.replace(tmp, self.directory)
+            _fsync(self.directory.parent)
+            shutil.rmtree(old, ignore_errors=True)
+
+            self._entries, self._rows, self._live, self._postings = [], {}, bytearray(), {}
+            for record in records:
+                self._place(record)
+            self._mapped_rows = 0
+            logger.info(f"Compacted flat collection {self.name}: removed {removed} rows, kept {len(records)}")
+            return {"removed": removed, "kept": len(records)}
+
+class FlatVectorStore:
+    """Directory of flat collections with the chromadb client methods the server uses"""
+
+    def __init__(self, path: str, dtype: Optional[str] = None):
+        self.path = Path(path)
+        self.path.mkdir(parents=True, exist_ok=True)
+        self.dtype = dtype or os.getenv("FLAT_INDEX_DTYPE", "int8")
+        if self.dtype not in DTYPES:
+            raise ValueError(f"FLAT_INDEX_DTYPE must be one of {', '.join(DTYPES)}")
+        self._collections: Dict[str, FlatCollection] = {}
+        self._lock = threading.Lock()
+        for item in list(self.path.iterdir()):
+            for suffix in (COMPACT_SUFFIX, OLD_SUFFIX):
+                if item.is_dir() and item.name.endswith(suffix):
+                    recover_interrupted_compaction(self.path / item.name[:-len(suffix)])
+
+    def _open(self, name: str) -> Optional[FlatCollection]:
+        directory = self.path / name
+        recover_interrupted_compaction(directory)
+        manifest_path = directory / "manifest.json"
+        if not manifest_path.exists():
+            return None
+        with open(manifest_path, "r") as f:
+            manifest = json.load(f)
+        collection = FlatCollection(directory, name, manifest.get("metadata"), manifest.get("dtype", self.dtype))
+        collection.dimension = manifest.get("dimension")
+        return collection
+
+    def get_collection(self, name: str) -> FlatCollection:
+        with self._lock:
+            collection = self._collections.get(name) or self._open(name)
+            if collection is None:
+                raise ValueError(f"Collection {name} does not exist")
+            self._collections[name] = collection
+            return collection
+
+    def get_or_create_collection(self, name: str, metadata: Optional[Dict[str, Any]] = None) -> FlatCollection:
+        with self._lock:
+            collection = self._collections.get(name) or self._open(name)
+            if collection is None:
+                directory = self.path / name
+                directory.mkdir(parents=True, exist_ok=True)
+                collection = FlatCollection(directory, name, metadata, self.dtype)
+                collection._write_manifest()
+            self._collections[name] = collection
+            return collection
+
+    def delete_collection(self, name: str):
+        with self._lock:
+            self._collections.pop(name, None)
+            directory = self.path / name
+            if not (directory / "manifest.json").exists():
+                raise ValueError(f"Collection {name} does not exist")
+            shutil.rmtree(directory)
+
+    def list_collections(self) -> List[FlatCollection]:
+        return [self.get_collection(item.name) for item in sorted(self.path.iterdir()) if (item / "manifest.json").exists()]